@@ -1,63 +1,395 @@
-from flask import Flask, redirect, url_for, session, jsonify, send_file, send_from_directory, request
-from authlib.integrations.flask_client import OAuth
-from authlib.common.security import generate_token
+'''
+The Flask app: create_app() builds it, every route lives on the `api` blueprint.
+
+Importing this module does no I/O. .env is loaded first, before the modules
+below read their settings at import. create_app(config) builds the
+process's caches, limiters and background workers (init_services) and sets
+the module's plain settings (read_settings) from config layered over the
+environment, under the environment variable names. A few settings are
+process-wide and only come from the environment: LOG_LEVEL and
+LOG_SAMPLE_RATE (logs.py), JSON_BACKEND (serialization.py),
+COMPRESS_MIN_SIZE (compression.py), SSE_HEARTBEAT_SECONDS (asgi.py) and
+the OIDC_* client settings. The MongoDB client and the OIDC client
+are created on first use in each process. warm_up() creates them ahead of
+time and checks MongoDB; gunicorn runs it in every new worker, and GET
+/readyz reports the same check.
+'''
+
+from collections import ChainMap
+
 from dotenv import load_dotenv
+from flask import Blueprint, Flask, Response, current_app, g, redirect, session, jsonify, request, stream_with_context
 from flask_cors import CORS
 from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from werkzeug.local import LocalProxy
+
+# Before the imports below, several of them read settings when they are imported
+load_dotenv()
+
+import atexit
+import logging
 import os
 import json
+import threading
+import time
+import base64
+import functools
+import math
+import urllib.parse
 from bson.objectid import ObjectId
 from datetime import datetime
+from nyt_cache import NYTArticleCache, UpstreamError, NYT_SEARCH_URL, trim_search_response
+from prefetch import ArticlePrefetcher, parse_targets
+from indexes import ensure_indexes, check_query_plans, drop_retired_indexes
+from articles import article_key, backfill_article_keys, to_article_key
+import reply_store
+from article_stats import ActivityBuffer, adjust_count, counted_write, rebuild_article_stats, touch_article
+from sessions import session_interface_from_env
+from ratelimit import client_key, rate_limiter_from_env
+from events import broker, comment_event, reply_event, update_event
+from moderation import moderation_changes, run_bulk
+from search import InvertedIndex, MongoTextSearch
+from trending import WINDOWS as TRENDING_WINDOWS, Leaderboard
+from compression import compress_response
+from serialization import MongoJSONProvider, to_json
+from logs import configure as configure_logging, log_event
+import metrics
+from ingest import QueueFull, WriteBehindQueue
+from http_cache import ArticleVersions, StaticAssets, article_etag, not_modified, with_validator
+from thread_cache import ThreadSnapshots
 
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Routes, hooks and CLI commands, put on an app by create_app()
+api = Blueprint('api', __name__, cli_group=None)
+
+MODERATOR_EMAIL = "moderator@hw3.com"
+
+# ?replies= values accepted by GET /api/comments/<article>
+REPLIES_MODES = ('full', 'count', 'tree')
+
+# Frontend files, the path is resolved once
+static_assets = StaticAssets(os.path.join(os.path.dirname(__file__), '../frontend'))
+
+MAX_SEARCH_PAGE = 50
+MAX_SEARCH_OFFSET = 1000
+
+def read_settings(settings=os.environ):
+    """Set the module's plain settings from settings (environment variable names to strings)
+
+    Read from the environment at import, so the CLI and gunicorn's hooks work
+    without an app, and again by init_services() from create_app's config.
+    """
+    global mongo_uri, MONGO_POOL_OPTIONS, USE_TRANSACTIONS, CHANGE_STREAMS, MAX_COMMENTS_PAGE, EXPORT_BATCH_SIZE
+    global MAX_COUNT_TITLES, MAX_BULK_ACTIONS, RATE_LIMIT_PROXY_HOPS, METRICS_DIR, METRICS_SNAPSHOT_INTERVAL, WORKERS
+    get = settings.get
+    connection = (globals().get('mongo_uri'), globals().get('MONGO_POOL_OPTIONS'))
+
+    # MongoDB Connection
+    mongo_uri = get('MONGO_URI', 'mongodb://mongo:27017/')
+    # Pool settings are per process, so size them for one worker's threads
+    MONGO_POOL_OPTIONS = {
+        'maxPoolSize': int(get('MONGO_MAX_POOL_SIZE', '20')),
+        'minPoolSize': int(get('MONGO_MIN_POOL_SIZE', '0')),
+        'waitQueueTimeoutMS': int(get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000')),
+    }
+    if connection[0] is not None and connection != (mongo_uri, MONGO_POOL_OPTIONS):
+        reset_mongo_client()
+
+    # Wrap each document write and its counter update in a transaction (needs a replica set)
+    USE_TRANSACTIONS = get('MONGO_TRANSACTIONS', '0') == '1'
+    # CHANGE_STREAMS=off: no change stream watcher, each worker only publishes its own writes, see events.py
+    CHANGE_STREAMS = get('CHANGE_STREAMS', 'auto') != 'off'
+    # Worker processes serving the app (gunicorn.conf.py sets it, uvicorn --workers defaults to it)
+    WORKERS = int(get('WEB_CONCURRENCY', '1'))
+    # Largest page size for paginated comment reads
+    MAX_COMMENTS_PAGE = int(get('MAX_COMMENTS_PAGE', '100'))
+    # Documents encoded per chunk when streaming /api/all-comments
+    EXPORT_BATCH_SIZE = int(get('EXPORT_BATCH_SIZE', '500'))
+    # Upper bound on titles accepted by /api/comment-counts (the front page shows 10-50)
+    MAX_COUNT_TITLES = int(get('MAX_COUNT_TITLES', '200'))
+    # Upper bound on actions accepted by /api/moderation/bulk
+    MAX_BULK_ACTIONS = int(get('MAX_BULK_ACTIONS', '500'))
+    # Proxies in front of the app that append to X-Forwarded-For (0: use the socket address)
+    RATE_LIMIT_PROXY_HOPS = int(get('RATE_LIMIT_PROXY_HOPS', '0'))
+    # Prometheus metrics (GET /metrics), METRICS_DIR sums them over every worker, see metrics.py
+    METRICS_DIR = get('METRICS_DIR')
+    METRICS_SNAPSHOT_INTERVAL = float(get('METRICS_SNAPSHOT_INTERVAL', '10'))
+
+_mongo_client = None
+_mongo_pid = None
+_mongo_lock = threading.Lock()
+
+def get_mongo_client():
+    """MongoClient for this process, created on first use
+
+    MongoClient is not fork-safe, so a pre-fork server worker never reuses a
+    client built in the master: a new one is created whenever the pid changes.
+    """
+    global _mongo_client, _mongo_pid
+    if _mongo_client is None or _mongo_pid != os.getpid():
+        with _mongo_lock:
+            if _mongo_client is None or _mongo_pid != os.getpid():
+                _mongo_client = MongoClient(mongo_uri, event_listeners=[metrics.mongo_metrics],
+                                            **MONGO_POOL_OPTIONS)
+                _mongo_pid = os.getpid()
+    return _mongo_client
+
+def reset_mongo_client():
+    """Drop this process's client (used by the gunicorn post_fork hook)"""
+    global _mongo_client, _mongo_pid
+    with _mongo_lock:
+        _mongo_client = None
+        _mongo_pid = None
+
+db = LocalProxy(lambda: get_mongo_client().nyt_comments_db)  # Use a new database for our comments
+
+read_settings()
+
+# Caches, limiters and background workers of this process, built by init_services()
+nyt_cache = None          # Cached NYT Article Search proxy, see nyt_cache.py
+article_prefetch = None   # The searches nearly every visit asks for, kept warm, see prefetch.py
+article_versions = None   # Latest version of each article's comments for ETags, see http_cache.py
+thread_snapshots = None   # Encoded ?replies=tree threads, see thread_cache.py
+comment_search = None     # SEARCH_BACKEND=mongo (text indexes) or memory (in-process index), see search.py
+_text_search = None       # The text indexes, for search_backend() while a memory index may be missing writes
+activity_buffer = None    # Trending activity of single writes, written in batches, see article_stats.py
+trending = None           # Most active articles per window, see trending.py
+comment_queue = None      # INGEST_MODE=write_behind batches new comments, see ingest.py
+_session_interface = None # SESSION_BACKEND=memory|mongo|file, see sessions.py
+rate_limiter = None       # RATE_LIMIT_BACKEND=memory|mongo|off, see ratelimit.py
+_listeners = []
+
+def init_services(settings=os.environ):
+    """Build this process's services from settings, stopping those of an earlier call
+
+    settings maps environment variable names to values in the same string
+    form; create_app() passes its config layered over the environment.
+    Nothing here does I/O, background threads start on first use.
+    """
+    global nyt_cache, article_prefetch, article_versions, thread_snapshots, comment_search, _text_search
+    global activity_buffer, trending, comment_queue, _session_interface, rate_limiter
+    close_services()
+    read_settings(settings)
+    get = settings.get
+
+    nyt_cache = NYTArticleCache(
+        api_key_getter=lambda: get('NYT_API_KEY'),
+        base_url=get('NYT_API_URL', NYT_SEARCH_URL),
+        ttl=int(get('NYT_CACHE_TTL', '300')),
+        stale_ttl=int(get('NYT_CACHE_STALE_TTL', '3600')),
+        max_entries=int(get('NYT_CACHE_MAX_ENTRIES', '256')),
+        max_bytes=int(get('NYT_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+        timeout=float(get('NYT_TIMEOUT', '5')),
+        transform=trim_search_response,
+        on_upstream=lambda seconds, status: metrics.nyt_upstream_duration.observe(seconds, status=str(status)),
+    )
+    article_prefetch = ArticlePrefetcher(
+        lambda: db,
+        nyt_cache,
+        # NYT_PREFETCH=off: no prefetch thread, every search goes through nyt_cache
+        parse_targets(get('NYT_PREFETCH_QUERIES', 'davis+sacramento'), int(get('NYT_PREFETCH_PAGES', '3')))
+        if get('NYT_PREFETCH', 'on') != 'off' else [],
+        interval=float(get('NYT_PREFETCH_INTERVAL', '900')),
+        rate_per_minute=float(get('NYT_PREFETCH_RATE', '5')),
+        max_age=float(get('NYT_PREFETCH_MAX_AGE', '3600')),
+    )
+
+    article_versions = ArticleVersions(
+        lambda: db,
+        ttl=float(get('ARTICLE_VERSION_TTL', '2')),
+        authoritative=broker.watching,
+        authoritative_ttl=float(get('ARTICLE_VERSION_WATCHED_TTL', '10'))
+    )
+    thread_snapshots = ThreadSnapshots(
+        max_entries=int(get('THREAD_SNAPSHOT_MAX_ENTRIES', '256')),
+        max_bytes=int(get('THREAD_SNAPSHOT_MAX_BYTES', str(64 * 1024 * 1024)))
+    )
+    versions, snapshots = article_versions, thread_snapshots
+    _listen(lambda article_title, event: versions.invalidate(article_key(article_title)))
+    _listen(lambda article_title, event: snapshots.invalidate(article_key(article_title)))
+
+    _text_search = MongoTextSearch(lambda: db)
+    if get('SEARCH_BACKEND', 'mongo') == 'memory':
+        comment_search = InvertedIndex(lambda: db)
+        _listen(comment_search.apply_event)
+    else:
+        comment_search = _text_search
+
+    # ACTIVITY_FLUSH_INTERVAL=0 writes the activity with each write instead
+    activity_flush_interval = float(get('ACTIVITY_FLUSH_INTERVAL', '2'))
+    activity_buffer = None
+    if activity_flush_interval > 0:
+        activity_buffer = ActivityBuffer(lambda: db, flush_interval=activity_flush_interval)
+
+    trending = Leaderboard(
+        lambda: db,
+        size=int(get('TRENDING_SIZE', '50')),
+        refresh_interval=float(get('TRENDING_REFRESH', '30'))
+    )
+
+    comment_queue = None
+    if get('INGEST_MODE', 'direct') == 'write_behind':
+        comment_queue = WriteBehindQueue(
+            lambda: db,
+            get('INGEST_SPILL_DIR', '/tmp/nyt_ingest'),
+            batch_size=int(get('INGEST_BATCH_SIZE', '500')),
+            flush_interval=float(get('INGEST_FLUSH_INTERVAL', '0.2')),
+            max_pending=int(get('INGEST_MAX_PENDING', '10000')),
+            fsync=get('INGEST_FSYNC', '1') == '1',
+            use_transactions=USE_TRANSACTIONS,
+            on_flushed=lambda titles: [_article_written(title) for title in titles]
+        )
+
+    _session_interface = session_interface_from_env(lambda: db, settings)
+    rate_limiter = rate_limiter_from_env(lambda: db, settings)
+
+def search_backend():
+    """comment_search, or the text indexes while a memory index could miss other workers' writes
+
+    A memory index learns about writes from the broker. With several workers
+    that only covers them all while the change stream is open, so it is
+    started here and the text indexes answer until it is. The index is built
+    on its first search, which is therefore after the stream opened.
+    """
+    if not isinstance(comment_search, InvertedIndex) or WORKERS <= 1:
+        return comment_search
+    if CHANGE_STREAMS:
+        broker.ensure_watcher(lambda: db)
+    return comment_search if broker.watching() else _text_search
+
+def _listen(listener):
+    broker.add_listener(listener)
+    _listeners.append(listener)
+
+def close_services():
+    """Stop the background work of the current services, flushing what is queued"""
+    while _listeners:
+        broker.remove_listener(_listeners.pop())
+    for service in (article_prefetch, trending, activity_buffer, comment_queue):
+        if service is not None:
+            service.close()
+
+# Write out whatever is still queued when the process exits
+atexit.register(close_services)
+
+metrics.registry.collect_stats('nyt_cache_requests_total', 'NYT article cache lookups by outcome', 'result',
+                               lambda: nyt_cache.stats)
+metrics.registry.collect_stats('nyt_prefetch_pages_total', 'Prefetched NYT pages by outcome', 'result',
+                               lambda: article_prefetch.stats)
+metrics.registry.collect_stats('article_version_cache_total', 'ETag version lookups by outcome', 'result',
+                               lambda: article_versions.stats)
+metrics.registry.collect_stats('thread_snapshot_total', 'Nested thread snapshot lookups by outcome', 'result',
+                               lambda: thread_snapshots.stats)
+metrics.registry.collect_stats('write_behind_comments_total', 'Write-behind queue activity', 'result',
+                               lambda: comment_queue.stats if comment_queue is not None else {})
+
+@api.before_app_request
+def start_request_metrics():
+    g._started = time.perf_counter()
+    metrics.mongo_metrics.begin_request()
+    if METRICS_DIR:
+        metrics.registry.ensure_snapshots(METRICS_DIR, METRICS_SNAPSHOT_INTERVAL)
 
-app = Flask(__name__)
-# Use a fixed secret key instead of randomly generating it on each restart
-app.secret_key = os.getenv('FLASK_SECRET_KEY', 'dev_secret_key_for_testing')
-CORS(app)  # Enable CORS for all routes
-
-# MongoDB Connection
-mongo_uri = os.getenv('MONGO_URI', 'mongodb://mongo:27017/')
-client = MongoClient(mongo_uri)
-db = client.nyt_comments_db  # Use a new database for our comments
-
-oauth = OAuth(app)
-
-nonce = generate_token()
-
-oauth.register(
-    name=os.getenv('OIDC_CLIENT_NAME'),
-    client_id=os.getenv('OIDC_CLIENT_ID'),
-    client_secret=os.getenv('OIDC_CLIENT_SECRET'),
-    #server_metadata_url='http://dex:5556/.well-known/openid-configuration',
-    authorization_endpoint="http://localhost:5556/auth",
-    token_endpoint="http://dex:5556/token",
-    jwks_uri="http://dex:5556/keys",
-    userinfo_endpoint="http://dex:5556/userinfo",
-    device_authorization_endpoint="http://dex:5556/device/code",
-    client_kwargs={'scope': 'openid email profile'}
-)
-
-@app.route('/')
+@api.after_app_request
+def record_request_metrics(response):
+    # Streamed responses (exports, event streams) are timed until their headers are ready
+    if '_started' in g:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.request_duration.observe(time.perf_counter() - g._started, route=route, method=request.method,
+                                         status=str(response.status_code))
+        commands, seconds = metrics.mongo_metrics.end_request()
+        metrics.request_mongo_commands.observe(commands, route=route)
+        metrics.request_mongo_seconds.observe(seconds, route=route)
+    return response
+
+_oauth_client = None
+_oauth_pid = None
+_oauth_lock = threading.Lock()
+
+def get_oauth_client():
+    """Dex OIDC client for this process, registered on first use (authlib is only imported then)"""
+    global _oauth_client, _oauth_pid
+    if _oauth_client is None or _oauth_pid != os.getpid():
+        with _oauth_lock:
+            if _oauth_client is None or _oauth_pid != os.getpid():
+                from authlib.integrations.flask_client import FlaskIntegration, FlaskOAuth2App
+                name = os.getenv('OIDC_CLIENT_NAME', 'flask_app')
+                # Built directly rather than through OAuth(app).register(), the client is per process, not per app
+                _oauth_client = FlaskOAuth2App(
+                    FlaskIntegration(name), name,
+                    client_id=os.getenv('OIDC_CLIENT_ID'),
+                    client_secret=os.getenv('OIDC_CLIENT_SECRET'),
+                    #server_metadata_url='http://dex:5556/.well-known/openid-configuration',
+                    authorization_endpoint="http://localhost:5556/auth",
+                    token_endpoint="http://dex:5556/token",
+                    jwks_uri="http://dex:5556/keys",
+                    userinfo_endpoint="http://dex:5556/userinfo",
+                    device_authorization_endpoint="http://dex:5556/device/code",
+                    client_kwargs={'scope': 'openid email profile'}
+                )
+                _oauth_pid = os.getpid()
+    return _oauth_client
+
+def warm_up(timeout=5.0):
+    """Readiness hook: create this process's clients and check MongoDB, {check: 'ok' or the error}
+
+    Waits at most timeout seconds for MongoDB, a slower answer is reported
+    as pending and the client stays usable.
+    """
+    checks = {'mongo': 'pending'}
+    def ping():
+        try:
+            get_mongo_client().admin.command('ping')
+            checks['mongo'] = 'ok'
+        except PyMongoError as e:
+            checks['mongo'] = str(e)
+    pinger = threading.Thread(target=ping, name='warm-up', daemon=True)
+    pinger.start()
+    try:
+        get_oauth_client()
+        checks['oauth'] = 'ok'
+    except Exception as e:
+        checks['oauth'] = str(e)
+    pinger.join(timeout)
+    log_event(logger, logging.INFO, 'warm_up', **checks)
+    return dict(checks)
+
+@api.route('/healthz')
+def healthz():
+    """Liveness: the process answers, nothing else is checked"""
+    return jsonify({"status": "ok"})
+
+@api.route('/readyz')
+def readyz():
+    """Readiness: MongoDB answers a ping, 503 until it does"""
+    try:
+        get_mongo_client().admin.command('ping')
+    except PyMongoError as e:
+        return jsonify({"ready": False, "mongo": str(e)}), 503
+    return jsonify({"ready": True})
+
+@api.route('/')
 def serve_index():
     # Serve the index.html file from the frontend folder
-    frontend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../frontend'))
-    return send_from_directory(frontend_path, 'index.html')
+    return static_assets.index()
 
-@app.route('/login')
+@api.route('/login')
 def login():
     redirect_uri = 'http://localhost:8000/authorize'
     # No nonce is used, just authorize the redirect, this shit causing issues frfr, no security :)
-    return oauth.flask_app.authorize_redirect(redirect_uri)
+    return get_oauth_client().authorize_redirect(redirect_uri)
 
-@app.route('/authorize')
+@api.route('/authorize')
 def authorize():
     try:
         # Get the token
-        token = oauth.flask_app.authorize_access_token()
+        oauth_client = get_oauth_client()
+        token = oauth_client.authorize_access_token()
         
         # Parse the ID token - this contains user information from Dex
-        user_info = oauth.flask_app.parse_id_token(token, nonce=None)
+        user_info = oauth_client.parse_id_token(token, nonce=None)
 
         # Extract email (this is reliable)
         email = user_info.get("email", "")
@@ -68,7 +400,7 @@ def authorize():
 
         
         # Check if user is a moderator
-        is_moderator = email == "moderator@hw3.com"
+        is_moderator = email == MODERATOR_EMAIL
         
         # Store user information in session
         session['user'] = {
@@ -81,11 +413,11 @@ def authorize():
         # Redirect to the main application page
         return redirect('/app')
     except Exception as e:
-        print(f"DEBUG - Authorization error: {str(e)}")
+        log_event(logger, logging.WARNING, 'authorize_failed', error=str(e))
         return jsonify({"error": str(e)}), 500
     return redirect('/app')
 
-@app.route('/logout')
+@api.route('/logout')
 def logout():
     session.clear()
     return redirect('/')
@@ -93,22 +425,59 @@ def logout():
 # We've replaced the /api/key endpoint with /api/articles
 # to handle NYT API requests on the server side for better security
 
-@app.route('/api/user')
+def current_user():
+    """The logged-in user with their role resolved, or None
+
+    Read from the session once per request and cached on flask.g, so handlers
+    can call this freely.
+    """
+    if '_current_user' not in g:
+        user = session.get('user')
+        if user:
+            user = dict(user)
+            # Older sessions may predate the is_moderator flag, the email is authoritative
+            user['is_moderator'] = bool(user.get('is_moderator')) or user.get('email') == MODERATOR_EMAIL
+            user.setdefault('user_id', 'unknown')
+        g._current_user = user or None
+    return g._current_user
+
+def rate_limited(policy):
+    """Answer 429 with Retry-After once the caller used up its bucket under policy"""
+    def decorator(view):
+        @functools.wraps(view)
+        def limited(*args, **kwargs):
+            if rate_limiter is not None:
+                key = client_key(rate_limiter.policies[policy].key, current_user(), request.remote_addr,
+                                 request.headers.get('X-Forwarded-For'), RATE_LIMIT_PROXY_HOPS)
+                allowed, retry_after = rate_limiter.hit(policy, key)
+                if not allowed:
+                    response = jsonify({"error": "Too many requests, try again later"})
+                    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                    return response, 429
+            return view(*args, **kwargs)
+        return limited
+    return decorator
+
+@api.route('/api/me')
+def get_me():
+    """Everything the page needs about the current user in one call"""
+    user = current_user()
+    if user:
+        return jsonify({
+            "username": user.get("username"),
+            "email": user.get("email"),
+            "user_id": user.get("user_id"),
+            "is_moderator": user['is_moderator']
+        })
+    return jsonify({"username": None, "email": None, "user_id": None, "is_moderator": False})
+
+@api.route('/api/user')
 def get_user_info():
-    user = session.get('user')
+    user = current_user()
     if user:
-        # Check if this is the moderator email as a fallback method
         email = user.get("email")
-        is_mod = user.get("is_moderator", False)
-        
-        # If user_id wasn't properly set but email matches moderator, set is_mod to True
-        if email == "moderator@hw3.com" and not is_mod:
-            is_mod = True
-            # Also update the session
-            session['user']["is_moderator"] = True
-            session.modified = True  # Mark the session as modified so it gets saved
-        
-        print(f"DEBUG - Sending user info: {user.get('username')}, is_moderator: {is_mod}, email: {email}")
+        is_mod = user['is_moderator']
+        log_event(logger, logging.DEBUG, 'user_info', username=user.get('username'), is_moderator=is_mod)
         return jsonify({
             "username": user.get("username"),
             "is_moderator": is_mod,
@@ -117,9 +486,9 @@ def get_user_info():
         })
     return jsonify({"username": None, "is_moderator": False})
 
-@app.route('/api/user-details')
+@api.route('/api/user-details')
 def get_user_details():
-    user = session.get('user')
+    user = current_user()
     if user:
         return jsonify({
             "username": user.get("username"),
@@ -127,335 +496,580 @@ def get_user_details():
         })
     return jsonify({"username": None, "email": None})
 
-@app.route('/app')
+@api.route('/app')
 def serve_app():
     # Serve the index.html file from the frontend folder
-    frontend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../frontend'))
-    return send_from_directory(frontend_path, 'index.html')
+    return static_assets.index()
 
-@app.route('/<path:filename>')
+@api.route('/<path:filename>')
 def serve_files(filename):
-    frontend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../frontend'))
-    return send_from_directory(frontend_path, filename)
+    return static_assets.send(filename)
 
 # Comment-related API endpoints
-@app.route('/api/comments/<article_title>', methods=['GET'])
+def _article_written(article_title):
+    """Drop the cached version (so ETags move at once) and the thread snapshots of an article"""
+    if article_title:
+        key = article_key(article_title)
+        article_versions.invalidate(key)
+        thread_snapshots.invalidate(key)
+
+def _article_changed(article_title, event):
+    """After a write: forget what is cached about the article and tell subscribers"""
+    _article_written(article_title)
+    broker.notify(article_title, event)
+
+def _encode_cursor(comment):
+    """Opaque keyset cursor pointing just past this comment"""
+    raw = json.dumps([comment.get('timestamp'), str(comment['_id'])]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    timestamp, comment_id = json.loads(raw)
+    return timestamp, ObjectId(comment_id)
+
+@api.route('/api/comments/<article_title>', methods=['GET'])
 def get_comments(article_title):
-    """Get all comments for a specific article"""
+    """Get comments for a specific article
+
+    Without query parameters this returns every comment with its replies, as
+    before. Passing ?limit=N switches to keyset pagination on (timestamp, _id)
+    and returns {"comments": [...], "next_cursor": ...}; pass the cursor back
+    to get the next page. ?replies=count leaves out the replies arrays and
+    adds a replyCount instead, replies can then be loaded per comment from
+    GET /api/comments/<comment_id>/replies. ?replies=tree nests every reply
+    under its parent in a `replies` list, assembled on the server and kept
+    as a snapshot until the article changes (see thread_cache.py).
+
+    The article is given by its headline or its article key (see articles.py).
+    """
     try:
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor')
+        replies_mode = request.args.get('replies', 'full')
+        if replies_mode not in REPLIES_MODES:
+            return jsonify({"error": "replies must be 'full', 'count' or 'tree'"}), 400
+        if limit is not None and limit <= 0:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        
+        # Repeat views of an unchanged thread are answered without touching the comments
+        key = to_article_key(article_title)
+        version = article_versions.get(key)
+        etag = article_etag(key, version, request.query_string)
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        if replies_mode == 'tree':
+            snapshot = thread_snapshots.get(key, version, request.query_string)
+            if snapshot is not None:
+                return with_validator(current_app.response_class(snapshot, mimetype='application/json'), etag)
+        
         # URL parameters are automatically decoded by Flask, so we don't need to decode again
-        comments = list(db.comments.find({'articleTitle': article_title}))
+        query = {'articleKey': key}
+        if cursor:
+            try:
+                after_timestamp, after_id = _decode_cursor(cursor)
+            except Exception:
+                return jsonify({"error": "Invalid cursor"}), 400
+            query['$or'] = [
+                {'timestamp': {'$gt': after_timestamp}},
+                {'timestamp': after_timestamp, '_id': {'$gt': after_id}}
+            ]
+        
+        paginate = limit is not None or cursor is not None
+        if paginate:
+            limit = min(limit or MAX_COMMENTS_PAGE, MAX_COMMENTS_PAGE)
+        
+        cursor_obj = db.comments.find(query, {'replies': 0})
+        if paginate:
+            cursor_obj = cursor_obj.sort([('timestamp', 1), ('_id', 1)]).limit(limit + 1)
+        comments = list(cursor_obj)
         
-        # Convert ObjectId to string for JSON serialization
-        for comment in comments:
-            comment['_id'] = str(comment['_id'])
-            if 'replies' in comment:
-                for reply in comment['replies']:
-                    if '_id' in reply:
-                        reply['_id'] = str(reply['_id'])
+        # We fetched one extra document to know whether another page exists
+        next_cursor = None
+        if paginate and len(comments) > limit:
+            comments = comments[:limit]
+            next_cursor = _encode_cursor(comments[-1])
+        
+        # Replies live in their own collection, fetched for the whole page in one query
+        comment_ids = [comment['_id'] for comment in comments]
+        if replies_mode == 'count':
+            counts = reply_store.reply_counts(db, comment_ids)
+            for comment in comments:
+                comment['replyCount'] = counts[comment['_id']]
+        elif replies_mode == 'tree':
+            replies = reply_store.replies_by_comment(db, comment_ids)
+            for comment in comments:
+                comment['replies'] = reply_store.nest_replies(replies[comment['_id']])
+        else:
+            replies = reply_store.replies_by_comment(db, comment_ids)
+            for comment in comments:
+                comment['replies'] = [reply_store.to_client(reply) for reply in replies[comment['_id']]]
         
-        return jsonify(comments)
+        # ObjectIds are left to the encoder, see serialization.py
+        response = jsonify(comments if not paginate else {"comments": comments, "next_cursor": next_cursor})
+        if replies_mode == 'tree':
+            thread_snapshots.put(key, version, request.query_string, response.get_data())
+        return with_validator(response, etag)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/comments', methods=['POST'])
+@api.route('/api/comments/<comment_id>/replies', methods=['GET'])
+def get_replies(comment_id):
+    """Get the replies of one comment, for clients that loaded comments with ?replies=count
+
+    ?depth=N only returns replies at that nesting level (0 = direct replies).
+    """
+    try:
+        depth = request.args.get('depth', type=int)
+        replies = reply_store.find_replies(db, ObjectId(comment_id), depth=depth)
+        if not replies and not db.comments.find_one({'_id': ObjectId(comment_id)}, {'_id': 1}):
+            return jsonify({"error": "Comment not found"}), 404
+        return jsonify([reply_store.to_client(reply) for reply in replies])
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/api/comments/<comment_id>/replies/<reply_id>/replies', methods=['GET'])
+def get_reply_subtree(comment_id, reply_id):
+    """Get every reply below one reply, ?depth=N limits it to one level (1 = direct children)"""
+    try:
+        depth = request.args.get('depth', type=int)
+        parent = db.replies.find_one({'_id': ObjectId(reply_id), 'comment_id': ObjectId(comment_id)},
+                                     {'depth': 1})
+        if not parent:
+            return jsonify({"error": "Reply not found"}), 404
+        absolute_depth = None if depth is None else parent.get('depth', 0) + depth
+        replies = reply_store.find_replies(db, ObjectId(comment_id), under=parent['_id'], depth=absolute_depth)
+        return jsonify([reply_store.to_client(reply) for reply in replies])
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/api/comments', methods=['POST'])
+@rate_limited('comments')
 def add_comment():
     """Add a new comment to an article"""
     try:
         data = request.json
         
         # Check if user is logged in
-        user = session.get('user')
+        user = current_user()
         if not user:
             return jsonify({"error": "You must be logged in to comment"}), 401        # Create new comment
         # URL-decode the article title to ensure consistency
-        import urllib.parse
         article_title = urllib.parse.unquote(data['articleTitle'])
         
         comment = {
+            'articleKey': article_key(article_title),
             'articleTitle': article_title, 
             'username': user.get('username'),
             'text': data['text'],
-            'timestamp': datetime.now().isoformat(),
-            'replies': []
+            'timestamp': datetime.now().isoformat()
         }
         
-        # Insert the comment into MongoDB
-        result = db.comments.insert_one(comment)
-        # comment count
-        db.article_stats.update_one(
-            {'articleTitle': article_title},
-            {'$inc': {'commentCount': 1}},
-            upsert=True
-        )
+        if comment_queue is not None:
+            # Write-behind: the id is assigned here and the insert happens in the next batch
+            comment['_id'] = ObjectId()
+            try:
+                comment_queue.submit(comment)
+            except QueueFull:
+                return jsonify({"error": "Too many comments right now, please retry"}), 503, {'Retry-After': '1'}
+            _article_changed(article_title, comment_event(comment))
+            return jsonify({"id": str(comment['_id']), "success": True, "queued": True}), 202
+        
+        # Insert the comment into MongoDB and bump the comment count with it
+        with counted_write(db, USE_TRANSACTIONS) as txn:
+            result = db.comments.insert_one(comment, session=txn)
+            adjust_count(db, article_title, 1, session=txn, activity=activity_buffer)
+        _article_changed(article_title, comment_event(comment))
         
         return jsonify({"id": str(result.inserted_id), "success": True}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/comments/<comment_id>/replies', methods=['POST'])
+@api.route('/api/comments/<comment_id>/replies', methods=['POST'])
+@rate_limited('comments')
 def add_reply(comment_id):
     """Add a reply to a specific comment"""
     try:
         data = request.json
         
         # Check if user is logged in
-        user = session.get('user')
+        user = current_user()
         if not user:
             return jsonify({"error": "You must be logged in to reply"}), 401
         
-        # Create new reply
-        reply = {
-            'username': user.get('username'),
-            'text': data['text'],
-            'timestamp': datetime.now().isoformat(),
-            '_id': ObjectId()
-        }
-          # Add reply to comment
-        result = db.comments.update_one(
-            {'_id': ObjectId(comment_id)},
-            {'$push': {'replies': reply}}
-        )
-        
-        if result.modified_count == 0:
+        comment = db.comments.find_one({'_id': ObjectId(comment_id)}, {'articleTitle': 1})
+        if not comment:
             return jsonify({"error": "Comment not found"}), 404
-            
-        # Get the article title from the parent comment
-        comment = db.comments.find_one({'_id': ObjectId(comment_id)})
-        if comment and 'articleTitle' in comment:
-            # Update comment count for the article (replies also count towards total)
-            db.article_stats.update_one(
-                {'articleTitle': comment['articleTitle']},
-                {'$inc': {'commentCount': 1}},
-                upsert=True
-            )
+        
+        # Create new reply in the reply store (replies also count towards the total)
+        reply = reply_store.new_reply(comment['_id'], comment.get('articleTitle'),
+                                      user.get('username'), data['text'])
+        with counted_write(db, USE_TRANSACTIONS) as txn:
+            db.replies.insert_one(reply, session=txn)
+            adjust_count(db, comment.get('articleTitle'), 1, session=txn, activity=activity_buffer)
+        _article_changed(comment.get('articleTitle'), reply_event(reply))
         
         return jsonify({"id": str(reply['_id']), "success": True}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/comments/<comment_id>/replies/<reply_id>/replies', methods=['POST'])
+@api.route('/api/comments/<comment_id>/replies/<reply_id>/replies', methods=['POST'])
+@rate_limited('comments')
 def add_nested_reply(comment_id, reply_id):
     """Add a nested reply (reply to a reply)"""
     try:
         data = request.json
         
         # Check if user is logged in
-        user = session.get('user')
+        user = current_user()
         if not user:
             return jsonify({"error": "You must be logged in to reply"}), 401
         
-        # Create new nested reply
-        nested_reply = {
-            'username': user.get('username'),
-            'text': data['text'],
-            'timestamp': datetime.now().isoformat(),
-            '_id': ObjectId(),
-            'parent_reply_id': reply_id  # Reference to the parent reply
-        }
-        
-        comment = db.comments.find_one({'_id': ObjectId(comment_id)})
-        if not comment:
-            return jsonify({"error": "Parent comment not found"}), 404
-        
-        # Add the nested reply to the replies array
-        result = db.comments.update_one(
-            {'_id': ObjectId(comment_id)},
-            {'$push': {'replies': nested_reply}}
+        # The parent reply carries the article title and its own ancestor path
+        parent = db.replies.find_one(
+            {'_id': ObjectId(reply_id), 'comment_id': ObjectId(comment_id)},
+            {'articleTitle': 1, 'ancestors': 1, 'depth': 1}
         )
+        if not parent:
+            return jsonify({"error": "Parent reply not found"}), 404
         
-        if result.modified_count == 0:
-            return jsonify({"error": "Failed to add nested reply"}), 500
-        
-        # Update comment count for the article (nested replies also count)
-        if 'articleTitle' in comment:
-            db.article_stats.update_one(
-                {'articleTitle': comment['articleTitle']},
-                {'$inc': {'commentCount': 1}},
-                upsert=True
-            )
+        # Create new nested reply
+        nested_reply = reply_store.new_reply(ObjectId(comment_id), parent.get('articleTitle'),
+                                             user.get('username'), data['text'], parent=parent)
+        # Nested replies also count towards the total
+        with counted_write(db, USE_TRANSACTIONS) as txn:
+            db.replies.insert_one(nested_reply, session=txn)
+            adjust_count(db, parent.get('articleTitle'), 1, session=txn, activity=activity_buffer)
+        _article_changed(parent.get('articleTitle'), reply_event(nested_reply))
         
         return jsonify({"id": str(nested_reply['_id']), "success": True}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/comment-count/<article_title>', methods=['GET'])
+@api.route('/api/comment-count/<article_title>', methods=['GET'])
 def get_comment_count(article_title):
-    """Get the comment count for a specific article"""
+    """Get the comment count for a specific article (by headline or article key)"""
     try:
         # URL parameters are automatically decoded by Flask, so we don't need to decode again
-        # Use the article title as-is for consistency, DO NOT CHANGE THIS I PLZZZZ
-        stats = db.article_stats.find_one({'articleTitle': article_title})
+        key = to_article_key(article_title)
+        etag = article_etag(key, article_versions.get(key), b'count')
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        stats = db.article_stats.find_one({'articleKey': key})
         count = stats['commentCount'] if stats else 0
         if not stats:
-            count = db.comments.count_documents({'articleTitle': article_title})
+            count = db.comments.count_documents({'articleKey': key})
             
-        return jsonify({"count": count})
+        return with_validator(jsonify({"count": count}), etag)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/all-comments', methods=['GET'])
+@api.route('/api/comment-counts', methods=['POST'])
+def get_comment_counts():
+    """Get the comment counts for many articles in one request
+
+    `titles` may mix headlines and article keys, counts come back under the
+    strings that were sent.
+    """
+    try:
+        data = request.json or {}
+        titles = data.get('titles')
+        if not isinstance(titles, list) or not all(isinstance(t, str) for t in titles):
+            return jsonify({"error": "titles must be a list of article titles"}), 400
+        if len(titles) > MAX_COUNT_TITLES:
+            return jsonify({"error": f"At most {MAX_COUNT_TITLES} titles per request"}), 400
+
+        titles = list(dict.fromkeys(titles))  # drop duplicates, keep order
+        counts = {title: 0 for title in titles}
+        if not titles:
+            return jsonify({"counts": counts})
+
+        # One $in lookup for every article that already has stats
+        requested = {}
+        for title in titles:
+            requested.setdefault(to_article_key(title), []).append(title)
+        missing = set(requested)
+        for stats in db.article_stats.find({'articleKey': {'$in': list(requested)}},
+                                           {'_id': 0, 'articleKey': 1, 'commentCount': 1}):
+            for title in requested[stats['articleKey']]:
+                counts[title] = stats.get('commentCount', 0)
+            missing.discard(stats['articleKey'])
+
+        # Same fallback as get_comment_count, but grouped into a single aggregation
+        if missing:
+            pipeline = [
+                {'$match': {'articleKey': {'$in': list(missing)}}},
+                {'$group': {'_id': '$articleKey', 'count': {'$sum': 1}}}
+            ]
+            for row in db.comments.aggregate(pipeline):
+                for title in requested[row['_id']]:
+                    counts[title] = row['count']
+
+        return jsonify({"counts": counts})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/api/all-comments', methods=['GET'])
 def get_all_comments():
-    comments = list(db.comments.find({}, {'_id': 1, 'text': 1, 'username': 1, 'created_at': 1}))
-    for comment in comments:
-        comment['_id'] = str(comment['_id'])
-    return jsonify(comments), 200
+    """Stream every comment, encoded batch by batch straight from the cursor
+
+    ?format=ndjson emits one JSON document per line, the default is a JSON
+    array sent in chunks. ?article=<title or article key> and
+    ?since=<ISO timestamp> narrow the export.
+    """
+    output_format = request.args.get('format', 'json')
+    if output_format not in ('json', 'ndjson'):
+        return jsonify({"error": "format must be 'json' or 'ndjson'"}), 400
+    
+    query = {}
+    if request.args.get('article'):
+        query['articleKey'] = to_article_key(request.args['article'])
+    if request.args.get('since'):
+        query['timestamp'] = {'$gt': request.args['since']}
+    
+    projection = {'_id': 1, 'text': 1, 'username': 1, 'created_at': 1, 'articleKey': 1, 'articleTitle': 1,
+                  'timestamp': 1}
+    cursor = db.comments.find(query, projection).batch_size(EXPORT_BATCH_SIZE)
+    
+    def encode(chunk):
+        if output_format == 'ndjson':
+            return b'\n'.join(to_json(comment) for comment in chunk)
+        # One encoder call per batch, without the enclosing brackets
+        return to_json(chunk)[1:-1]
+
+    def generate():
+        # Only one batch worth of encoded documents is held in memory at a time
+        separator = b'\n' if output_format == 'ndjson' else b','
+        chunk = []
+        first = True
+        if output_format == 'json':
+            yield b'['
+        try:
+            for comment in cursor:
+                chunk.append(comment)
+                if len(chunk) >= EXPORT_BATCH_SIZE:
+                    yield (b'' if first else separator) + encode(chunk)
+                    first = False
+                    chunk = []
+            if chunk:
+                yield (b'' if first else separator) + encode(chunk)
+                first = False
+            if output_format == 'ndjson' and not first:
+                yield b'\n'
+        finally:
+            cursor.close()
+        if output_format == 'json':
+            yield b']'
+    
+    mimetype = 'application/x-ndjson' if output_format == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), status=200, mimetype=mimetype)
+
+@api.route('/api/search', methods=['GET'])
+def search_comments():
+    """Search comment and reply text, best match first
+
+    ?q= is required; ?username=, ?article=, ?since= and ?until= (ISO
+    timestamps) narrow the results. Pages are ?limit= (at most 50) and
+    ?offset=, the response carries the next_offset to request or null.
+    """
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({"error": "q is required"}), 400
+    limit = request.args.get('limit', 20, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    if limit <= 0 or offset < 0:
+        return jsonify({"error": "limit and offset must be positive"}), 400
+    limit = min(limit, MAX_SEARCH_PAGE)
+    if offset > MAX_SEARCH_OFFSET:
+        return jsonify({"error": f"offset must be at most {MAX_SEARCH_OFFSET}, narrow the search instead"}), 400
+
+    try:
+        hits, more = search_backend().search(
+            text, offset=offset, limit=limit,
+            username=request.args.get('username'), article=request.args.get('article'),
+            since=request.args.get('since'), until=request.args.get('until')
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"results": hits, "next_offset": offset + limit if more else None})
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape endpoint"""
+    samples = metrics.registry.merged_samples(METRICS_DIR) if METRICS_DIR else None
+    return Response(metrics.registry.render(samples), content_type=metrics.CONTENT_TYPE)
+
+@api.route('/api/trending', methods=['GET'])
+def get_trending():
+    """Articles with the most new comments and replies in ?window= (1h, 24h, 7d or all)"""
+    window = request.args.get('window', '24h')
+    if window not in TRENDING_WINDOWS:
+        return jsonify({"error": f"window must be one of {', '.join(TRENDING_WINDOWS)}"}), 400
+    limit = request.args.get('limit', 10, type=int)
+    if limit <= 0:
+        return jsonify({"error": "limit must be positive"}), 400
 
-@app.route('/api/comments/<comment_id>', methods=['DELETE'])
+    try:
+        articles, refreshed_at = trending.top(window, min(limit, trending.size))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"window": window, "articles": articles, "refreshedAt": refreshed_at.isoformat()})
+
+@api.route('/api/comments/<comment_id>', methods=['DELETE'])
 def delete_comment(comment_id):
     # Check if user is logged in
-    user = session.get('user')
+    user = current_user()
     if not user:
         return jsonify({"error": "You must be logged in to delete comments"}), 401
     
     # Check if user is a moderator
-    email = user.get("email", "")
-    is_moderator = email == "moderator@hw3.com" or user.get('is_moderator', False)
+    is_moderator = user['is_moderator']
     
     if not is_moderator:
         return jsonify({"error": "Only moderators can delete comments"}), 403
     
     try:
-        # Find the comment (to verify it exists)
-        comment = db.comments.find_one({'_id': ObjectId(comment_id)})
-        if not comment:
-            return jsonify({'error': 'Comment not found'}), 404
-        
-        # Get the article title for statistics updates
-        article_title = comment.get('articleTitle')
-        
-        # Mark as deleted instead of actually deleting
-        result = db.comments.update_one(
-            {'_id': ObjectId(comment_id)},
-            {'$set': {
-                'text': "[Comment removed by a moderator]",
-                'removed_at': datetime.now().isoformat(),
-                'removed_by': user.get('username')
-            }}
-        )
+        # Mark as deleted instead of actually deleting. Only a comment that is
+        # still visible matches, so removing it twice never decrements twice.
+        removal = moderation_changes('remove', 'comment', user.get('username'))
+        with counted_write(db, USE_TRANSACTIONS) as txn:
+            comment = db.comments.find_one_and_update(
+                {'_id': ObjectId(comment_id), 'removed_at': {'$exists': False}},
+                {'$set': removal},
+                projection={'articleTitle': 1},
+                session=txn
+            )
+            if comment:
+                adjust_count(db, comment.get('articleTitle'), -1, session=txn, activity=activity_buffer)
         
-        if result.modified_count == 1:
-            print(f"Comment {comment_id} successfully updated to show removal message")
+        if comment:
+            _article_changed(comment.get('articleTitle'), update_event('comment', comment_id, None, removal))
+            log_event(logger, logging.INFO, 'comment_removed', comment_id=comment_id, moderator=user.get('username'))
             return jsonify({'message': 'Comment removed successfully'}), 200
-        else:
-            print(f"Failed to update comment {comment_id}")
-            return jsonify({'error': 'Failed to remove comment'}), 500
+        if db.comments.find_one({'_id': ObjectId(comment_id)}, {'_id': 1}):
+            return jsonify({'message': 'Comment already removed'}), 200
+        return jsonify({'error': 'Comment not found'}), 404
     
     except Exception as e:
-        print(f"Error in delete_comment: {str(e)}")
+        log_event(logger, logging.ERROR, 'delete_comment_failed', comment_id=comment_id, error=str(e))
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/comments/<comment_id>', methods=['PUT'])
+@api.route('/api/comments/<comment_id>', methods=['PUT'])
 def update_comment(comment_id):
     data = request.json
     if not data or 'comment' not in data:
         return jsonify({'error': 'Invalid data'}), 400
 
-    result = db.comments.update_one(
-        {'_id': ObjectId(comment_id)},
-        {'$set': {'text': data['comment'], 'updated_at': datetime.utcnow()}}
-    )
-    if result.matched_count == 1:
+    changes = {'text': data['comment'], 'updated_at': datetime.utcnow()}
+    with counted_write(db, USE_TRANSACTIONS) as txn:
+        comment = db.comments.find_one_and_update(
+            {'_id': ObjectId(comment_id)}, {'$set': changes}, projection={'articleTitle': 1}, session=txn
+        )
+        if comment:
+            touch_article(db, comment.get('articleTitle'), session=txn)
+    if comment:
+        _article_changed(comment.get('articleTitle'), update_event('comment', comment_id, None, changes))
         return jsonify({'message': 'Comment updated'}), 200
     return jsonify({'error': 'Comment not found'}), 404
 
-@app.route('/api/comments/<comment_id>/replies/<reply_id>', methods=['DELETE'])
+@api.route('/api/comments/<comment_id>/replies/<reply_id>', methods=['DELETE'])
 def delete_reply(comment_id, reply_id):
-    user = session.get('user')
+    user = current_user()
     if not user:
         return jsonify({"error": "You must be logged in to delete replies"}), 401
-    email = user.get("email", "")
-    is_moderator = email == "moderator@hw3.com" or user.get('is_moderator', False)
-    
-    # DEBUG
-    print(f"DEBUG - Delete reply request from: {email}, is_moderator: {is_moderator}")
+    is_moderator = user['is_moderator']
+    log_event(logger, logging.DEBUG, 'delete_reply_request', username=user.get('username'),
+              is_moderator=is_moderator, reply_id=reply_id)
     
     if not is_moderator:
         return jsonify({"error": "Only moderators can delete replies"}), 403
         
-    # Verify the parent comment exists
-    comment = db.comments.find_one({'_id': ObjectId(comment_id)})
-    if not comment:
-        return jsonify({'error': 'Parent comment not found'}), 404
-    
-    result = db.comments.update_one(
-        {'_id': ObjectId(comment_id), 'replies._id': ObjectId(reply_id)},
-        {'$set': {
-            'replies.$.text': "",
-            'replies.$.removed_at': datetime.now().isoformat(),
-            'replies.$.removed_by': user.get('username')
-        }}
-    )
+    # The reply filter includes its comment, so no separate parent lookup is needed
+    removal = moderation_changes('remove', 'reply', user.get('username'))
+    with counted_write(db, USE_TRANSACTIONS) as txn:
+        reply = db.replies.find_one_and_update(
+            {'_id': ObjectId(reply_id), 'comment_id': ObjectId(comment_id), 'removed_at': {'$exists': False}},
+            {'$set': removal},
+            projection={'articleTitle': 1},
+            session=txn
+        )
+        if reply:
+            adjust_count(db, reply.get('articleTitle'), -1, session=txn, activity=activity_buffer)
     
-    if result.modified_count == 1:
+    if reply:
+        _article_changed(reply.get('articleTitle'), update_event('reply', reply_id, comment_id, removal))
         return jsonify({'message': 'Reply removed successfully'}), 200
+    if db.replies.find_one({'_id': ObjectId(reply_id), 'comment_id': ObjectId(comment_id)}, {'_id': 1}):
+        return jsonify({'message': 'Reply already removed'}), 200
     return jsonify({'error': 'Reply not found'}), 404
 
-@app.route('/api/comments/<comment_id>/redact', methods=['PUT'])
+@api.route('/api/comments/<comment_id>/redact', methods=['PUT'])
 def redact_comment(comment_id):
     """Redact a comment (moderators only)"""
     # Check if user is logged in
-    user = session.get('user')
+    user = current_user()
     if not user:
         return jsonify({"error": "You must be logged in to redact comments"}), 401
     
     # Check if user is a moderator
-    email = user.get("email", "")
-    is_moderator = email == "moderator@hw3.com" or user.get('is_moderator', False)
+    is_moderator = user['is_moderator']
     
     if not is_moderator:
         return jsonify({"error": "Only moderators can redact comments"}), 403
     
-    # Update the comment with redacted message
-    result = db.comments.update_one(
-        {'_id': ObjectId(comment_id)},
-        {'$set': {
-            'text': "[This comment has been redacted by a moderator]",
-            'redacted_at': datetime.now().isoformat(),
-            'redacted_by': user.get('username')
-        }}
-    )
+    # Update the comment with redacted message (returning its article for subscribers)
+    changes = moderation_changes('redact', 'comment', user.get('username'))
+    with counted_write(db, USE_TRANSACTIONS) as txn:
+        comment = db.comments.find_one_and_update(
+            {'_id': ObjectId(comment_id)}, {'$set': changes}, projection={'articleTitle': 1}, session=txn
+        )
+        if comment:
+            touch_article(db, comment.get('articleTitle'), session=txn)
     
-    if result.matched_count == 1:
+    if comment:
+        _article_changed(comment.get('articleTitle'), update_event('comment', comment_id, None, changes))
         return jsonify({'message': 'Comment redacted successfully'}), 200
     return jsonify({'error': 'Comment not found'}), 404
 
-@app.route('/api/comments/<comment_id>/replies/<reply_id>', methods=['PUT'])
+@api.route('/api/comments/<comment_id>/replies/<reply_id>', methods=['PUT'])
 def redact_reply(comment_id, reply_id):
     """Redact a reply (moderators only)"""
-    user = session.get('user')
+    user = current_user()
     if not user:
         return jsonify({"error": "You must be logged in to redact replies"}), 401
     
-    email = user.get("email", "")
-    is_moderator = email == "moderator@hw3.com" or user.get('is_moderator', False)
+    is_moderator = user['is_moderator']
     
     if not is_moderator:
         return jsonify({"error": "Only moderators can redact replies"}), 403
     
     # Update the reply with redacted message
-    result = db.comments.update_one(
-        {'_id': ObjectId(comment_id), 'replies._id': ObjectId(reply_id)},
-        {'$set': {
-            'replies.$.text': "[This reply has been redacted by a moderator]",
-            'replies.$.redacted_at': datetime.now().isoformat(),
-            'replies.$.redacted_by': user.get('username')
-        }}
-    )
+    changes = moderation_changes('redact', 'reply', user.get('username'))
+    with counted_write(db, USE_TRANSACTIONS) as txn:
+        reply = db.replies.find_one_and_update(
+            {'_id': ObjectId(reply_id), 'comment_id': ObjectId(comment_id)},
+            {'$set': changes},
+            projection={'articleTitle': 1},
+            session=txn
+        )
+        if reply:
+            touch_article(db, reply.get('articleTitle'), session=txn)
     
-    if result.matched_count == 1:
+    if reply:
+        _article_changed(reply.get('articleTitle'), update_event('reply', reply_id, comment_id, changes))
         return jsonify({'message': 'Reply redacted successfully'}), 200
     return jsonify({'error': 'Reply not found'}), 404
 
-@app.route('/api/comments/<comment_id>/partial-redact', methods=['PUT'])
+@api.route('/api/comments/<comment_id>/partial-redact', methods=['PUT'])
 def partial_redact_comment(comment_id):
     """Partially redact a comment (moderators only)"""
-    user = session.get('user')
+    user = current_user()
     if not user:
         return jsonify({"error": "You must be logged in to redact comments"}), 401
     
-    email = user.get("email", "")
-    is_moderator = email == "moderator@hw3.com" or user.get('is_moderator', False)
+    is_moderator = user['is_moderator']
     
     if not is_moderator:
         return jsonify({"error": "Only moderators can redact comments"}), 403
@@ -465,30 +1079,29 @@ def partial_redact_comment(comment_id):
         return jsonify({'error': 'No redacted text provided'}), 400
     
     # Update the comment with partially redacted text
-    result = db.comments.update_one(
-        {'_id': ObjectId(comment_id)},
-        {'$set': {
-            'text': data['redactedText'],
-            'partially_redacted_at': datetime.now().isoformat(),
-            'redacted_by': user.get('username')
-        }}
-    )
+    changes = moderation_changes('partial_redact', 'comment', user.get('username'), data['redactedText'])
+    with counted_write(db, USE_TRANSACTIONS) as txn:
+        comment = db.comments.find_one_and_update(
+            {'_id': ObjectId(comment_id)}, {'$set': changes}, projection={'articleTitle': 1}, session=txn
+        )
+        if comment:
+            touch_article(db, comment.get('articleTitle'), session=txn)
     
-    if result.matched_count == 1:
+    if comment:
+        _article_changed(comment.get('articleTitle'), update_event('comment', comment_id, None, changes))
         return jsonify({'message': 'Comment partially redacted successfully'}), 200
     return jsonify({'error': 'Comment not found'}), 404
 
-@app.route('/api/comments/<comment_id>/replies/<reply_id>/partial-redact', methods=['PUT'])
+@api.route('/api/comments/<comment_id>/replies/<reply_id>/partial-redact', methods=['PUT'])
 def partial_redact_reply(comment_id, reply_id):
     """Partially redact a reply (moderators only)"""
     # Check if user is logged in
-    user = session.get('user')
+    user = current_user()
     if not user:
         return jsonify({"error": "You must be logged in to redact replies"}), 401
     
     # Check if user is a moderator
-    email = user.get("email", "")
-    is_moderator = email == "moderator@hw3.com" or user.get('is_moderator', False)
+    is_moderator = user['is_moderator']
     
     if not is_moderator:
         return jsonify({"error": "Only moderators can redact replies"}), 403
@@ -499,20 +1112,58 @@ def partial_redact_reply(comment_id, reply_id):
         return jsonify({'error': 'No redacted text provided'}), 400
     
     # Update the reply with partially redacted text
-    result = db.comments.update_one(
-        {'_id': ObjectId(comment_id), 'replies._id': ObjectId(reply_id)},
-        {'$set': {
-            'replies.$.text': data['redactedText'],
-            'replies.$.partially_redacted_at': datetime.now().isoformat(),
-            'replies.$.redacted_by': user.get('username')
-        }}
-    )
+    changes = moderation_changes('partial_redact', 'reply', user.get('username'), data['redactedText'])
+    with counted_write(db, USE_TRANSACTIONS) as txn:
+        reply = db.replies.find_one_and_update(
+            {'_id': ObjectId(reply_id), 'comment_id': ObjectId(comment_id)},
+            {'$set': changes},
+            projection={'articleTitle': 1},
+            session=txn
+        )
+        if reply:
+            touch_article(db, reply.get('articleTitle'), session=txn)
     
-    if result.matched_count == 1:
+    if reply:
+        _article_changed(reply.get('articleTitle'), update_event('reply', reply_id, comment_id, changes))
         return jsonify({'message': 'Reply partially redacted successfully'}), 200
     return jsonify({'error': 'Reply not found'}), 404
 
-@app.route('/api/articles', methods=['GET'])
+@api.route('/api/moderation/bulk', methods=['POST'])
+def bulk_moderate():
+    """Apply many remove/redact/partial_redact actions in one request (moderators only)
+
+    Body: {"actions": [...]}, see moderation.py for the action shapes. Actions
+    are independent (unordered); the response has one result per action.
+    """
+    user = current_user()
+    if not user:
+        return jsonify({"error": "You must be logged in to moderate"}), 401
+    if not user['is_moderator']:
+        return jsonify({"error": "Only moderators can moderate"}), 403
+
+    data = request.get_json(silent=True)
+    actions = data.get('actions') if isinstance(data, dict) else None
+    if not isinstance(actions, list) or not actions:
+        return jsonify({"error": "actions must be a non-empty list"}), 400
+    if len(actions) > MAX_BULK_ACTIONS:
+        return jsonify({"error": f"At most {MAX_BULK_ACTIONS} actions per request"}), 400
+
+    try:
+        with counted_write(db, USE_TRANSACTIONS) as txn:
+            results, events = run_bulk(db, actions, user.get('username'), session=txn)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    for article_title, event in events:
+        _article_changed(article_title, event)
+
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return jsonify({"results": results, "summary": summary}), 200
+
+@api.route('/api/articles', methods=['GET'])
+@rate_limited('articles')
 def get_articles():
     """Get articles from NYT API"""
     try:
@@ -520,23 +1171,80 @@ def get_articles():
         page = request.args.get('page', '0')
         query = request.args.get('q', 'davis+sacramento')  # Default query is "davis+sacramento"
         
-        # Get API key from environment variable
-        nyt_api_key = os.getenv('NYT_API_KEY')
-        if not nyt_api_key:
+        # NYT_API_KEY, from the environment or create_app's config
+        if not nyt_cache.api_key_getter():
             return jsonify({"error": "API key not found"}), 500
         
-        # Make request to NYT API
-        import requests
-        url = f"https://api.nytimes.com/svc/search/v2/articlesearch.json?q={query}&page={page}&api-key={nyt_api_key}"
-        response = requests.get(url)
+        # Prefetched searches come straight from memory, anything else from the shared cache
+        article_prefetch.ensure_started()
+        body, cache_status = article_prefetch.get(query, page), 'PREFETCHED'
+        if body is None:
+            try:
+                body, cache_status = nyt_cache.get(query, page)
+            except UpstreamError as e:
+                return jsonify({"error": str(e)}), e.status_code
         
-        if response.status_code == 200:
-            return jsonify(response.json()), 200
-        else:
-            return jsonify({"error": f"NYT API returned status code {response.status_code}"}), response.status_code
+        response = current_app.response_class(body, status=200, mimetype='application/json')
+        response.headers['X-Cache'] = cache_status
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@api.cli.command('init-db')
+def init_db_command():
+    """Create the MongoDB indexes used by the API and migrate embedded replies"""
+    names = ensure_indexes(db)
+    print(f"Indexes ready: {', '.join(names)}")
+    migrated = reply_store.migrate_embedded_replies(db)
+    print(f"Moved embedded replies out of {migrated} comments")
+
+@api.cli.command('migrate-article-keys')
+def migrate_article_keys_command():
+    """Key every document by articleKey and drop the indexes on the full headline"""
+    updated = backfill_article_keys(db)
+    print('Keyed ' + ', '.join(f"{count} {collection}" for collection, count in updated.items()))
+    names = ensure_indexes(db)
+    print(f"Indexes ready: {', '.join(names)}")
+    dropped = drop_retired_indexes(db)
+    print(f"Dropped {', '.join(dropped) or 'no'} headline indexes")
+
+@api.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute article_stats from the comments and replies collections"""
+    articles = rebuild_article_stats(db)
+    print(f"Rebuilt comment counts for {articles} articles")
+
+@api.cli.command('check-indexes')
+def check_indexes_command():
+    """Fail if any hot query is answered by a collection scan"""
+    failures = check_query_plans(db)
+    if failures:
+        raise SystemExit(f"COLLSCAN in query plan for: {', '.join(failures)}")
+    print("All hot queries use an index")
+
+def create_app(config=None):
+    """A configured Flask app serving the API
+
+    config is applied to app.config and, under the environment variable
+    names (e.g. {'RATE_LIMIT_BACKEND': 'off'}), to the services it builds.
+    """
+    configure_logging()
+    app = Flask(__name__)
+    # Use a fixed secret key instead of randomly generating it on each restart
+    settings = ChainMap(dict(config or {}), os.environ)
+    app.secret_key = settings.get('FLASK_SECRET_KEY', 'dev_secret_key_for_testing')
+    app.config.update(config or {})
+    init_services(settings)
+    CORS(app)  # Enable CORS for all routes
+    app.json = MongoJSONProvider(app)  # jsonify encodes ObjectIds and datetimes itself, see serialization.py
+    app.after_request(compress_response)  # gzip/br for JSON responses, see compression.py
+    if _session_interface is not None:
+        app.session_interface = _session_interface
+    app.register_blueprint(api)
+    return app
+
 # docker-compose -f docker-compose.dev.yml down -v
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=8000)
\ No newline at end of file
+    ensure_indexes(db)
+    reply_store.migrate_embedded_replies(db)
+    create_app().run(debug=True, host='0.0.0.0', port=8000)
\ No newline at end of file
@@ -0,0 +1,239 @@
+'''
+Comment counters kept in the article_stats collection.
+
+Every visible comment and reply counts once towards its article; moderator
+removals take it back out. Each article document also carries a `version`
+that goes up with every write to its comments or replies, which the API turns
+into ETags (see http_cache.py). Writes that change the count go through
+counted_write() so the document write and the counter move together (inside
+a transaction when the deployment supports it). rebuild_article_stats()
+recomputes every counter from the comments and replies collections to repair
+any drift left by writes that failed halfway.
+
+Count changes are also recorded per article in ACTIVITY_BUCKET_SECONDS
+slices in article_activity ({articleKey, articleTitle, bucket, count},
+expired by a TTL index), which the trending leaderboard sums over its
+windows (trending.py). Single writes hand their change to an ActivityBuffer,
+which tallies them in memory and writes them with one bulk_write every few
+seconds, so a comment costs one counter write rather than two. The tally of
+a process that dies between flushes is lost; it only feeds rankings, the
+comment counts themselves are written with the document.
+
+Both collections are keyed by articleKey (articles.py); the headline is
+kept alongside it for display.
+'''
+
+import logging
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from articles import article_key, backfill_article_keys
+
+logger = logging.getLogger(__name__)
+
+VISIBLE = {'removed_at': {'$exists': False}}
+
+ACTIVITY_BUCKET_SECONDS = 600
+ACTIVITY_RETENTION_SECONDS = 8 * 24 * 3600
+
+
+def activity_bucket(now=None):
+    """Start of the activity slice containing now (UTC)"""
+    now = now or datetime.now(timezone.utc)
+    seconds = int(now.timestamp()) // ACTIVITY_BUCKET_SECONDS * ACTIVITY_BUCKET_SECONDS
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+
+def _activity_op(article_title, delta, bucket):
+    return UpdateOne({'articleKey': article_key(article_title), 'bucket': bucket},
+                     {'$inc': {'count': delta}, '$set': {'articleTitle': article_title}}, upsert=True)
+
+
+def _stats_op(article_title, delta):
+    return UpdateOne({'articleKey': article_key(article_title)},
+                     {'$inc': {'commentCount': delta, 'version': 1}, '$set': {'articleTitle': article_title}},
+                     upsert=True)
+
+
+class ActivityBuffer:
+    """article_activity changes waiting for the next flush, {(title, bucket): delta}"""
+
+    def __init__(self, db_getter, flush_interval=2.0):
+        self.db_getter = db_getter
+        self.flush_interval = flush_interval
+        self._pending = defaultdict(int)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pid = None
+
+    def add(self, article_title, delta):
+        self._ensure_started()
+        with self._lock:
+            self._pending[(article_title, activity_bucket())] += delta
+
+    def flush(self):
+        """Write the tally so far with one bulk_write, returns the number of buckets written"""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+        ops = [_activity_op(title, delta, bucket) for (title, bucket), delta in pending.items() if delta]
+        if not ops:
+            return 0
+        try:
+            self.db_getter().article_activity.bulk_write(ops, ordered=False)
+        except PyMongoError:
+            # Keep the tally for the next flush ($inc upserts are not idempotent, so a partial write may count twice)
+            with self._lock:
+                for key, delta in pending.items():
+                    self._pending[key] += delta
+            raise
+        return len(ops)
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+
+    def _ensure_started(self):
+        # Started lazily so forked workers get their own flusher
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pending.clear()
+            self._stop.clear()
+            threading.Thread(target=self._run, name='activity-flush', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except PyMongoError:
+                logger.exception("activity flush failed, retrying with the next one")
+
+    def close(self):
+        """Write what is left and stop the flusher (worker shutdown)"""
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._pid = None
+        try:
+            self.flush()
+        except PyMongoError:
+            logger.exception("final activity flush failed")
+
+
+def adjust_count(db, article_title, delta, session=None, activity=None):
+    """Move an article's comment count by delta, bump its version and record the activity
+
+    With an ActivityBuffer the activity is left to its next flush, otherwise
+    it is written here.
+    """
+    if not article_title or not delta:
+        return
+    key = article_key(article_title)
+    db.article_stats.update_one(
+        {'articleKey': key},
+        {'$inc': {'commentCount': delta, 'version': 1}, '$set': {'articleTitle': article_title}},
+        upsert=True,
+        session=session
+    )
+    if activity is not None:
+        activity.add(article_title, delta)
+        return
+    db.article_activity.update_one(
+        {'articleKey': key, 'bucket': activity_bucket()},
+        {'$inc': {'count': delta}, '$set': {'articleTitle': article_title}},
+        upsert=True,
+        session=session
+    )
+
+
+def apply_count_deltas(db, deltas, session=None):
+    """adjust_count for many articles at once ({title: delta}), one bulk write per collection
+
+    Every listed article gets a new version, even with a delta of 0.
+    """
+    deltas = {title: delta for title, delta in deltas.items() if title}
+    if not deltas:
+        return
+    db.article_stats.bulk_write([_stats_op(title, delta) for title, delta in deltas.items()],
+                                ordered=False, session=session)
+    bucket = activity_bucket()
+    activity = [_activity_op(title, delta, bucket) for title, delta in deltas.items() if delta]
+    if activity:
+        db.article_activity.bulk_write(activity, ordered=False, session=session)
+
+
+def touch_article(db, article_title, session=None):
+    """Bump an article's version after a write that leaves the count alone (edits, redactions)"""
+    if not article_title:
+        return
+    db.article_stats.update_one(
+        {'articleKey': article_key(article_title)},
+        {'$inc': {'version': 1}, '$set': {'articleTitle': article_title}},
+        upsert=True,
+        session=session
+    )
+
+
+@contextmanager
+def counted_write(db, use_transactions=False):
+    """Yield the session to pass to the document write and adjust_count/touch_article
+
+    With use_transactions (replica sets only) both writes commit or abort
+    together. Otherwise this yields None and the writes are applied in order,
+    leaving rebuild_article_stats() to fix a counter if the second one fails.
+    """
+    if not use_transactions:
+        yield None
+        return
+    with db.client.start_session() as session:
+        with session.start_transaction():
+            yield session
+
+
+def _visible_counts(collection):
+    """{articleKey: (count, a headline)} over visible documents"""
+    pipeline = [
+        {'$match': dict(VISIBLE, articleKey={'$ne': None})},
+        {'$group': {'_id': '$articleKey', 'count': {'$sum': 1}, 'title': {'$last': '$articleTitle'}}}
+    ]
+    return {row['_id']: (row['count'], row['title']) for row in collection.aggregate(pipeline)}
+
+
+def rebuild_article_stats(db, batch_size=1000):
+    """Recompute every article's commentCount from comments and replies
+
+    Returns the number of articles with at least one visible comment.
+    Documents written before article keys existed are keyed first.
+    """
+    backfill_article_keys(db, batch_size)
+    counts = _visible_counts(db.comments)
+    for key, (count, title) in _visible_counts(db.replies).items():
+        total, known_title = counts.get(key, (0, title))
+        counts[key] = (total + count, known_title)
+
+    rebuilt_at = datetime.now().isoformat()
+    ops = [
+        UpdateOne({'articleKey': key},
+                  {'$set': {'commentCount': count, 'articleTitle': title, 'rebuiltAt': rebuilt_at},
+                   '$inc': {'version': 1}},
+                  upsert=True)
+        for key, (count, title) in counts.items()
+    ]
+    for start in range(0, len(ops), batch_size):
+        db.article_stats.bulk_write(ops[start:start + batch_size], ordered=False)
+
+    # Articles whose comments were all removed no longer show up in the aggregation
+    db.article_stats.update_many(
+        {'rebuiltAt': {'$ne': rebuilt_at}},
+        {'$set': {'commentCount': 0, 'rebuiltAt': rebuilt_at}, '$inc': {'version': 1}}
+    )
+    return len(counts)
@@ -0,0 +1,74 @@
+'''
+Article identity.
+
+Comments, replies, article_stats and article_activity used to be joined on
+`articleTitle`, the full NYT headline. They now carry an `articleKey`: "ak_"
+plus 16 hex digits of a BLAKE2b hash of the headline after Unicode (NFC) and
+whitespace normalization. It is fixed width (19 characters), so index entries
+stay small, and it is derived from the headline alone, so any process can
+compute it without a lookup. The NYT document URI would be more stable, but
+existing comments only record the headline, so the hash is the identity the
+stored data can be migrated to. `articleTitle` stays on the documents for
+display.
+
+Routes that take an article accept either form, see to_article_key().
+backfill_article_keys() adds the key to documents written before it existed.
+ensure_indexes() runs it before building the articleKey indexes; `flask
+migrate-article-keys` also drops the old indexes on the headline.
+'''
+
+import functools
+import hashlib
+import re
+import unicodedata
+
+from pymongo import UpdateOne
+
+KEY_PREFIX = 'ak_'
+KEY_PATTERN = re.compile(r'^ak_[0-9a-f]{16}$')
+
+# Every collection that references an article
+KEYED_COLLECTIONS = ('comments', 'replies', 'article_stats', 'article_activity')
+
+
+def normalize_title(title):
+    """The headline as hashed: NFC, whitespace runs collapsed, no leading or trailing spaces"""
+    return ' '.join(unicodedata.normalize('NFC', title).split())
+
+
+@functools.lru_cache(maxsize=4096)
+def article_key(title):
+    """Fixed-width key of a headline"""
+    digest = hashlib.blake2b(normalize_title(title).encode('utf-8'), digest_size=8).hexdigest()
+    return KEY_PREFIX + digest
+
+
+def is_article_key(value):
+    return isinstance(value, str) and KEY_PATTERN.match(value) is not None
+
+
+def to_article_key(value):
+    """The key for a route parameter that is either a key already or a headline"""
+    return value if is_article_key(value) else article_key(value)
+
+
+def backfill_article_keys(db, batch_size=1000):
+    """Set articleKey on every document that only has an articleTitle
+
+    Idempotent, returns {collection: documents updated}.
+    """
+    updated = {}
+    for name in KEYED_COLLECTIONS:
+        collection = db[name]
+        cursor = collection.find({'articleKey': {'$exists': False}, 'articleTitle': {'$type': 'string'}},
+                                 {'articleTitle': 1}).batch_size(batch_size)
+        ops, total = [], 0
+        for doc in cursor:
+            ops.append(UpdateOne({'_id': doc['_id']}, {'$set': {'articleKey': article_key(doc['articleTitle'])}}))
+            if len(ops) >= batch_size:
+                total += collection.bulk_write(ops, ordered=False).modified_count
+                ops = []
+        if ops:
+            total += collection.bulk_write(ops, ordered=False).modified_count
+        updated[name] = total
+    return updated
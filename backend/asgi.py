@@ -0,0 +1,416 @@
+'''
+Async serving mode: uvicorn asgi:app --workers N
+
+The read endpoints that mostly wait on NYT or MongoDB run natively on the
+event loop with Motor and httpx, so one process can hold thousands of them in
+flight. Every other route (login, posting, moderation, static files) is handed
+to the regular Flask app through a WSGI adapter, so clients see the same
+routes and JSON contracts in both modes.
+
+The comment event stream (/api/comments/<title>/events) only exists here: a
+Server-Sent Events connection stays open as long as the sidebar does, and
+under gunicorn each one would hold a worker thread. The WSGI app answers it
+with 404, and the frontend falls back to refetching after writes.
+
+Extra dependencies are listed in requirements-async.txt.
+'''
+
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+from asgiref.wsgi import WsgiToAsgi
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as flask_module
+import metrics
+import reply_store
+from articles import to_article_key
+from events import LoopRelay, broker, hello_frame
+from compression import CompressionMiddleware
+from http_cache import REVALIDATE, article_etag
+from nyt_cache import AsyncNYTArticleCache, UpstreamError
+from ratelimit import client_key
+from serialization import to_json
+
+# Routes without an async twin, building it also builds the services used below (app.init_services)
+flask_app = flask_module.create_app()
+
+# Seconds between keep-alive comments on idle event streams
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+
+nyt_cache = AsyncNYTArticleCache(
+    api_key_getter=lambda: flask_module.nyt_cache.api_key_getter(),
+    base_url=flask_module.nyt_cache.base_url,
+    ttl=flask_module.nyt_cache.ttl,
+    stale_ttl=flask_module.nyt_cache.stale_ttl,
+    max_entries=flask_module.nyt_cache.max_entries,
+    max_bytes=flask_module.nyt_cache.max_bytes,
+    timeout=flask_module.nyt_cache.timeout,
+    transform=flask_module.nyt_cache.transform,
+    on_upstream=flask_module.nyt_cache.on_upstream,
+)
+
+mongo = {}
+relays = {}
+
+
+def get_db():
+    # Created inside the running loop (one per worker process)
+    if 'db' not in mongo:
+        mongo['client'] = AsyncIOMotorClient(flask_module.mongo_uri, event_listeners=[metrics.mongo_metrics],
+                                             **flask_module.MONGO_POOL_OPTIONS)
+        mongo['db'] = mongo['client'].nyt_comments_db
+    return mongo['db']
+
+
+class MongoJSONResponse(JSONResponse):
+    """Encoded like the Flask app's jsonify: ObjectIds and datetimes as they are, see serialization.py"""
+
+    def render(self, content):
+        return to_json(content)
+
+
+def error(message, status):
+    return MongoJSONResponse({"error": message}, status_code=status)
+
+
+async def article_version(db, article_key):
+    """Same version cache as the Flask app, loaded through Motor on a miss"""
+    versions = flask_module.article_versions
+    version, token = versions.peek(article_key)
+    if version is None:
+        stats = await db.article_stats.find_one({'articleKey': article_key}, {'version': 1})
+        version = stats.get('version', 0) if stats else 0
+        versions.store(article_key, version, token)
+    return version
+
+
+def not_modified(request, etag):
+    header = request.headers.get('if-none-match')
+    if not header:
+        return None
+    tags = [tag.strip() for tag in header.split(',')]
+    if '*' in tags or f'"{etag}"' in tags or f'W/"{etag}"' in tags:
+        return Response(status_code=304, headers={'ETag': f'"{etag}"', 'Cache-Control': REVALIDATE})
+    return None
+
+
+def validated(response, etag):
+    response.headers['ETag'] = f'"{etag}"'
+    response.headers['Cache-Control'] = REVALIDATE
+    return response
+
+
+async def over_limit(request, policy):
+    """app.rate_limited for native routes (keyed by IP, these do not read the session), 429 or None"""
+    limiter = flask_module.rate_limiter
+    if limiter is None:
+        return None
+    key = client_key('ip', None, request.client.host if request.client else None,
+                     request.headers.get('x-forwarded-for'), flask_module.RATE_LIMIT_PROXY_HOPS)
+    if limiter.buckets.blocking:
+        allowed, retry_after = await run_in_threadpool(limiter.hit, policy, key)
+    else:
+        allowed, retry_after = limiter.hit(policy, key)
+    if allowed:
+        return None
+    return MongoJSONResponse({"error": "Too many requests, try again later"}, status_code=429,
+                        headers={'Retry-After': str(max(1, math.ceil(retry_after)))})
+
+
+async def get_articles(request):
+    """Get articles from NYT API"""
+    limited = await over_limit(request, 'articles')
+    if limited is not None:
+        return limited
+    try:
+        page = request.query_params.get('page', '0')
+        query = request.query_params.get('q', 'davis+sacramento')
+        if not nyt_cache.api_key_getter():
+            return error("API key not found", 500)
+        prefetch = flask_module.article_prefetch
+        prefetch.ensure_started()
+        body, cache_status = prefetch.get(query, page), 'PREFETCHED'
+        if body is None:
+            try:
+                body, cache_status = await nyt_cache.get(query, page)
+            except UpstreamError as e:
+                return error(str(e), e.status_code)
+        return Response(body, media_type='application/json', headers={'X-Cache': cache_status})
+    except Exception as e:
+        return error(str(e), 500)
+
+
+async def get_comments(request):
+    """Async twin of app.get_comments, same parameters and response shapes"""
+    try:
+        db = get_db()
+        key = to_article_key(request.path_params['article_title'])
+        args = request.query_params
+        replies_mode = args.get('replies', 'full')
+        if replies_mode not in flask_module.REPLIES_MODES:
+            return error("replies must be 'full', 'count' or 'tree'", 400)
+        try:
+            limit = int(args['limit']) if 'limit' in args else None
+        except ValueError:
+            limit = None
+        if limit is not None and limit <= 0:
+            return error("limit must be a positive integer", 400)
+        cursor = args.get('cursor')
+
+        version = await article_version(db, key)
+        variant = request.url.query.encode()
+        etag = article_etag(key, version, variant)
+        unchanged = not_modified(request, etag)
+        if unchanged:
+            return unchanged
+        snapshots = flask_module.thread_snapshots
+        if replies_mode == 'tree':
+            snapshot = snapshots.get(key, version, variant)
+            if snapshot is not None:
+                return validated(Response(snapshot, media_type='application/json'), etag)
+
+        query = {'articleKey': key}
+        if cursor:
+            try:
+                after_timestamp, after_id = flask_module._decode_cursor(cursor)
+            except Exception:
+                return error("Invalid cursor", 400)
+            query['$or'] = [
+                {'timestamp': {'$gt': after_timestamp}},
+                {'timestamp': after_timestamp, '_id': {'$gt': after_id}}
+            ]
+
+        paginate = limit is not None or cursor is not None
+        if paginate:
+            limit = min(limit or flask_module.MAX_COMMENTS_PAGE, flask_module.MAX_COMMENTS_PAGE)
+
+        cursor_obj = db.comments.find(query, {'replies': 0})
+        if paginate:
+            cursor_obj = cursor_obj.sort([('timestamp', 1), ('_id', 1)]).limit(limit + 1)
+        comments = await cursor_obj.to_list(None)
+
+        next_cursor = None
+        if paginate and len(comments) > limit:
+            comments = comments[:limit]
+            next_cursor = flask_module._encode_cursor(comments[-1])
+
+        comment_ids = [comment['_id'] for comment in comments]
+        if replies_mode == 'count':
+            counts = {comment_id: 0 for comment_id in comment_ids}
+            pipeline = [
+                {'$match': {'comment_id': {'$in': comment_ids}}},
+                {'$group': {'_id': '$comment_id', 'count': {'$sum': 1}}}
+            ]
+            async for row in db.replies.aggregate(pipeline):
+                counts[row['_id']] = row['count']
+            for comment in comments:
+                comment['replyCount'] = counts[comment['_id']]
+        else:
+            grouped = {comment_id: [] for comment_id in comment_ids}
+            if comment_ids:
+                replies = db.replies.find({'comment_id': {'$in': comment_ids}}).sort([('timestamp', 1), ('_id', 1)])
+                async for reply in replies:
+                    grouped.setdefault(reply['comment_id'], []).append(reply)
+            for comment in comments:
+                if replies_mode == 'tree':
+                    comment['replies'] = reply_store.nest_replies(grouped[comment['_id']])
+                else:
+                    comment['replies'] = [reply_store.to_client(reply) for reply in grouped[comment['_id']]]
+
+        response = MongoJSONResponse(comments if not paginate else {"comments": comments, "next_cursor": next_cursor})
+        if replies_mode == 'tree':
+            snapshots.put(key, version, variant, response.body)
+        return validated(response, etag)
+    except Exception as e:
+        return error(str(e), 500)
+
+
+async def get_replies(request):
+    """Async twin of app.get_replies"""
+    try:
+        db = get_db()
+        comment_id = ObjectId(request.path_params['comment_id'])
+        query = {'comment_id': comment_id}
+        if 'depth' in request.query_params:
+            query['depth'] = int(request.query_params['depth'])
+        projection = {field: 0 for field in reply_store.INTERNAL_FIELDS}
+        replies = await db.replies.find(query, projection).sort([('timestamp', 1), ('_id', 1)]).to_list(None)
+        if not replies and not await db.comments.find_one({'_id': comment_id}, {'_id': 1}):
+            return error("Comment not found", 404)
+        return MongoJSONResponse([reply_store.to_client(reply) for reply in replies])
+    except Exception as e:
+        return error(str(e), 500)
+
+
+async def get_comment_count(request):
+    """Get the comment count for a specific article"""
+    try:
+        db = get_db()
+        key = to_article_key(request.path_params['article_title'])
+        etag = article_etag(key, await article_version(db, key), b'count')
+        unchanged = not_modified(request, etag)
+        if unchanged:
+            return unchanged
+        stats = await db.article_stats.find_one({'articleKey': key})
+        count = stats['commentCount'] if stats else 0
+        if not stats:
+            count = await db.comments.count_documents({'articleKey': key})
+        return validated(MongoJSONResponse({"count": count}), etag)
+    except Exception as e:
+        return error(str(e), 500)
+
+
+async def get_comment_counts(request):
+    """Async twin of app.get_comment_counts"""
+    try:
+        db = get_db()
+        data = await request.json()
+        titles = data.get('titles') if isinstance(data, dict) else None
+        if not isinstance(titles, list) or not all(isinstance(t, str) for t in titles):
+            return error("titles must be a list of article titles", 400)
+        if len(titles) > flask_module.MAX_COUNT_TITLES:
+            return error(f"At most {flask_module.MAX_COUNT_TITLES} titles per request", 400)
+
+        titles = list(dict.fromkeys(titles))
+        counts = {title: 0 for title in titles}
+        if not titles:
+            return MongoJSONResponse({"counts": counts})
+
+        requested = {}
+        for title in titles:
+            requested.setdefault(to_article_key(title), []).append(title)
+        missing = set(requested)
+        stats = db.article_stats.find({'articleKey': {'$in': list(requested)}},
+                                      {'_id': 0, 'articleKey': 1, 'commentCount': 1})
+        async for row in stats:
+            for title in requested[row['articleKey']]:
+                counts[title] = row.get('commentCount', 0)
+            missing.discard(row['articleKey'])
+        if missing:
+            pipeline = [
+                {'$match': {'articleKey': {'$in': list(missing)}}},
+                {'$group': {'_id': '$articleKey', 'count': {'$sum': 1}}}
+            ]
+            async for row in db.comments.aggregate(pipeline):
+                for title in requested[row['_id']]:
+                    counts[title] = row['count']
+        return MongoJSONResponse({"counts": counts})
+    except Exception as e:
+        return error(str(e), 500)
+
+
+def get_relay():
+    loop = asyncio.get_running_loop()
+    if loop not in relays:
+        relays[loop] = LoopRelay(broker, loop)
+    return relays[loop]
+
+
+async def stream_comment_events(request):
+    """Push new comments, replies and moderation changes for one article (Server-Sent Events)
+
+    Each message is a JSON delta, see events.py. Clients keep their loaded
+    thread up to date from these instead of re-polling /api/comments. The
+    article is given by its headline or its article key. An idle subscriber
+    costs one queue.
+    """
+    article_title = request.path_params['article_title']
+    if flask_module.CHANGE_STREAMS:
+        broker.ensure_watcher(lambda: flask_module.db)
+    relay = get_relay()
+    inbox = asyncio.Queue()
+    relay.add(article_title, inbox)
+
+    async def generate():
+        try:
+            yield "retry: 3000\n\n"
+            yield hello_frame(broker.watching())
+            while True:
+                try:
+                    yield await asyncio.wait_for(inbox.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+        finally:
+            relay.remove(article_title, inbox)
+
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+class RequestMetricsMiddleware:
+    """app.py's request metrics for the native routes, which never run the Flask hooks
+
+    Routes handed to the Flask app are left to its own hooks. MongoDB time is
+    not totalled per request here: Motor runs commands on its own threads, so
+    they only show up in mongo_command_duration_seconds.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        if flask_module.METRICS_DIR:
+            metrics.registry.ensure_snapshots(flask_module.METRICS_DIR, flask_module.METRICS_SNAPSHOT_INTERVAL)
+
+        observed = []
+
+        def observe(status):
+            route = scope.get('route')  # set by the router on the scope it was given
+            if isinstance(route, Route) and not observed:
+                observed.append(status)
+                # Labelled like the Flask rule, e.g. /api/comments/<article_title>
+                label = route.path.replace('{', '<').replace('}', '>')
+                metrics.request_duration.observe(time.perf_counter() - started, route=label,
+                                                 method=scope['method'], status=str(status))
+
+        # Streamed responses (event streams) are timed until their headers are ready
+        async def send_timed(message):
+            if message['type'] == 'http.response.start':
+                observe(message['status'])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        except Exception:
+            observe(500)
+            raise
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    yield
+    await nyt_cache.aclose()
+    if 'client' in mongo:
+        mongo.pop('client').close()
+        mongo.pop('db', None)
+
+
+# Async routes are matched first; anything else (including other methods on
+# the same paths) falls through to the Flask app.
+routes = [
+    Route('/api/articles', get_articles, methods=['GET']),
+    Route('/api/comments/{article_title}', get_comments, methods=['GET']),
+    Route('/api/comments/{comment_id}/replies', get_replies, methods=['GET']),
+    Route('/api/comments/{article_title}/events', stream_comment_events, methods=['GET']),
+    Route('/api/comment-count/{article_title}', get_comment_count, methods=['GET']),
+    Route('/api/comment-counts', get_comment_counts, methods=['POST']),
+    Mount('/', app=WsgiToAsgi(flask_app)),
+]
+
+# JSON responses, native or from the Flask app, are compressed as in app.py
+app = Starlette(routes=routes, lifespan=lifespan,
+                middleware=[Middleware(RequestMetricsMiddleware), Middleware(CompressionMiddleware)])
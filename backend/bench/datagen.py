@@ -0,0 +1,102 @@
+'''
+Deterministic data for the benchmarks.
+
+seed(db, articles, comments, ...) fills comments, replies and article_stats
+with N articles, M comments spread over them with a long tail (a few
+articles get most of the traffic, as on the real front page) and reply
+trees up to reply_depth levels deep under a share of the comments.
+
+    python bench/datagen.py --mongo-uri mongodb://localhost:27017/ --articles 200 --comments 20000
+'''
+
+import argparse
+import itertools
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bson.objectid import ObjectId  # noqa: E402
+
+import reply_store  # noqa: E402
+from articles import article_key  # noqa: E402
+from article_stats import rebuild_article_stats  # noqa: E402
+
+WORDS = ('city council budget vote traffic housing river levee school board transit fire season campus '
+         'tuition farm water drought downtown bike lane rent election mayor park').split()
+
+
+def article_title(n):
+    return f'Bench Article {n}'
+
+
+def seed(db, articles=100, comments=5000, threaded_share=0.2, replies_per_thread=6, reply_depth=4,
+         users=500, seed=11, batch_size=5000):
+    """Insert the corpus, returns the article titles (busiest first)"""
+    rng = random.Random(seed)
+    titles = [article_title(n) for n in range(articles)]
+    cum_weights = list(itertools.accumulate(1 / (n + 1) for n in range(articles)))
+    start = datetime(2025, 5, 1)
+
+    def text(words):
+        return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+    comment_batch, reply_batch = [], []
+    for n in range(comments):
+        title = rng.choices(titles, cum_weights=cum_weights)[0]
+        comment = {
+            '_id': ObjectId(),
+            'articleKey': article_key(title),
+            'articleTitle': title,
+            'username': f'user{rng.randrange(users)}',
+            'text': text(rng.randint(5, 60)),
+            'timestamp': (start + timedelta(seconds=n)).isoformat(),
+        }
+        comment_batch.append(comment)
+        if rng.random() < threaded_share:
+            # One chain reply_depth deep, the rest hang off random levels of it
+            chain = []
+            for i in range(replies_per_thread):
+                if i < reply_depth:
+                    parent = chain[-1] if chain else None
+                else:
+                    parent = rng.choice([None] + chain[:reply_depth - 1])
+                chain.append(reply_store.new_reply(comment['_id'], comment['articleTitle'],
+                                                   f'user{rng.randrange(users)}', text(rng.randint(3, 30)), parent))
+            reply_batch.extend(chain)
+        if len(comment_batch) >= batch_size:
+            db.comments.insert_many(comment_batch, ordered=False)
+            comment_batch = []
+        if len(reply_batch) >= batch_size:
+            db.replies.insert_many(reply_batch, ordered=False)
+            reply_batch = []
+    if comment_batch:
+        db.comments.insert_many(comment_batch, ordered=False)
+    if reply_batch:
+        db.replies.insert_many(reply_batch, ordered=False)
+    rebuild_article_stats(db)
+    return titles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', required=True)
+    parser.add_argument('--database', default='bench_comments_db')
+    parser.add_argument('--articles', type=int, default=100)
+    parser.add_argument('--comments', type=int, default=5000)
+    parser.add_argument('--reply-depth', type=int, default=4)
+    args = parser.parse_args()
+
+    from pymongo import MongoClient
+    db = MongoClient(args.mongo_uri)[args.database]
+    for collection in ('comments', 'replies', 'article_stats', 'article_activity'):
+        db[collection].drop()
+    seed(db, args.articles, args.comments, reply_depth=args.reply_depth)
+    print(f"seeded {db.comments.estimated_document_count()} comments and "
+          f"{db.replies.estimated_document_count()} replies over {args.articles} articles into {args.database}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+'''
+Load test comparing the sync (gunicorn) and async (uvicorn) serving modes.
+
+Start both servers against the same MongoDB and NYT endpoint, with rate
+limiting off (every virtual user shares one IP, so the default limits would
+answer most requests with 429), e.g.
+
+    RATE_LIMIT_BACKEND=off gunicorn -c gunicorn.conf.py --bind 0.0.0.0:8000 wsgi:app
+    RATE_LIMIT_BACKEND=off uvicorn asgi:app --port 8001 --workers 4
+
+then run
+
+    python bench/load_test.py --sync http://localhost:8000 --async http://localhost:8001 \
+        --concurrency 500 --duration 30
+
+Every target gets the same closed-loop workload (each virtual user sends its
+next request as soon as the previous one finishes) and the script prints
+requests/sec plus p50/p99 latency per path. Only 2xx and 304 responses count
+as requests; 429s are reported in their own column and every other status or
+transport failure as an error.
+'''
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+DEFAULT_PATHS = [
+    '/api/articles?q=davis+sacramento&page=0',
+    '/api/comments/Load%20Test%20Article?limit=20',
+    '/api/comment-count/Load%20Test%20Article',
+]
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_target(base_url, paths, concurrency, duration):
+    latencies = {path: [] for path in paths}
+    errors = {path: 0 for path in paths}
+    limited = {path: 0 for path in paths}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    deadline = time.perf_counter() + duration
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        async def user(worker):
+            i = worker
+            while time.perf_counter() < deadline:
+                path = paths[i % len(paths)]
+                i += 1
+                start = time.perf_counter()
+                try:
+                    status = (await client.get(path)).status_code
+                except httpx.HTTPError:
+                    status = None
+                if status is not None and (200 <= status < 300 or status == 304):
+                    latencies[path].append(time.perf_counter() - start)
+                elif status == 429:
+                    limited[path] += 1
+                else:
+                    errors[path] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    report = {}
+    for path in paths:
+        report[path] = {
+            'requests': len(latencies[path]),
+            'errors': errors[path],
+            'limited': limited[path],
+            'rps': len(latencies[path]) / elapsed,
+            'p50_ms': percentile(latencies[path], 50) * 1000,
+            'p99_ms': percentile(latencies[path], 99) * 1000,
+        }
+    total = sum(len(samples) for samples in latencies.values())
+    every = [latency for samples in latencies.values() for latency in samples]
+    report['total'] = {
+        'requests': total,
+        'errors': sum(errors.values()),
+        'limited': sum(limited.values()),
+        'rps': total / elapsed,
+        'p50_ms': percentile(every, 50) * 1000,
+        'p99_ms': percentile(every, 99) * 1000,
+    }
+    return report
+
+
+def print_report(name, report):
+    print(f"\n== {name}")
+    print(f"{'path':60} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'429s':>8} {'errors':>8}")
+    for path, row in report.items():
+        print(f"{path:60} {row['rps']:10.1f} {row['p50_ms']:10.1f} {row['p99_ms']:10.1f} "
+              f"{row['limited']:8d} {row['errors']:8d}")
+    if report['total']['limited']:
+        print("rate limited: start the server with RATE_LIMIT_BACKEND=off for throughput numbers")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sync', dest='sync_url', help='base URL of the gunicorn server')
+    parser.add_argument('--async', dest='async_url', help='base URL of the uvicorn server')
+    parser.add_argument('--path', action='append', dest='paths', help='path to request (repeatable)')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--json', dest='json_out', help='also write the results to this file')
+    args = parser.parse_args()
+
+    targets = [(name, url) for name, url in (('sync', args.sync_url), ('async', args.async_url)) if url]
+    if not targets:
+        parser.error('pass --sync and/or --async')
+
+    results = {}
+    for name, url in targets:
+        results[name] = asyncio.run(run_target(url, args.paths or DEFAULT_PATHS, args.concurrency, args.duration))
+        print_report(f"{name} ({url})", results[name])
+
+    if len(results) == 2:
+        sync_total, async_total = results['sync']['total'], results['async']['total']
+        print(f"\nasync/sync throughput: {async_total['rps'] / max(sync_total['rps'], 1e-9):.2f}x, "
+              f"p99 {sync_total['p99_ms']:.1f} ms -> {async_total['p99_ms']:.1f} ms")
+
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+'''
+Search benchmark on a generated corpus.
+
+    python bench/search_bench.py --comments 1000000                 # in-process index
+    python bench/search_bench.py --comments 1000000 --mongo-uri mongodb://localhost:27017/
+
+The corpus is deterministic (seeded): comments of 8-40 words drawn from a
+Zipf-like vocabulary, spread over 5k articles and 50k users. The memory run
+reports build time, resident memory, incremental update cost and query
+latency; the Mongo run seeds a scratch database (search_bench), builds the
+text index and times the same queries through MongoTextSearch.
+'''
+
+import argparse
+import itertools
+import os
+import random
+import resource
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bson.objectid import ObjectId  # noqa: E402
+
+from search import InvertedIndex, MongoTextSearch  # noqa: E402
+
+QUERIES = [
+    ('common word', {'text': 'w1'}),
+    ('mid-frequency pair', {'text': 'w250 w900'}),
+    ('rare word', {'text': 'w19000'}),
+    ('common + user filter', {'text': 'w3', 'username': 'user42'}),
+    ('common + article filter', {'text': 'w5', 'article': 'Article 7'}),
+    ('pair + time range', {'text': 'w10 w40', 'since': '2024-03-01', 'until': '2024-04-01'}),
+]
+
+
+def corpus(count, vocabulary=20000, seed=7):
+    rng = random.Random(seed)
+    words = [f'w{n}' for n in range(vocabulary)]
+    cum_weights = list(itertools.accumulate(1 / (n + 1) for n in range(vocabulary)))
+    start = datetime(2024, 1, 1)
+    for n in range(count):
+        yield {
+            '_id': ObjectId(),
+            'articleTitle': f'Article {rng.randrange(5000)}',
+            'username': f'user{rng.randrange(50000)}',
+            'text': ' '.join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(8, 40))),
+            'timestamp': (start + timedelta(seconds=n * 30)).isoformat(),
+        }
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def time_queries(search, repeat):
+    for name, params in QUERIES:
+        params = dict(params)
+        text = params.pop('text')
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            hits, _ = search(text, limit=20, **params)
+            samples.append(time.perf_counter() - start)
+        print(f"  {name:28} p50 {percentile(samples, 50) * 1000:8.2f} ms  p99 {percentile(samples, 99) * 1000:8.2f} ms"
+              f"  ({len(hits)} hits)")
+
+
+def run_memory(args):
+    index = InvertedIndex()
+    start = time.perf_counter()
+    for doc in corpus(args.comments):
+        index.add('comment', doc)
+    build = time.perf_counter() - start
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"memory index: {len(index)} comments built in {build:.1f} s, peak RSS {rss_mb:.0f} MB")
+
+    samples = []
+    for doc in corpus(1000, seed=99):
+        start = time.perf_counter()
+        index.add('comment', doc)
+        samples.append(time.perf_counter() - start)
+    print(f"  incremental add             p50 {percentile(samples, 50) * 1e6:8.1f} us  "
+          f"p99 {percentile(samples, 99) * 1e6:8.1f} us")
+    time_queries(index.search, args.repeat)
+
+
+def run_mongo(args):
+    from pymongo import MongoClient
+    from indexes import INDEXES
+
+    db = MongoClient(args.mongo_uri).search_bench
+    if args.reseed or db.comments.estimated_document_count() != args.comments:
+        db.comments.drop()
+        db.replies.drop()
+        batch = []
+        start = time.perf_counter()
+        for doc in corpus(args.comments):
+            batch.append(doc)
+            if len(batch) == 10000:
+                db.comments.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            db.comments.insert_many(batch, ordered=False)
+        print(f"seeded {args.comments} comments in {time.perf_counter() - start:.1f} s")
+    start = time.perf_counter()
+    for collection, keys, options in INDEXES:
+        if collection in ('comments', 'replies'):
+            db[collection].create_index(keys, **options)
+    print(f"mongo text index ready in {time.perf_counter() - start:.1f} s")
+    time_queries(MongoTextSearch(lambda: db).search, args.repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--comments', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--mongo-uri', help='also benchmark $text search against this server')
+    parser.add_argument('--reseed', action='store_true', help='regenerate the Mongo corpus')
+    args = parser.parse_args()
+
+    run_memory(args)
+    if args.mongo_uri:
+        run_mongo(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+'''
+Fan-out latency of the comment event broker (events.py).
+
+Holds N idle subscribers on one article and measures, for each published
+event, the time from publish() until every subscriber has the frame:
+
+    python bench/sse_fanout.py --subscribers 10000 --events 200
+
+--mode async parks each subscriber on an asyncio.Queue behind a LoopRelay,
+the way asgi.py serves /api/comments/<title>/events. --mode thread gives each
+subscriber its own queue and thread, the way a thread-per-connection server
+would hold them (keep N within the thread limit of the machine).
+
+Publishing happens on a separate thread, like a write handler or the change
+stream watcher would.
+'''
+
+import argparse
+import asyncio
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from events import ArticleBroker, LoopRelay, comment_event  # noqa: E402
+
+ARTICLE = 'Fan-out Benchmark'
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def sample_event(n):
+    return comment_event({'_id': f'bench{n}', 'articleTitle': ARTICLE, 'username': 'bench',
+                          'text': 'x' * 200, 'timestamp': '2024-01-01T00:00:00'})
+
+
+async def run_async(subscribers, events, interval):
+    broker = ArticleBroker()
+    loop = asyncio.get_running_loop()
+    relay = LoopRelay(broker, loop)
+    latencies = []
+    done = asyncio.Event()
+    state = {'remaining': subscribers, 'published_at': 0.0}
+
+    async def subscriber(inbox):
+        while True:
+            await inbox.get()
+            state['remaining'] -= 1
+            if state['remaining'] == 0:
+                latencies.append(time.perf_counter() - state['published_at'])
+                done.set()
+
+    queues = [asyncio.Queue() for _ in range(subscribers)]
+    for inbox in queues:
+        relay.add(ARTICLE, inbox)
+    tasks = [asyncio.create_task(subscriber(inbox)) for inbox in queues]
+    await asyncio.sleep(0)
+
+    for n in range(events):
+        event = sample_event(n)
+        state['remaining'] = subscribers
+        done.clear()
+        state['published_at'] = time.perf_counter()
+        await loop.run_in_executor(None, broker.publish, ARTICLE, event)
+        await done.wait()
+        await asyncio.sleep(interval)
+
+    for task in tasks:
+        task.cancel()
+    return latencies
+
+
+def run_threads(subscribers, events, interval):
+    broker = ArticleBroker()
+    latencies = []
+    lock = threading.Lock()
+    done = threading.Event()
+    state = {'remaining': subscribers, 'published_at': 0.0}
+
+    def subscriber(inbox):
+        while True:
+            if inbox.get() is None:
+                return
+            with lock:
+                state['remaining'] -= 1
+                if state['remaining'] == 0:
+                    latencies.append(time.perf_counter() - state['published_at'])
+                    done.set()
+
+    inboxes = [queue.SimpleQueue() for _ in range(subscribers)]
+    threads = [threading.Thread(target=subscriber, args=(inbox,), daemon=True) for inbox in inboxes]
+    for inbox, thread in zip(inboxes, threads):
+        broker.subscribe(ARTICLE, inbox.put)
+        thread.start()
+
+    for n in range(events):
+        event = sample_event(n)
+        with lock:
+            state['remaining'] = subscribers
+            done.clear()
+            state['published_at'] = time.perf_counter()
+        broker.publish(ARTICLE, event)
+        done.wait()
+        time.sleep(interval)
+
+    for inbox in inboxes:
+        inbox.put(None)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subscribers', type=int, default=10000)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.01, help='seconds between events')
+    parser.add_argument('--mode', choices=['async', 'thread'], default='async')
+    args = parser.parse_args()
+
+    if args.mode == 'async':
+        latencies = asyncio.run(run_async(args.subscribers, args.events, args.interval))
+    else:
+        latencies = run_threads(args.subscribers, args.events, args.interval)
+
+    print(f"{args.mode}: {args.subscribers} subscribers, {len(latencies)} events, publish -> last delivery")
+    print(f"  p50 {percentile(latencies, 50) * 1000:.2f} ms  p99 {percentile(latencies, 99) * 1000:.2f} ms  "
+          f"max {max(latencies) * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+'''
+Startup benchmark: how long a fresh worker process takes to serve.
+
+    python bench/startup.py              # median of 5 fresh interpreters
+    python bench/startup.py --runs 10
+
+Every run starts a new interpreter and times, in order:
+
+- import: `import app`
+- create_app: create_app()
+- first_request: GET /healthz, the first request through the app
+- first_db_request: GET /api/comments/<title> against mongomock
+- warm_up: app.warm_up(), the readiness hook (OIDC client, MongoDB ping)
+
+MongoDB is mongomock, so the numbers are the app's own cost, not network
+round trips. warm_up is what gunicorn's post_fork now pays up front instead
+of import time, see gunicorn.conf.py.
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+PHASES = ('import', 'create_app', 'first_request', 'first_db_request', 'warm_up')
+
+PROBE = '''
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+timings = {}
+started = time.perf_counter()
+import app
+timings['import'] = time.perf_counter() - started
+
+import mongomock
+db = mongomock.MongoClient().startup_db
+app.db = db
+app.get_mongo_client = lambda: db.client
+
+started = time.perf_counter()
+client = app.create_app().test_client()
+timings['create_app'] = time.perf_counter() - started
+
+started = time.perf_counter()
+assert client.get('/healthz').status_code == 200
+timings['first_request'] = time.perf_counter() - started
+
+started = time.perf_counter()
+assert client.get('/api/comments/Startup Article').status_code == 200
+timings['first_db_request'] = time.perf_counter() - started
+
+started = time.perf_counter()
+checks = app.warm_up()
+timings['warm_up'] = time.perf_counter() - started
+assert checks['mongo'] == 'ok', checks
+print(json.dumps(timings))
+'''
+
+
+def measure():
+    """{phase: seconds} from one fresh interpreter"""
+    env = dict(os.environ, NYT_PREFETCH='off', CHANGE_STREAMS='off', LOG_LEVEL='WARNING')
+    out = subprocess.run([sys.executable, '-c', PROBE, BACKEND], env=env, cwd=BACKEND,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(runs=5):
+    """{phase: median milliseconds} over runs fresh interpreters"""
+    samples = [measure() for _ in range(runs)]
+    return {phase: round(statistics.median(s[phase] for s in samples) * 1000, 2) for phase in PHASES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    print(f"median of {args.runs} fresh interpreters")
+    print(f"{'phase':<18} {'ms':>9}")
+    for phase, ms in results.items():
+        print(f"{phase:<18} {ms:>9.2f}")
+    print(f"{'ready to serve':<18} {sum(results[p] for p in PHASES[:3]):>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+'''
+Benchmark suite: scripted workloads against the Flask app, in process.
+
+    python bench/suite.py                                   # mongomock, default sizes
+    python bench/suite.py --mongo-uri mongodb://localhost:27017/
+    python bench/suite.py --save-baseline                   # record bench/baseline.json
+    python bench/suite.py --check                           # exit 1 on a regression
+
+Every run seeds a fresh database (bench/datagen.py), points the NYT proxy
+at a local stub server and drives the app through its test client, so no
+network, gunicorn or NYT quota is involved. Workloads:
+
+- browse: the front page (articles pages 0-2 and their comment counts),
+  then threads opened and revalidated with If-None-Match
+- burst: logged-in users posting comments, replies and nested replies
+  to the busiest articles
+- moderation: bulk sweeps, single removals and redactions
+
+For every endpoint it prints requests/s (one client), p50 and p99.
+Baselines are kept per database backend, mongomock and mongod differ by
+orders of magnitude. --check fails when an endpoint's p50 or a workload's
+total throughput is more than --tolerance worse than the baseline. p99 (the
+second slowest of 200 requests) and per-endpoint req/s (which moves with the
+other endpoints of its workload) are printed but too noisy to gate on.
+
+Timings are absolute, so a baseline only holds for the machine it was
+recorded on. Each run also times a fixed pure-Python job (calibrate()) and
+--check scales the baseline by how much slower or faster that job ran, which
+absorbs most of the difference between machines for mongomock runs (whose
+cost is all Python) but not for mongod. The checked-in bench/baseline.json is
+a reference, not a portable gate: before relying on --check, record your own
+with --save-baseline on an idle machine, then change the code and --check.
+For many concurrent clients against a real server use bench/load_test.py.
+'''
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from datagen import seed  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+WORKLOADS = ('browse', 'burst', 'moderation')
+
+
+class StubNYT:
+    """Local stand-in for NYT Article Search with full-size documents"""
+
+    def __init__(self, docs=10):
+        doc = {
+            'abstract': 'A bench article abstract. ' * 4,
+            'web_url': 'https://www.nytimes.com/2025/05/01/us/bench.html',
+            'snippet': 'A bench article snippet. ' * 4,
+            'lead_paragraph': 'Lead paragraph text. ' * 20,
+            'multimedia': [{'url': f'images/2025/05/01/bench-{n}.jpg', 'height': 400, 'width': 600,
+                            'type': 'image', 'subtype': 'xlarge', 'caption': 'caption ' * 10} for n in range(8)],
+            'headline': {'main': 'Bench headline', 'kicker': None, 'print_headline': 'Bench headline'},
+            'keywords': [{'name': 'subject', 'value': f'keyword {n}', 'rank': n} for n in range(10)],
+            'pub_date': '2025-05-01T12:00:00+0000',
+            'byline': {'original': 'By A Reporter', 'person': [{'firstname': 'A', 'lastname': 'Reporter'}]},
+            'word_count': 900,
+        }
+        body = json.dumps({'status': 'OK', 'response': {'docs': [doc] * docs, 'meta': {'hits': 1000}}}).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/articlesearch.json"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def call(self, endpoint, request):
+        start = time.perf_counter()
+        response = request()
+        elapsed = time.perf_counter() - start
+        if response.status_code >= 500:
+            self.errors[endpoint] += 1
+        self.samples[endpoint].append(elapsed)
+        return response
+
+    def report(self, wall_time):
+        report = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            report[endpoint] = {
+                'requests': len(samples),
+                'errors': self.errors[endpoint],
+                'rps': len(samples) / sum(samples),
+                'p50_ms': percentile(samples, 50) * 1000,
+                'p99_ms': percentile(samples, 99) * 1000,
+            }
+        total = sum(len(samples) for samples in self.samples.values())
+        report['total'] = {
+            'requests': total,
+            'errors': sum(self.errors.values()),
+            'rps': total / wall_time,
+            'p50_ms': percentile([s for samples in self.samples.values() for s in samples], 50) * 1000,
+            'p99_ms': percentile([s for samples in self.samples.values() for s in samples], 99) * 1000,
+        }
+        return report
+
+
+def login(client, username, moderator=False):
+    with client.session_transaction() as sess:
+        sess['user'] = {'username': username, 'user_id': username, 'is_moderator': moderator,
+                        'email': 'moderator@hw3.com' if moderator else f'{username}@example.com'}
+
+
+def busy_title(rng, titles):
+    # Same long tail as the seeded data: low-numbered articles get most views
+    return titles[min(int(rng.paretovariate(1.2)) - 1, len(titles) - 1)]
+
+
+def browse(client, db, titles, rng, recorder, iterations):
+    etags = {}
+    for n in range(iterations):
+        page = n % 3
+        recorder.call('GET /api/articles', lambda: client.get(f'/api/articles?q=davis+sacramento&page={page}'))
+        front_page = titles[page * 10:page * 10 + 10]
+        recorder.call('POST /api/comment-counts', lambda: client.post('/api/comment-counts',
+                                                                      json={'titles': front_page}))
+        title = busy_title(rng, titles)
+        headers = {'If-None-Match': etags[title]} if title in etags else {}
+        response = recorder.call('GET /api/comments/<title>',
+                                 lambda: client.get(f'/api/comments/{title}?limit=20', headers=headers))
+        if response.status_code == 200:
+            etags[title] = response.headers.get('ETag')
+            comments = response.get_json().get('comments', [])
+            if comments:
+                comment_id = rng.choice(comments)['_id']
+                recorder.call('GET /api/comments/<id>/replies',
+                              lambda: client.get(f'/api/comments/{comment_id}/replies'))
+        recorder.call('GET /api/comment-count/<title>', lambda: client.get(f'/api/comment-count/{title}'))
+
+
+def burst(client, db, titles, rng, recorder, iterations):
+    recent = []
+    for n in range(iterations):
+        login(client, f'burst{n % 50}')
+        title = busy_title(rng, titles)
+        response = recorder.call('POST /api/comments', lambda: client.post(
+            '/api/comments', json={'articleTitle': title, 'text': f'burst comment {n} about the levee'}))
+        if response.status_code in (201, 202):
+            recent.append(response.get_json()['id'])
+        if recent:
+            comment_id = rng.choice(recent[-20:])
+            response = recorder.call('POST /api/comments/<id>/replies', lambda: client.post(
+                f'/api/comments/{comment_id}/replies', json={'text': f'burst reply {n}'}))
+            if response.status_code == 201 and n % 2:
+                reply_id = response.get_json()['id']
+                recorder.call('POST /api/comments/<id>/replies/<id>/replies', lambda: client.post(
+                    f'/api/comments/{comment_id}/replies/{reply_id}/replies', json={'text': f'nested {n}'}))
+
+
+def moderation(client, db, titles, rng, recorder, iterations):
+    login(client, 'mod', moderator=True)
+    ids = [str(doc['_id']) for doc in db.comments.find({}, {'_id': 1}).limit(iterations * 30)]
+    rng.shuffle(ids)
+    for n in range(iterations):
+        sweep = [{'action': rng.choice(('remove', 'redact')), 'target': 'comment', 'id': ids.pop()}
+                 for _ in range(min(20, len(ids) - 2))]
+        if n % 5 == 0:
+            sweep.append({'action': 'redact', 'target': 'all', 'filter': {'username': f'user{rng.randrange(500)}'}})
+        recorder.call('POST /api/moderation/bulk', lambda: client.post('/api/moderation/bulk',
+                                                                        json={'actions': sweep}))
+        if len(ids) < 2:
+            break
+        removed, redacted = ids.pop(), ids.pop()
+        recorder.call('DELETE /api/comments/<id>', lambda: client.delete(f'/api/comments/{removed}'))
+        recorder.call('PUT /api/comments/<id>/redact', lambda: client.put(f'/api/comments/{redacted}/redact'))
+
+
+def run(mongo_uri=None, articles=100, comments=5000, iterations=200, workloads=WORKLOADS, seed_value=11):
+    """Seed, run the workloads and return {workload: {endpoint: stats}}"""
+    # One simulated client sends everything, so limits would only measure 429s
+    config = {'NYT_API_KEY': os.getenv('NYT_API_KEY', 'bench'), 'NYT_PREFETCH': 'off', 'RATE_LIMIT_BACKEND': 'off'}
+    import app as app_module
+    app_logger = logging.getLogger('app')
+    log_level = app_logger.level
+    app_logger.setLevel(logging.WARNING)  # Moderation events are logged at INFO
+
+    if mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_uri)
+        client.drop_database('bench_comments_db')
+        db = client.bench_comments_db
+        from indexes import ensure_indexes
+        ensure_indexes(db)
+    else:
+        import mongomock
+        config['CHANGE_STREAMS'] = 'off'  # mongomock has no change streams
+        db = mongomock.MongoClient().bench_comments_db
+
+    stub = StubNYT()
+    saved = app_module.db
+    app_module.db = db
+    flask_app = app_module.create_app(dict(config, NYT_API_URL=stub.url))
+    try:
+        titles = seed(db, articles, comments, seed=seed_value)
+        results = {}
+        for name in workloads:
+            rng = random.Random(f'{seed_value}-{name}')
+            recorder = Recorder()
+            started = time.perf_counter()
+            globals()[name](flask_app.test_client(), db, titles, rng, recorder, iterations)
+            results[name] = recorder.report(time.perf_counter() - started)
+        return results
+    finally:
+        app_module.close_services()  # Flushes into the bench database, before it is swapped back
+        app_module.db = saved
+        app_logger.setLevel(log_level)
+        stub.close()
+
+
+def calibrate(rounds=5):
+    """Seconds for a fixed pure-Python job (best of rounds), how fast this machine runs the app's code"""
+    docs = [{'_id': i, 'text': 'x' * (i % 50), 'replies': list(range(i % 7))} for i in range(2000)]
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(5):
+            sorted(json.loads(json.dumps(docs)), key=lambda doc: (len(doc['text']), -doc['_id']))
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def compare(baseline, results, tolerance, scale=1.0):
+    """Regressions of results against baseline, as readable lines
+
+    scale is how many times slower this machine is than the baseline's
+    (calibrate() here / there); baseline timings are stretched by it first.
+    """
+    regressions = []
+    for workload, endpoints in results.items():
+        for endpoint, row in endpoints.items():
+            base = baseline.get(workload, {}).get(endpoint)
+            if not base:
+                continue
+            # The total's p50 mixes fast and slow endpoints, its throughput is the workload's
+            if endpoint == 'total':
+                metric, expected, worse = 'rps', base['rps'] / scale, row['rps'] < base['rps'] / scale / (1 + tolerance)
+            else:
+                metric, expected = 'p50_ms', base['p50_ms'] * scale
+                worse = row['p50_ms'] > expected * (1 + tolerance)
+            if worse:
+                regressions.append(f"{workload} {endpoint}: {metric} {row[metric]:.2f} "
+                                   f"(baseline {expected:.2f} on this machine)")
+    return regressions
+
+
+def print_report(workload, report):
+    print(f"\n== {workload}")
+    print(f"{'endpoint':52} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errors':>8}")
+    for endpoint, row in report.items():
+        print(f"{endpoint:52} {row['rps']:10.1f} {row['p50_ms']:10.2f} {row['p99_ms']:10.2f} {row['errors']:8d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', help='run against this mongod (a scratch database) instead of mongomock')
+    parser.add_argument('--articles', type=int, default=100)
+    parser.add_argument('--comments', type=int, default=5000)
+    parser.add_argument('--iterations', type=int, default=200, help='rounds of each workload')
+    parser.add_argument('--workload', action='append', choices=WORKLOADS, dest='workloads')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true', help='exit 1 when a result regressed against the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.3)
+    parser.add_argument('--json', dest='json_out', help='also write the results to this file')
+    args = parser.parse_args()
+
+    calibration_ms = calibrate() * 1000
+    results = run(args.mongo_uri, args.articles, args.comments, args.iterations, args.workloads or WORKLOADS)
+    for workload, report in results.items():
+        print_report(workload, report)
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    backend = 'mongod' if args.mongo_uri else 'mongomock'
+    # A baseline only compares with runs of the same size
+    params = {'articles': args.articles, 'comments': args.comments, 'iterations': args.iterations}
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        baselines[backend] = {'params': params, 'calibration_ms': calibration_ms, 'results': results}
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nbaseline for {backend} saved to {args.baseline}")
+    if args.check:
+        if backend not in baselines:
+            raise SystemExit(f"no {backend} baseline in {args.baseline}, run with --save-baseline first")
+        if baselines[backend]['params'] != params:
+            raise SystemExit(f"the {backend} baseline was recorded with {baselines[backend]['params']}")
+        # Baselines recorded before calibration was added compare unscaled
+        scale = calibration_ms / baselines[backend].get('calibration_ms', calibration_ms)
+        print(f"\nthis machine runs the calibration job {scale:.2f}x as long as the baseline's did")
+        regressions = compare(baselines[backend]['results'], results, args.tolerance, scale)
+        if regressions:
+            print("\nregressions:\n  " + "\n  ".join(regressions))
+            raise SystemExit(1)
+        print(f"\nno regressions against the {backend} baseline (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == '__main__':
+    main()
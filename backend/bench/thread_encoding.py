@@ -0,0 +1,109 @@
+'''
+Micro-benchmark: encoding a large comment thread as GET /api/comments does.
+
+    python bench/thread_encoding.py                       # 2000 comments, 10 replies each
+    python bench/thread_encoding.py --comments 500 --replies 40
+
+Every encoder gets the same documents as they come out of the driver
+(ObjectId ids, reply arrays attached) and produces the response body:
+
+- legacy: the walk that converted every id with str(), then Flask's
+  default stdlib encoding with sorted keys (the path before serialization.py)
+- json: serialization.py on the standard library
+- orjson: serialization.py on orjson, when it is installed
+
+Each timing is the median of --repeat runs. The documents are rebuilt
+before every run, outside the timed section, since the legacy walk
+mutates them.
+'''
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bson.objectid import ObjectId  # noqa: E402
+
+import reply_store  # noqa: E402
+import serialization  # noqa: E402
+
+
+def build_thread(comments=2000, replies=10, seed=5):
+    """One article's comments with their replies embedded, in the driver's types"""
+    rng = random.Random(seed)
+    words = 'city council budget vote housing river transit campus tuition drought election'.split()
+    thread = []
+    for n in range(comments):
+        comment_id = ObjectId()
+        chain = []
+        for _ in range(replies):
+            parent = rng.choice([None] + chain) if chain else None
+            chain.append(reply_store.new_reply(comment_id, 'Bench Article', f'user{rng.randrange(500)}',
+                                               ' '.join(rng.choice(words) for _ in range(rng.randint(3, 30))),
+                                               parent))
+        thread.append({
+            '_id': comment_id,
+            'articleKey': 'ak_0123456789abcdef',
+            'articleTitle': 'Bench Article',
+            'username': f'user{rng.randrange(500)}',
+            'text': ' '.join(rng.choice(words) for _ in range(rng.randint(5, 60))),
+            'timestamp': f'2025-05-01T10:{n // 60 % 60:02d}:{n % 60:02d}',
+            'replies': [reply_store.to_client(reply) for reply in chain],
+        })
+    return thread
+
+
+def _legacy(thread):
+    for comment in thread:
+        comment['_id'] = str(comment['_id'])
+        for reply in comment['replies']:
+            reply['_id'] = str(reply['_id'])
+    return json.dumps(thread, sort_keys=True, separators=(',', ':')).encode()
+
+
+def encoders():
+    found = {'legacy': _legacy, 'json': serialization._stdlib_dumps}
+    if serialization.orjson is not None:
+        found['orjson'] = serialization._orjson_dumps
+    return found
+
+
+def run(comments=2000, replies=10, repeat=5):
+    """{encoder: {'ms': median milliseconds, 'bytes': body size, 'mb_s': throughput}}"""
+    results = {}
+    for name, encode in encoders().items():
+        timings = []
+        for _ in range(repeat):
+            thread = build_thread(comments, replies)
+            started = time.perf_counter()
+            body = encode(thread)
+            timings.append(time.perf_counter() - started)
+        seconds = statistics.median(timings)
+        results[name] = {'ms': round(seconds * 1000, 2), 'bytes': len(body),
+                         'mb_s': round(len(body) / seconds / 1e6, 1)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--comments', type=int, default=2000)
+    parser.add_argument('--replies', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.comments, args.replies, args.repeat)
+    legacy = results['legacy']['ms']
+    print(f"{args.comments} comments x {args.replies} replies")
+    print(f"{'encoder':<8} {'ms':>9} {'MB/s':>8} {'bytes':>10} {'speedup':>8}")
+    for name, result in results.items():
+        print(f"{name:<8} {result['ms']:>9.2f} {result['mb_s']:>8.1f} {result['bytes']:>10} "
+              f"{legacy / result['ms']:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
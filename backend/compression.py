@@ -0,0 +1,182 @@
+'''
+Response compression for the JSON API.
+
+JSON and NDJSON responses of at least COMPRESS_MIN_SIZE bytes are encoded
+with the best coding the client accepts: br when the optional `brotli`
+package is installed (requirements-optional.txt), otherwise gzip. Streamed responses (the
+/api/all-comments export) are compressed chunk by chunk; event streams and
+static files are left alone. Compressed responses carry weak ETags since
+the bytes differ from the identity representation.
+
+Flask: app.after_request(compress_response). ASGI: CompressionMiddleware.
+'''
+
+import os
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('application/json', 'application/x-ndjson')
+MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # Much faster than the default of 11, still smaller than gzip -6
+
+
+def supported_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding):
+    """The preferred supported coding in an Accept-Encoding header, or None"""
+    weights = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best = None
+    for encoding in supported_encodings():
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (encoding, q)
+    return best[0] if best else None
+
+
+class _Encoder:
+    """Incremental compressor for one response body"""
+
+    def __init__(self, encoding):
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._compress, self._finish = self._compressor.process, self._compressor.finish
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._compress, self._finish = self._compressor.compress, self._compressor.flush
+
+    def compress(self, data):
+        return self._compress(data)
+
+    def finish(self):
+        return self._finish()
+
+
+def compress(body, encoding):
+    encoder = _Encoder(encoding)
+    return encoder.compress(body) + encoder.finish()
+
+
+def _compress_stream(chunks, encoding):
+    encoder = _Encoder(encoding)
+    for chunk in chunks:
+        data = encoder.compress(chunk)
+        if data:
+            yield data
+    yield encoder.finish()
+
+
+def _compressible(mimetype):
+    return mimetype in COMPRESSIBLE
+
+
+def _weak_etag(etag):
+    return etag if etag.startswith('W/') else f'W/{etag}'
+
+
+def compress_response(response):
+    """Flask after_request hook"""
+    if (not _compressible(response.mimetype) or response.status_code in (204, 304) or
+            'Content-Encoding' in response.headers or response.direct_passthrough):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.iter_encoded(), encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < MIN_SIZE:
+            return response
+        response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    if 'ETag' in response.headers:
+        response.headers['ETag'] = _weak_etag(response.headers['ETag'])
+    return response
+
+
+class CompressionMiddleware:
+    """The same for the ASGI app, responses that are already encoded pass through"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get('headers') or [])
+        encoding = choose_encoding(headers.get(b'accept-encoding', b'').decode('latin-1'))
+        state = {'start': None, 'encoder': None, 'passthrough': False}
+
+        async def send_compressed(message):
+            if message['type'] == 'http.response.start':
+                response_headers = {name.lower(): value for name, value in message.get('headers', [])}
+                mimetype = response_headers.get(b'content-type', b'').split(b';')[0].strip().decode('latin-1')
+                if (not _compressible(mimetype) or b'content-encoding' in response_headers or
+                        message['status'] in (204, 304)):
+                    state['passthrough'] = True
+                    await send(message)
+                    return
+                message['headers'] = list(message.get('headers', []))
+                if b'vary' not in response_headers:
+                    message['headers'].append((b'vary', b'Accept-Encoding'))
+                if encoding is None:
+                    state['passthrough'] = True
+                    await send(message)
+                    return
+                state['start'] = message
+                return
+            if message['type'] != 'http.response.body' or state['passthrough']:
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            more = message.get('more_body', False)
+            if state['encoder'] is None:
+                start = state['start']
+                if not more and len(body) < MIN_SIZE:
+                    await send(start)
+                    await send(message)
+                    state['passthrough'] = True
+                    return
+                start['headers'] = [(name, _weak_etag(value.decode('latin-1')).encode('latin-1')
+                                     if name.lower() == b'etag' else value)
+                                    for name, value in start['headers'] if name.lower() != b'content-length']
+                start['headers'].append((b'content-encoding', encoding.encode()))
+                if not more:
+                    compressed = compress(body, encoding)
+                    start['headers'].append((b'content-length', str(len(compressed)).encode()))
+                    await send(start)
+                    await send({'type': 'http.response.body', 'body': compressed})
+                    state['passthrough'] = True
+                    return
+                state['encoder'] = _Encoder(encoding)
+                await send(start)
+            data = state['encoder'].compress(body)
+            if not more:
+                data += state['encoder'].finish()
+            await send({'type': 'http.response.body', 'body': data, 'more_body': more})
+
+        await self.app(scope, receive, send_compressed)
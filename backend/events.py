@@ -0,0 +1,249 @@
+'''
+Per-article push channel for comment activity.
+
+Clients subscribe to one article and receive small deltas (a new comment, a
+new reply, or the changed fields of a redacted/removed item) instead of
+re-polling the whole thread. Events come from a single MongoDB change stream
+per process when the deployment supports it (replica sets); otherwise the
+write handlers publish them locally through notify(), which only reaches the
+subscribers of the process that handled the write, so deployments with
+several workers should run MongoDB as a replica set.
+
+Every stream starts with a `hello` event telling the client whether this
+process is watching the change stream. Only then does the stream carry
+writes handled by other workers, so otherwise clients keep refetching after
+their own writes.
+
+Every event is encoded once, as a ready-to-send SSE frame, no matter how many
+clients are subscribed. Subscriptions are held by article key, so clients
+may name the article by its headline or its key (articles.py).
+'''
+
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+import reply_store
+from articles import article_key, to_article_key
+
+logger = logging.getLogger(__name__)
+
+# Fields of a comment or reply that clients may see change
+VISIBLE_UPDATE_FIELDS = ('text', 'removed_at', 'removed_by', 'redacted_at', 'redacted_by', 'partially_redacted_at')
+
+
+def comment_event(comment):
+    comment = dict(comment)
+    comment['_id'] = str(comment['_id'])
+    comment.setdefault('replies', [])
+    return {'type': 'comment', 'comment': comment, 'countDelta': 1}
+
+
+def reply_event(reply):
+    comment_id = str(reply['comment_id'])
+    return {'type': 'reply', 'commentId': comment_id, 'reply': reply_store.to_client(dict(reply)), 'countDelta': 1}
+
+
+def update_event(target, item_id, comment_id, fields):
+    """Changed fields of a comment or reply, a removal also takes it out of the count"""
+    fields = {key: value for key, value in fields.items() if key in VISIBLE_UPDATE_FIELDS}
+    event = {'type': 'update', 'target': target, 'id': str(item_id), 'fields': fields,
+             'countDelta': -1 if 'removed_at' in fields else 0}
+    if comment_id is not None:
+        event['commentId'] = str(comment_id)
+    return event
+
+
+def sse_frame(event):
+    return f"data: {json.dumps(event, default=str)}\n\n"
+
+
+def hello_frame(watching):
+    """First frame of a stream, changeStream tells whether every worker's writes will arrive on it"""
+    return f"event: hello\ndata: {json.dumps({'changeStream': watching})}\n\n"
+
+
+class ArticleBroker:
+    """Routes events to the subscribers of each article
+
+    A subscriber is any callable taking the encoded SSE frame; it must not
+    block (queues and loop.call_soon_threadsafe are both fine).
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(dict)
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._next_token = 0
+        self.watcher = None
+
+    def subscribe(self, article, deliver):
+        key = to_article_key(article)
+        with self._lock:
+            self._next_token += 1
+            token = (key, self._next_token)
+            self._subscribers[key][token] = deliver
+        return token
+
+    def unsubscribe(self, token):
+        key, _ = token
+        with self._lock:
+            subscribers = self._subscribers.get(key)
+            if subscribers is not None:
+                subscribers.pop(token, None)
+                if not subscribers:
+                    del self._subscribers[key]
+
+    def subscriber_count(self, article=None):
+        with self._lock:
+            if article is not None:
+                return len(self._subscribers.get(to_article_key(article), {}))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def add_listener(self, listener):
+        """Call listener(article_title, event) for every event, e.g. to invalidate caches"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def publish(self, article_title, event):
+        for listener in self._listeners:
+            try:
+                listener(article_title, event)
+            except Exception:
+                logger.exception("event listener failed")
+
+        with self._lock:
+            subscribers = list(self._subscribers.get(article_key(article_title), {}).values())
+        if not subscribers:
+            return 0
+        frame = sse_frame(event)
+        for deliver in subscribers:
+            try:
+                deliver(frame)
+            except Exception:
+                logger.exception("dropping event for a slow or closed subscriber")
+        return len(subscribers)
+
+    def watching(self):
+        """True while this process's change stream is open, i.e. writes from every worker are published"""
+        return self.watcher is not None and self.watcher.active
+
+    def notify(self, article_title, event):
+        """Publish from a write handler, unless the change stream will report the write itself"""
+        if not article_title:
+            return
+        if self.watching():
+            return
+        self.publish(article_title, event)
+
+    def ensure_watcher(self, db_getter):
+        """Start this process's change stream watcher once (callers skip it for CHANGE_STREAMS=off, see app.py)"""
+        with self._lock:
+            if self.watcher is None or self.watcher.pid != os.getpid():
+                self.watcher = ChangeStreamWatcher(db_getter, self)
+                self.watcher.start()
+
+
+class ChangeStreamWatcher(threading.Thread):
+    """One database-level change stream per process feeding the broker"""
+
+    def __init__(self, db_getter, broker):
+        super().__init__(name='comment-change-stream', daemon=True)
+        self.db_getter = db_getter
+        self.broker = broker
+        self.pid = os.getpid()
+        self.active = False
+        self.unsupported = False
+        self._resume_token = None
+        self._stop = threading.Event()
+
+    def run(self):
+        pipeline = [{'$match': {
+            'ns.coll': {'$in': ['comments', 'replies']},
+            'operationType': {'$in': ['insert', 'update']}
+        }}]
+        while not self._stop.is_set():
+            try:
+                with self.db_getter().watch(pipeline, full_document='updateLookup',
+                                            resume_after=self._resume_token) as stream:
+                    self.active = True
+                    for change in stream:
+                        self._resume_token = stream.resume_token
+                        self._dispatch(change)
+                        if self._stop.is_set():
+                            break
+            except (OperationFailure, NotImplementedError) as e:
+                # Standalone servers have no change streams, handlers publish locally instead
+                self.active = False
+                self.unsupported = True
+                logger.info("change streams unavailable (%s), using local events", e)
+                return
+            except PyMongoError:
+                self.active = False
+                logger.exception("change stream interrupted, resuming")
+                self._stop.wait(1)
+        self.active = False
+
+    def stop(self):
+        self._stop.set()
+
+    def _dispatch(self, change):
+        collection = change['ns']['coll']
+        document = change.get('fullDocument')
+        if not document:
+            return
+        article_title = document.get('articleTitle')
+        if change['operationType'] == 'insert':
+            event = comment_event(document) if collection == 'comments' else reply_event(document)
+        else:
+            fields = change.get('updateDescription', {}).get('updatedFields', {})
+            if collection == 'comments':
+                event = update_event('comment', document['_id'], None, fields)
+            else:
+                event = update_event('reply', document['_id'], document.get('comment_id'), fields)
+        self.broker.publish(article_title, event)
+
+
+class LoopRelay:
+    """Fan-out inside one asyncio loop
+
+    The broker sees a single subscriber per article for the whole loop, so a
+    publish costs one call_soon_threadsafe per loop instead of one per client.
+    """
+
+    def __init__(self, broker, loop):
+        self.broker = broker
+        self.loop = loop
+        self._queues = defaultdict(set)
+        self._tokens = {}
+
+    def add(self, article, queue):
+        # Called from the loop thread
+        key = to_article_key(article)
+        if not self._queues[key]:
+            self._tokens[key] = self.broker.subscribe(
+                key, lambda frame: self.loop.call_soon_threadsafe(self._fanout, key, frame))
+        self._queues[key].add(queue)
+
+    def remove(self, article, queue):
+        key = to_article_key(article)
+        queues = self._queues.get(key)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._queues[key]
+            self.broker.unsubscribe(self._tokens.pop(key))
+
+    def _fanout(self, key, frame):
+        for queue in self._queues.get(key, ()):
+            queue.put_nowait(frame)
+
+
+broker = ArticleBroker()
@@ -0,0 +1,73 @@
+'''
+Gunicorn settings for the production server.
+
+Every value can be overridden from the environment.
+
+Deploying new code: the app is preloaded in the master (GUNICORN_PRELOAD=1),
+so SIGHUP only forks new workers from the code already imported there. To
+upgrade without dropping requests, send SIGUSR2 to the master, which starts
+a new master (and workers) on the new code next to the old one; once it is
+serving, send SIGWINCH to the old master (its pid is in <pidfile>.oldbin when
+a pidfile is set) so its workers finish their in-flight requests and exit,
+then SIGQUIT to stop it. SIGTERM does both in one step but leaves no master
+to roll back to.
+With GUNICORN_PRELOAD=0 each worker imports the app itself and SIGHUP is
+enough, at the cost of every worker importing it on start.
+'''
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# Pre-fork worker pool, each worker runs a small thread pool. Long-lived event
+# streams are not served here (see asgi.py), so every thread stays free for API calls
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+
+# Load the app once in the master so workers fork from a warm copy
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# Recycle workers now and then so slow leaks cannot build up
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+accesslog = '-'
+errorlog = '-'
+
+# Each worker gets its own pool, default it to one connection per thread plus headroom
+os.environ.setdefault('MONGO_MAX_POOL_SIZE', str(threads * 2))
+os.environ.setdefault('MONGO_MIN_POOL_SIZE', '1')
+# Tells the app it is one of several processes, see app.search_backend
+os.environ.setdefault('WEB_CONCURRENCY', str(workers))
+
+
+def on_starting(server):
+    """Create indexes and migrate embedded replies once, before any worker starts"""
+    if os.getenv('INIT_DB_ON_START', '1') != '1':
+        return
+    import app
+    from indexes import ensure_indexes
+    import reply_store
+    ensure_indexes(app.db)
+    reply_store.migrate_embedded_replies(app.db)
+    # The master must not hand its connections down to the workers
+    app.get_mongo_client().close()
+    app.reset_mongo_client()
+
+
+def post_fork(server, worker):
+    """Make sure the worker opens its own MongoClient instead of inheriting one
+
+    With WARM_UP_ON_FORK=1 (default) the worker also connects and builds its
+    OIDC client now, so its first request does not pay for them.
+    """
+    import app
+    app.reset_mongo_client()
+    if os.getenv('WARM_UP_ON_FORK', '1') == '1':
+        app.warm_up(timeout=float(os.getenv('WARM_UP_TIMEOUT', '5')))
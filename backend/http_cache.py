@@ -0,0 +1,181 @@
+'''
+HTTP validators for comment reads and the static frontend.
+
+Article versions
+    article_stats.version goes up on every write that changes what an
+    article's comment reads return (see article_stats.touch_article). The API
+    derives strong ETags from it, and ArticleVersions keeps the latest version
+    of recently read articles (by article key, see articles.py) in process
+    memory so a matching If-None-Match is answered with 304 without a
+    database round trip. Cached versions are
+    dropped on every comment event for the article (events.py); when events
+    are only local to one process they also expire after a few seconds so
+    other workers' writes are picked up. With change streams they still
+    expire, just later: the event comes from the comments or replies write,
+    and the version bump on article_stats can land after it, so a version
+    read in between would otherwise be served until the next write.
+
+Static assets
+    StaticAssets serves the frontend folder. index.html is rewritten so its
+    local stylesheets and scripts point at `name?v=<content hash>`; those
+    URLs never change content and are cached for a year, everything else is
+    revalidated with an ETag.
+'''
+
+import hashlib
+import os
+import re
+import threading
+import time
+
+from flask import Response, request, send_from_directory
+
+# Cache-Control for API reads: clients may store them but must revalidate
+REVALIDATE = 'no-cache'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class ArticleVersions:
+    def __init__(self, db_getter, ttl=2.0, authoritative=lambda: False, authoritative_ttl=10.0,
+                 max_entries=10000):
+        self.db_getter = db_getter
+        self.ttl = ttl
+        # True while every write reaches this process as an event (change streams),
+        # versions are then kept for authoritative_ttl instead of ttl
+        self.authoritative = authoritative
+        self.authoritative_ttl = authoritative_ttl
+        self.max_entries = max_entries
+        self._versions = {}
+        self._invalidations = 0
+        self._lock = threading.Lock()
+        self.stats = {'hit': 0, 'miss': 0}
+
+    def peek(self, article_key):
+        """Cached version or None, plus the token to pass back to store()"""
+        with self._lock:
+            token = self._invalidations
+            item = self._versions.get(article_key)
+        if item is not None:
+            version, loaded_at = item
+            ttl = self.authoritative_ttl if self.authoritative() else self.ttl
+            if time.monotonic() - loaded_at < ttl:
+                self.stats['hit'] += 1
+                return version, token
+        self.stats['miss'] += 1
+        return None, token
+
+    def store(self, article_key, version, token):
+        with self._lock:
+            # A write invalidated something while this version was being read
+            if token != self._invalidations:
+                return
+            if len(self._versions) >= self.max_entries:
+                self._versions.clear()
+            self._versions[article_key] = (version, time.monotonic())
+
+    def get(self, article_key):
+        version, token = self.peek(article_key)
+        if version is None:
+            stats = self.db_getter().article_stats.find_one({'articleKey': article_key}, {'version': 1})
+            version = stats.get('version', 0) if stats else 0
+            self.store(article_key, version, token)
+        return version
+
+    def invalidate(self, article_key):
+        with self._lock:
+            self._invalidations += 1
+            self._versions.pop(article_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._invalidations += 1
+            self._versions.clear()
+
+
+def article_etag(article_key, version, variant=b''):
+    """Strong ETag for one representation (variant = e.g. the query string) of an article read"""
+    digest = hashlib.blake2b(article_key.encode() + b'\0' + variant, digest_size=8).hexdigest()
+    return f"{digest}-{version}"
+
+
+def not_modified(etag):
+    """304 for the current request if the client already holds etag, else None
+
+    Weak comparison, a compressed response carries the same tag as W/.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = REVALIDATE
+        return response
+    return None
+
+
+def with_validator(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = REVALIDATE
+    return response
+
+
+class StaticAssets:
+    ASSET_REF = re.compile(r'''(?P<attr>(?:href|src)=")(?P<name>[^":?#]+\.(?:css|js))"''')
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self._digests = {}
+        self._index = None
+        self._lock = threading.Lock()
+
+    def digest(self, filename):
+        """Content hash of a frontend file, recomputed only when it changes on disk"""
+        path = os.path.join(self.root, filename)
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._digests.get(filename)
+        if cached and cached[0] == key:
+            return cached[1]
+        with open(path, 'rb') as f:
+            digest = hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+        self._digests[filename] = (key, digest)
+        return digest
+
+    def _versioned(self, match):
+        name = match.group('name')
+        try:
+            digest = self.digest(name)
+        except OSError:
+            return match.group(0)
+        return f'{match.group("attr")}{name}?v={digest}"'
+
+    def _stat_key(self, filename):
+        try:
+            stat = os.stat(os.path.join(self.root, filename))
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def index(self):
+        """index.html pointing at content-hashed asset URLs"""
+        with self._lock:
+            index_key = self._stat_key('index.html')
+            if (self._index is None or self._index['key'] != index_key or
+                    any(self._stat_key(name) != key for name, key in self._index['assets'])):
+                with open(os.path.join(self.root, 'index.html'), encoding='utf-8') as f:
+                    html = f.read()
+                assets = [(m.group('name'), self._stat_key(m.group('name'))) for m in self.ASSET_REF.finditer(html)]
+                html = self.ASSET_REF.sub(self._versioned, html).encode('utf-8')
+                self._index = {'key': index_key, 'assets': assets, 'html': html,
+                               'etag': hashlib.blake2b(html, digest_size=8).hexdigest()}
+            html, etag = self._index['html'], self._index['etag']
+
+        response = with_validator(Response(html, mimetype='text/html'), etag)
+        return response.make_conditional(request)
+
+    def send(self, filename):
+        response = send_from_directory(self.root, filename)
+        version = request.args.get('v')
+        if version and version == self.digest(filename):
+            response.headers['Cache-Control'] = IMMUTABLE
+        else:
+            response.headers['Cache-Control'] = REVALIDATE
+        return response
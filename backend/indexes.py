@@ -0,0 +1,135 @@
+'''
+Index bootstrap for the comments database.
+
+ensure_indexes() is idempotent and runs at startup (and via `flask init-db`).
+check_query_plans() explains the hot queries and reports any that fall back
+to a collection scan, `flask check-indexes` fails when it finds one.
+
+Articles are joined on the fixed-width articleKey (articles.py). The
+indexes that were built on the full headline are listed in RETIRED_INDEXES
+and dropped by drop_retired_indexes() once every document has a key.
+'''
+
+from bson.objectid import ObjectId
+
+from article_stats import ACTIVITY_RETENTION_SECONDS
+from articles import article_key, backfill_article_keys
+from pymongo import ASCENDING, DESCENDING, TEXT
+from pymongo.errors import OperationFailure
+
+# (collection, keys, options)
+INDEXES = [
+    ('comments', [('articleKey', ASCENDING), ('timestamp', ASCENDING)], {'name': 'articleKey_timestamp'}),
+    ('replies', [('comment_id', ASCENDING), ('timestamp', ASCENDING)], {'name': 'comment_id_timestamp'}),
+    ('replies', [('comment_id', ASCENDING), ('ancestors', ASCENDING)], {'name': 'comment_id_ancestors'}),
+    ('article_stats', [('articleKey', ASCENDING)], {'name': 'articleKey_unique', 'unique': True}),
+    # GET /api/search with SEARCH_BACKEND=mongo (one text index per collection)
+    ('comments', [('text', TEXT)], {'name': 'text_search'}),
+    ('replies', [('text', TEXT)], {'name': 'text_search'}),
+    # Trending leaderboard (trending.py): activity buckets, expired by TTL, and the all-time ranking
+    ('article_activity', [('articleKey', ASCENDING), ('bucket', ASCENDING)],
+     {'name': 'articleKey_bucket_unique', 'unique': True}),
+    ('article_activity', [('bucket', ASCENDING)],
+     {'name': 'bucket_ttl', 'expireAfterSeconds': ACTIVITY_RETENTION_SECONDS}),
+    ('article_stats', [('commentCount', DESCENDING)], {'name': 'commentCount'}),
+]
+
+# (collection, name) of indexes replaced by the articleKey ones above
+RETIRED_INDEXES = [
+    ('comments', 'articleTitle_timestamp'),
+    ('article_stats', 'articleTitle_unique'),
+    ('article_activity', 'articleTitle_bucket_unique'),
+]
+
+
+def ensure_indexes(db):
+    """Create every index the API relies on, returns the index names
+
+    Keys are backfilled first, the unique articleKey indexes need them.
+    """
+    backfill_article_keys(db)
+    names = []
+    for collection, keys, options in INDEXES:
+        try:
+            names.append(db[collection].create_index(keys, **options))
+        except OperationFailure as e:
+            # Racing upserts, or headlines that only differed in spacing, may have left duplicates behind
+            if collection not in MERGE_DUPLICATES or e.code != 11000:
+                raise
+            MERGE_DUPLICATES[collection](db)
+            names.append(db[collection].create_index(keys, **options))
+    return names
+
+
+def drop_retired_indexes(db):
+    """Drop the headline indexes replaced by articleKey ones, returns the names dropped"""
+    dropped = []
+    for collection, name in RETIRED_INDEXES:
+        if name in db[collection].index_information():
+            db[collection].drop_index(name)
+            dropped.append(name)
+    return dropped
+
+
+def _merge_duplicates(collection, group_by, total_field):
+    """Fold rows sharing group_by into the first one, summing total_field"""
+    pipeline = [
+        {'$group': {'_id': {field: f'${field}' for field in group_by}, 'ids': {'$push': '$_id'},
+                    'total': {'$sum': f'${total_field}'}, 'n': {'$sum': 1}}},
+        {'$match': {'n': {'$gt': 1}}},
+    ]
+    for group in list(collection.aggregate(pipeline)):
+        keep, *extra = group['ids']
+        collection.update_one({'_id': keep}, {'$set': {total_field: group['total']}})
+        collection.delete_many({'_id': {'$in': extra}})
+
+
+def merge_duplicate_stats(db):
+    """Fold duplicate article_stats rows into one so the unique index can be built"""
+    _merge_duplicates(db.article_stats, ('articleKey',), 'commentCount')
+
+
+def merge_duplicate_activity(db):
+    """The same for article_activity buckets"""
+    _merge_duplicates(db.article_activity, ('articleKey', 'bucket'), 'count')
+
+
+MERGE_DUPLICATES = {'article_stats': merge_duplicate_stats, 'article_activity': merge_duplicate_activity}
+
+
+def hot_queries():
+    """The queries on the request path that must be served from an index"""
+    sample_key = article_key('index check')
+    return [
+        ('get_comments', 'comments', {'articleKey': sample_key}),
+        ('get_comment_count fallback', 'comments', {'articleKey': {'$in': [sample_key]}}),
+        ('article_stats lookup', 'article_stats', {'articleKey': sample_key}),
+        ('replies for a page of comments', 'replies', {'comment_id': {'$in': [ObjectId()]}}),
+        ('reply subtree', 'replies', {'comment_id': ObjectId(), 'ancestors': ObjectId()}),
+    ]
+
+
+def _stages(plan):
+    """Yield every stage name in an explain() plan tree"""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _stages(item)
+
+
+def uses_collscan(explain_output):
+    winning_plan = explain_output.get('queryPlanner', {}).get('winningPlan', {})
+    return 'COLLSCAN' in _stages(winning_plan)
+
+
+def check_query_plans(db):
+    """Return the names of hot queries whose winning plan is a COLLSCAN"""
+    failures = []
+    for name, collection, query in hot_queries():
+        if uses_collscan(db[collection].find(query).explain()):
+            failures.append(name)
+    return failures
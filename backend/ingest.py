@@ -0,0 +1,251 @@
+'''
+Write-behind ingestion for new comments (INGEST_MODE=write_behind).
+
+POST /api/comments normally waits on two acknowledged writes, the comment
+insert and its counter upsert. In write-behind mode the handler only
+assigns the comment its _id, appends it to a local spill file and queues
+it; a background thread flushes the queue with one insert_many and one
+aggregated article_stats bulk_write whenever it holds INGEST_BATCH_SIZE
+comments or INGEST_FLUSH_INTERVAL seconds have passed.
+
+- Backpressure: the queue is bounded, submit() raises QueueFull when it
+  stays full (the API answers 503 with Retry-After).
+- Crash safety: comments are in the spill file before the client gets its
+  id. Each flush moves the current file aside as a segment and deletes it
+  only after Mongo acknowledged the batch; leftover segments are replayed
+  at startup, including those of a replay that died half way. Replays are idempotent because the ids were assigned up
+  front (duplicates are skipped and not counted again). Without
+  MONGO_TRANSACTIONS a batch that fails between the insert and the $inc
+  leaves its counts low until `flask rebuild-stats`.
+- Comments become readable after their flush, at most one interval later.
+'''
+
+import glob
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from bson import json_util
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from article_stats import apply_count_deltas, counted_write
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WriteBehindQueue:
+    def __init__(self, db_getter, spill_dir, batch_size=500, flush_interval=0.2, max_pending=10000,
+                 put_timeout=0.5, fsync=True, use_transactions=False, on_flushed=None):
+        self.db_getter = db_getter
+        self.spill_dir = spill_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self.fsync = fsync
+        self.use_transactions = use_transactions
+        # Called with the article titles of every written batch (e.g. to invalidate caches)
+        self.on_flushed = on_flushed
+        self.stats = {'queued': 0, 'flushed': 0, 'batches': 0, 'rejected': 0, 'replayed': 0}
+
+        self._pending = []
+        self._cond = threading.Condition()
+        self._flushing = threading.Lock()
+        self._spill = None
+        self._pid = None
+        self._thread = None
+        self._closed = False
+        self._segment = 0
+
+    # -- producer side --------------------------------------------------
+
+    def submit(self, comment):
+        """Queue one comment (its _id must already be set), durable once this returns"""
+        self._ensure_started()
+        line = json_util.dumps(comment) + '\n'
+        deadline = time.monotonic() + self.put_timeout
+        with self._cond:
+            while len(self._pending) >= self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._closed:
+                    self.stats['rejected'] += 1
+                    raise QueueFull("comment queue is full")
+                self._cond.wait(remaining)
+            self._spill.write(line)
+            self._spill.flush()
+            if self.fsync:
+                os.fsync(self._spill.fileno())
+            self._pending.append(comment)
+            self.stats['queued'] += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    # -- flusher side ---------------------------------------------------
+
+    def _spill_path(self):
+        return os.path.join(self.spill_dir, f"comments.{os.getpid()}.jsonl")
+
+    def _ensure_started(self):
+        # Started lazily so every forked worker gets its own file and thread
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._pending = []
+            if os.path.exists(self._spill_path()):
+                # Left by an earlier process with the same pid, flush it like a failed segment
+                os.replace(self._spill_path(), f"{self._spill_path()}.orphan{time.time_ns()}.flushing")
+            self._spill = open(self._spill_path(), 'a', encoding='utf-8')
+            self._pid = os.getpid()
+            self._closed = False
+            self._thread = threading.Thread(target=self._run, name='comment-write-behind', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        self.replay()
+        while True:
+            with self._cond:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            try:
+                self.flush()
+            except PyMongoError:
+                logger.exception("write-behind flush failed, the batch stays in its spill segment")
+                time.sleep(min(5, self.flush_interval * 10))
+            if closed:
+                return
+
+    def flush(self):
+        """Write everything queued so far, returns the number of comments inserted"""
+        with self._flushing:
+            inserted = self._retry_segments()
+            with self._cond:
+                segment = None
+                if self._pending:
+                    # Everything in the current file is in this batch, so the file moves with it
+                    self._segment += 1
+                    segment = f"{self._spill_path()}.{self._segment}.flushing"
+                    self._spill.close()
+                    os.replace(self._spill_path(), segment)
+                    self._spill = open(self._spill_path(), 'a', encoding='utf-8')
+                batch, self._pending = self._pending, []
+                self._cond.notify_all()
+            if batch:
+                # On failure the segment stays behind and the next flush retries it
+                inserted += self._write(batch)
+                os.remove(segment)
+            return inserted
+
+    def _retry_segments(self):
+        """Segments whose flush failed earlier in this process"""
+        inserted = 0
+        for path in sorted(glob.glob(f"{self._spill_path()}.*.flushing")):
+            inserted += self._write(self._read_segment(path))
+            os.remove(path)
+        return inserted
+
+    def _write(self, batch):
+        """insert_many plus one aggregated $inc per article, duplicates (replays) are not counted twice"""
+        if not batch:
+            return 0
+        db = self.db_getter()
+        skipped = set()
+        with counted_write(db, self.use_transactions) as txn:
+            try:
+                db.comments.insert_many(batch, ordered=False, session=txn)
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                if any(error.get('code') != DUPLICATE_KEY for error in errors):
+                    raise
+                skipped = {error['index'] for error in errors}
+            deltas = defaultdict(int)
+            for index, comment in enumerate(batch):
+                if index not in skipped:
+                    deltas[comment.get('articleTitle')] += 1
+            apply_count_deltas(db, deltas, session=txn)
+        if self.on_flushed is not None:
+            self.on_flushed(set(deltas))
+        inserted = len(batch) - len(skipped)
+        self.stats['flushed'] += inserted
+        self.stats['batches'] += 1
+        return inserted
+
+    @staticmethod
+    def _read_segment(path):
+        batch = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    batch.append(json_util.loads(line))
+                except ValueError:
+                    # A torn last line from a crash mid-append was never acknowledged
+                    logger.warning("skipping unreadable line in %s", path)
+        return batch
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def replay(self):
+        """Insert comments left behind by processes that died before flushing them"""
+        if not os.path.isdir(self.spill_dir):
+            return 0
+        replayed = 0
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, 'comments.*.jsonl*'))):
+            source = path
+            if path.endswith('.replaying'):
+                # Claimed by a replay that may have died with it: <source>.<owner pid>.replaying
+                source, owner, _ = path.rsplit('.', 2)
+                if not owner.isdigit() or self._alive(int(owner)):
+                    continue
+            pid = os.path.basename(source).split('.')[1]
+            if not pid.isdigit() or self._alive(int(pid)):
+                continue
+            claimed = f"{source}.{os.getpid()}.replaying"
+            try:
+                os.rename(path, claimed)  # Only one worker wins each file
+            except OSError:
+                continue
+            try:
+                replayed += self._write(self._read_segment(claimed))
+            except Exception:
+                os.rename(claimed, source)  # Left for the next replay
+                raise
+            os.remove(claimed)
+        self.stats['replayed'] += replayed
+        if replayed:
+            logger.info("replayed %d spilled comments", replayed)
+        return replayed
+
+    def close(self, timeout=10):
+        """Flush what is queued and stop the flusher (worker shutdown)"""
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._spill.close()
+        self._pid = None
+        if os.path.exists(self._spill_path()) and os.path.getsize(self._spill_path()) == 0:
+            os.remove(self._spill_path())
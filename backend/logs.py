@@ -0,0 +1,29 @@
+'''
+Leveled, sampled structured logging for the request path.
+
+log_event() writes one JSON object per line ({"event": ..., fields}).
+A disabled level costs a single isEnabledFor() check, and DEBUG/INFO
+events are further thinned to LOG_SAMPLE_RATE (0-1) so a busy worker
+can keep them on. Warnings and errors are never sampled.
+'''
+
+import json
+import logging
+import os
+import random
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1'))
+
+
+def configure():
+    """Log to stderr at LOG_LEVEL unless a handler is already set up (e.g. by gunicorn or tests)"""
+    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+
+
+def log_event(logger, level, event, **fields):
+    if not logger.isEnabledFor(level):
+        return
+    if level < logging.WARNING and SAMPLE_RATE < 1 and random.random() >= SAMPLE_RATE:
+        return
+    logger.log(level, json.dumps(dict(event=event, **fields), default=str))
@@ -0,0 +1,249 @@
+'''
+Request metrics in the Prometheus text format (GET /metrics).
+
+- http_request_duration_seconds: latency per route, method and status.
+- http_request_mongo_commands / http_request_mongo_seconds: MongoDB
+  commands each request issued and the time spent in them, from pymongo
+  command monitoring (MongoCommandMetrics is passed to every MongoClient).
+- mongo_command_duration_seconds: every command, by command name.
+- nyt_upstream_duration_seconds: NYT Article Search calls, by status.
+- Cache counters (NYT cache, prefetch, ETag versions, write-behind queue)
+  are read from the components' own stats when scraped.
+
+Metrics live in process memory. Under gunicorn every worker has its own
+registry, so with METRICS_DIR set each worker writes a snapshot there every
+METRICS_SNAPSHOT_INTERVAL seconds and /metrics sums all of them. Counts of
+workers that exited are folded into retired.json so counters never go back.
+'''
+
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _bound(value):
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+
+class Counter:
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def inc(self, amount=1, **labels):
+        self.registry._add(self.name, tuple(sorted(labels.items())), amount)
+
+
+class Histogram:
+    def __init__(self, registry, name, buckets):
+        self.registry = registry
+        self.name = name
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        labels = tuple(sorted(labels.items()))
+        with self.registry._lock:
+            values = self.registry._values
+            for bound in self.buckets:
+                if value <= bound:
+                    key = (self.name + '_bucket', labels + (('le', _bound(bound)),))
+                    values[key] = values.get(key, 0) + 1
+            for suffix, amount in (('_sum', value), ('_count', 1)):
+                key = (self.name + suffix, labels)
+                values[key] = values.get(key, 0) + amount
+
+
+class Registry:
+    def __init__(self):
+        self._families = {}    # family name -> (type, help)
+        self._values = {}      # (sample name, labels) -> value
+        self._collectors = []  # (family name, label name, stats getter)
+        self._lock = threading.Lock()
+        self._snapshots_pid = None
+
+    def counter(self, name, help_text):
+        self._families[name] = ('counter', help_text)
+        return Counter(self, name)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._families[name] = ('histogram', help_text)
+        return Histogram(self, name, buckets)
+
+    def collect_stats(self, name, help_text, label, stats_getter):
+        """Export a component's {key: count} stats dict as a counter labelled by key"""
+        self._families[name] = ('counter', help_text)
+        self._collectors.append((name, label, stats_getter))
+
+    def _add(self, name, labels, amount):
+        with self._lock:
+            key = (name, labels)
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            samples = dict(self._values)
+        for name, label, stats_getter in self._collectors:
+            stats = stats_getter()
+            for key, value in (stats or {}).items():
+                samples[(name, ((label, key),))] = value
+        return samples
+
+    def _family(self, sample_name):
+        if sample_name in self._families:
+            return sample_name
+        for suffix in ('_bucket', '_sum', '_count'):
+            if sample_name.endswith(suffix) and sample_name[:-len(suffix)] in self._families:
+                return sample_name[:-len(suffix)]
+        return sample_name
+
+    def render(self, samples=None):
+        samples = self.samples() if samples is None else samples
+        by_family = {}
+        for (name, labels), value in samples.items():
+            by_family.setdefault(self._family(name), []).append((name, labels, value))
+        lines = []
+        for family in sorted(by_family):
+            kind, help_text = self._families.get(family, ('untyped', ''))
+            lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} {kind}')
+            for name, labels, value in sorted(by_family[family], key=lambda sample: (sample[1], sample[0])):
+                lines.append(f'{name}{_labels_text(labels)} {float(value)!r}')
+        return '\n'.join(lines) + '\n'
+
+    # -- several worker processes ---------------------------------------
+
+    def write_snapshot(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'worker.{os.getpid()}.json')
+        # The snapshot thread and a scrape may both be writing
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(_encode(self.samples()), f)
+        os.replace(tmp, path)
+
+    def ensure_snapshots(self, directory, interval):
+        """Start this process's snapshot writer once"""
+        if self._snapshots_pid == os.getpid():
+            return
+        with self._lock:
+            if self._snapshots_pid == os.getpid():
+                return
+            self._snapshots_pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.write_snapshot(directory)
+        threading.Thread(target=run, name='metrics-snapshot', daemon=True).start()
+
+    def merged_samples(self, directory):
+        """This process's samples plus every other worker's latest snapshot"""
+        self.write_snapshot(directory)
+        with open(os.path.join(directory, 'merge.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            retired_path = os.path.join(directory, 'retired.json')
+            retired = _read(retired_path)
+            merged, dead = dict(retired), False
+            for path in glob.glob(os.path.join(directory, 'worker.*.json')):
+                samples = _read(path)
+                if not _alive(int(os.path.basename(path).split('.')[1])):
+                    _merge(retired, samples)
+                    os.remove(path)
+                    dead = True
+                _merge(merged, samples)
+            if dead:
+                with open(retired_path + '.tmp', 'w') as f:
+                    json.dump(_encode(retired), f)
+                os.replace(retired_path + '.tmp', retired_path)
+        return merged
+
+
+def _encode(samples):
+    return [[name, [list(label) for label in labels], value] for (name, labels), value in samples.items()]
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return {(name, tuple(tuple(label) for label in labels)): value for name, labels, value in json.load(f)}
+    except (OSError, ValueError):
+        return {}
+
+
+def _merge(into, samples):
+    for key, value in samples.items():
+        into[key] = into.get(key, 0) + value
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command, and totals them per request for the thread serving it"""
+
+    def __init__(self, registry):
+        self.duration = registry.histogram('mongo_command_duration_seconds', 'MongoDB command latency')
+        self.failures = registry.counter('mongo_command_failures_total', 'MongoDB commands that failed')
+        self._request = threading.local()
+
+    def begin_request(self):
+        self._request.totals = [0, 0.0]
+
+    def end_request(self):
+        """(commands, seconds) since begin_request on this thread"""
+        totals = getattr(self._request, 'totals', None) or [0, 0.0]
+        self._request.totals = None
+        return totals
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self.failures.inc(command=event.command_name)
+        self._record(event)
+
+    def _record(self, event):
+        seconds = event.duration_micros / 1e6
+        self.duration.observe(seconds, command=event.command_name)
+        totals = getattr(self._request, 'totals', None)
+        if totals is not None:
+            totals[0] += 1
+            totals[1] += seconds
+
+
+registry = Registry()
+mongo_metrics = MongoCommandMetrics(registry)
+request_duration = registry.histogram('http_request_duration_seconds', 'Time to produce a response, per route')
+request_mongo_commands = registry.histogram('http_request_mongo_commands', 'MongoDB commands issued per request',
+                                            COUNT_BUCKETS)
+request_mongo_seconds = registry.histogram('http_request_mongo_seconds', 'Time spent in MongoDB per request')
+nyt_upstream_duration = registry.histogram('nyt_upstream_duration_seconds', 'NYT Article Search call latency')
@@ -0,0 +1,238 @@
+'''
+Moderation writes shared by the single-item endpoints and the bulk endpoint.
+
+A bulk request is a list of actions, each either on one item
+
+    {"action": "remove", "target": "comment", "id": "..."}
+    {"action": "partial_redact", "target": "reply", "id": "...", "commentId": "...",
+     "redactedText": "..."}
+
+or on every item matching a filter, resolved on the server
+
+    {"action": "redact", "target": "all", "filter": {"articleTitle": "...", "username": "..."}}
+
+(the article may also be given as {"articleKey": "ak_..."}, see articles.py)
+
+run_bulk() resolves every action with one read per id-based collection plus
+one per filter, then applies all of them as a single unordered bulk_write
+per collection (MongoDB bulk writes cannot span collections) and moves the
+article counters with one more. Each action gets its own result.
+
+A bulk write only reports how many documents it changed in total, so the
+removed items are read back afterwards: only those carrying this call's
+removed_at/removed_by count as removed here. An item a concurrent request
+removed in between is reported as already removed and its count is left to
+that request.
+'''
+
+from collections import defaultdict
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from article_stats import apply_count_deltas
+from articles import to_article_key
+from events import update_event
+
+ACTIONS = ('remove', 'redact', 'partial_redact')
+TARGETS = ('comment', 'reply')
+FILTER_FIELDS = ('articleTitle', 'articleKey', 'username')
+COLLECTIONS = {'comment': 'comments', 'reply': 'replies'}
+
+# Texts shown in place of moderated items
+REMOVED_TEXT = {'comment': "[Comment removed by a moderator]", 'reply': ""}
+REDACTED_TEXT = {
+    'comment': "[This comment has been redacted by a moderator]",
+    'reply': "[This reply has been redacted by a moderator]",
+}
+
+
+class InvalidAction(ValueError):
+    pass
+
+
+def moderation_changes(action, target, moderator, redacted_text=None):
+    """The $set applied by one moderation action"""
+    now = datetime.now().isoformat()
+    if action == 'remove':
+        return {'text': REMOVED_TEXT[target], 'removed_at': now, 'removed_by': moderator}
+    if action == 'redact':
+        return {'text': REDACTED_TEXT[target], 'redacted_at': now, 'redacted_by': moderator}
+    return {'text': redacted_text, 'partially_redacted_at': now, 'redacted_by': moderator}
+
+
+def _object_id(value, name):
+    try:
+        return ObjectId(value)
+    except Exception:
+        raise InvalidAction(f"{name} is not a valid id")
+
+
+def parse_action(item):
+    """Validate one bulk item, raising InvalidAction with a client-facing message"""
+    if not isinstance(item, dict):
+        raise InvalidAction("each action must be an object")
+    action = item.get('action')
+    if action not in ACTIONS:
+        raise InvalidAction(f"action must be one of {', '.join(ACTIONS)}")
+
+    if 'filter' in item:
+        if action == 'partial_redact':
+            raise InvalidAction("partial_redact needs an id")
+        target = item.get('target', 'all')
+        if target not in TARGETS + ('all',):
+            raise InvalidAction("target must be comment, reply or all")
+        query = item['filter']
+        if (not isinstance(query, dict) or not query or
+                any(key not in FILTER_FIELDS or not isinstance(value, str) for key, value in query.items())):
+            raise InvalidAction(f"filter must match on {' and/or '.join(FILTER_FIELDS)}")
+        query = dict(query)
+        if 'articleTitle' in query or 'articleKey' in query:
+            keys = {to_article_key(query.pop(field)) for field in ('articleTitle', 'articleKey') if field in query}
+            if len(keys) > 1:
+                raise InvalidAction("articleTitle and articleKey name different articles")
+            query['articleKey'] = keys.pop()
+        targets = TARGETS if target == 'all' else (target,)
+        return {'action': action, 'targets': targets, 'filter': query}
+
+    target = item.get('target')
+    if target not in TARGETS:
+        raise InvalidAction("target must be comment or reply")
+    parsed = {'action': action, 'targets': (target,), 'id': _object_id(item.get('id'), 'id')}
+    if target == 'reply' and item.get('commentId') is not None:
+        parsed['comment_id'] = _object_id(item['commentId'], 'commentId')
+    if action == 'partial_redact':
+        if not isinstance(item.get('redactedText'), str):
+            raise InvalidAction("partial_redact needs redactedText")
+        parsed['redacted_text'] = item['redactedText']
+    return parsed
+
+
+def _resolve(db, parsed_items):
+    """Fetch the documents each action applies to: {index: {target: [docs]}}"""
+    projection = {'articleTitle': 1, 'comment_id': 1, 'removed_at': 1}
+    ids = defaultdict(set)
+    for parsed in parsed_items.values():
+        if 'id' in parsed:
+            ids[parsed['targets'][0]].add(parsed['id'])
+    by_id = {}
+    for target, target_ids in ids.items():
+        for doc in db[COLLECTIONS[target]].find({'_id': {'$in': list(target_ids)}}, projection):
+            by_id[(target, doc['_id'])] = doc
+
+    resolved = {}
+    for index, parsed in parsed_items.items():
+        if 'id' in parsed:
+            target = parsed['targets'][0]
+            doc = by_id.get((target, parsed['id']))
+            if doc is not None and 'comment_id' in parsed and doc.get('comment_id') != parsed['comment_id']:
+                doc = None
+            resolved[index] = {target: [doc] if doc else []}
+        else:
+            resolved[index] = {
+                target: list(db[COLLECTIONS[target]].find(parsed['filter'], projection))
+                for target in parsed['targets']
+            }
+    return resolved
+
+
+def run_bulk(db, items, moderator, session=None):
+    """Apply a list of moderation actions, returning (results, events)
+
+    results has one entry per item in request order. events are the
+    (article_title, event) pairs to publish once the writes are committed.
+    """
+    results = [None] * len(items)
+    parsed_items = {}
+    for index, item in enumerate(items):
+        try:
+            parsed_items[index] = parse_action(item)
+        except InvalidAction as e:
+            results[index] = {'index': index, 'status': 'invalid', 'error': str(e)}
+
+    resolved = _resolve(db, parsed_items)
+
+    ops = {target: [] for target in TARGETS}
+    op_items = {target: [] for target in TARGETS}
+    removed = set()
+    removals = {target: {} for target in TARGETS}  # doc id -> the removed_at/removed_by this call sets
+    item_changes = defaultdict(list)
+    for index, parsed in parsed_items.items():
+        action = parsed['action']
+        matched = modified = 0
+        for target, docs in resolved[index].items():
+            matched += len(docs)
+            if action == 'remove':
+                # Items that are already removed (or removed earlier in this batch) stay as they are
+                docs = [doc for doc in docs if 'removed_at' not in doc and (target, doc['_id']) not in removed]
+                removed.update((target, doc['_id']) for doc in docs)
+            if not docs:
+                continue
+            changes = moderation_changes(action, target, moderator, parsed.get('redacted_text'))
+            doc_ids = [doc['_id'] for doc in docs]
+            if len(doc_ids) == 1:
+                query = {'_id': doc_ids[0]}
+                op = UpdateOne
+            else:
+                query = {'_id': {'$in': doc_ids}}
+                op = UpdateMany
+            if action == 'remove':
+                query['removed_at'] = {'$exists': False}
+            ops[target].append(op(query, {'$set': changes}))
+            op_items[target].append(index)
+            modified += len(docs)
+            for doc in docs:
+                comment_id = doc.get('comment_id') if target == 'reply' else None
+                if action == 'remove':
+                    removals[target][doc['_id']] = (changes['removed_at'], changes['removed_by'])
+                item_changes[index].append(
+                    (target, doc['_id'], doc.get('articleTitle'), update_event(target, doc['_id'], comment_id, changes)))
+
+        if not matched:
+            status = 'not_found'
+        elif not modified:
+            status = 'already_removed'
+        else:
+            status = 'ok'
+        results[index] = {'index': index, 'status': status, 'matched': matched, 'modified': modified}
+
+    failed = set()
+    for target in TARGETS:
+        if not ops[target]:
+            continue
+        try:
+            db[COLLECTIONS[target]].bulk_write(ops[target], ordered=False, session=session)
+        except BulkWriteError as e:
+            for write_error in e.details.get('writeErrors', []):
+                index = op_items[target][write_error['index']]
+                failed.add(index)
+                results[index] = {'index': index, 'status': 'error', 'error': write_error.get('errmsg')}
+
+    confirmed = set()
+    for target, pending in removals.items():
+        if not pending:
+            continue
+        for doc in db[COLLECTIONS[target]].find({'_id': {'$in': list(pending)}},
+                                                {'removed_at': 1, 'removed_by': 1}, session=session):
+            if (doc.get('removed_at'), doc.get('removed_by')) == pending[doc['_id']]:
+                confirmed.add((target, doc['_id']))
+
+    # Every touched article gets a new version, removals also move its count
+    count_deltas = defaultdict(int)
+    events = []
+    for index, changes in item_changes.items():
+        if index in failed:
+            continue
+        for target, doc_id, article_title, event in changes:
+            if doc_id in removals[target] and (target, doc_id) not in confirmed:
+                # Removed by someone else between the read and the write
+                results[index]['modified'] -= 1
+                if not results[index]['modified']:
+                    results[index]['status'] = 'already_removed'
+                continue
+            count_deltas[article_title] += event['countDelta']
+            events.append((article_title, event))
+    apply_count_deltas(db, count_deltas, session=session)
+    return results, events
@@ -0,0 +1,340 @@
+'''
+Server-side cache for the NYT Article Search proxy.
+
+Responses are cached by (query, page) with a TTL and LRU eviction bounded by
+entry count and total bytes. Concurrent misses for the same key share a single
+upstream request, and expired entries are kept around for a while so they can
+be served when NYT fails or rate-limits us.
+
+With transform=trim_search_response only the article fields the frontend
+renders are kept, which cuts a page from ~100 KB to a few KB.
+'''
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from articles import article_key
+
+logger = logging.getLogger(__name__)
+
+NYT_SEARCH_URL = 'https://api.nytimes.com/svc/search/v2/articlesearch.json'
+NYT_SITE_URL = 'https://www.nytimes.com/'
+
+# What clients are told when NYT could not be reached, the client errors name the URL and with it the API key
+REQUEST_FAILED = "NYT request failed"
+
+
+def _image_url(multimedia):
+    # Newer responses carry an object with absolute URLs, older ones a list of site-relative paths
+    if isinstance(multimedia, dict):
+        return (multimedia.get('default') or {}).get('url')
+    if isinstance(multimedia, list) and multimedia and isinstance(multimedia[0], dict):
+        url = multimedia[0].get('url')
+        if url and not url.startswith('http'):
+            url = NYT_SITE_URL + url.lstrip('/')
+        return url
+    return None
+
+
+def trim_article(doc):
+    """The fields frontend/script.js renders, in the shape it already reads, plus the article key"""
+    headline = doc.get('headline')
+    title = headline.get('main') if isinstance(headline, dict) else headline
+    trimmed = {
+        'headline': {'main': title},
+        'abstract': doc.get('abstract') or doc.get('snippet') or '',
+        'word_count': doc.get('word_count'),
+    }
+    if isinstance(title, str) and title:
+        # What the comment routes accept in place of the headline, see articles.py
+        trimmed['articleKey'] = article_key(title)
+    url = _image_url(doc.get('multimedia'))
+    if url:
+        trimmed['multimedia'] = {'default': {'url': url}}
+    return trimmed
+
+
+def trim_search_response(body):
+    """Article Search body (bytes) reduced to {"response": {"docs": [trimmed articles]}}"""
+    try:
+        docs = json.loads(body)['response']['docs']
+    except (ValueError, KeyError, TypeError):
+        return body
+    trimmed = {'response': {'docs': [trim_article(doc) for doc in docs if isinstance(doc, dict)]}}
+    return json.dumps(trimmed, separators=(',', ':')).encode()
+
+
+class UpstreamError(Exception):
+    """NYT answered with something other than 200 (or could not be reached)"""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _request_failed(error):
+    """UpstreamError for a request that got no answer, logged by type only (the message holds the URL)"""
+    logger.warning("NYT request failed: %s", type(error).__name__)
+    return UpstreamError(500, REQUEST_FAILED)
+
+
+class _Entry:
+    __slots__ = ('body', 'fetched_at')
+
+    def __init__(self, body, fetched_at):
+        self.body = body
+        self.fetched_at = fetched_at
+
+
+class _Flight:
+    """A fetch in progress that other threads can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.body = None
+        self.error = None
+
+
+class NYTArticleCache:
+    def __init__(self, api_key_getter, base_url=NYT_SEARCH_URL, ttl=300, stale_ttl=3600,
+                 max_entries=256, max_bytes=32 * 1024 * 1024, timeout=5.0, pool_size=10, transform=None,
+                 on_upstream=None):
+        self.api_key_getter = api_key_getter
+        self.base_url = base_url
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.pool_size = pool_size
+        # Applied to every upstream body before it is cached and served
+        self.transform = transform
+        # Called with (seconds, status code) after every upstream call, 0 when it never answered
+        self.on_upstream = on_upstream
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._session = None
+        self.stats = {'hit': 0, 'miss': 0, 'stale': 0, 'coalesced': 0}
+
+    @property
+    def session(self):
+        # One pooled keep-alive session per process so we stop paying a TLS handshake per request
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+        return self._session
+
+    def get(self, query, page):
+        """Return (body_bytes, cache_status) for a search, fetching from NYT if needed.
+
+        cache_status is one of HIT, MISS, STALE. Raises UpstreamError when NYT
+        fails and there is nothing cached to fall back on.
+        """
+        key = (query, str(page))
+
+        with self._lock:
+            body = self._fresh(key)
+            if body is not None:
+                return body, 'HIT'
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                self.stats['coalesced'] += 1
+
+        if leader:
+            try:
+                flight.body = self._fetch(query, page)
+                self._store(key, flight.body)
+            except UpstreamError as e:
+                flight.error = e
+            except requests.RequestException as e:
+                flight.error = _request_failed(e)
+            except Exception:
+                # e.g. from transform; the waiting threads must not get an empty body
+                logger.exception("NYT fetch failed")
+                flight.error = UpstreamError(500, REQUEST_FAILED)
+            finally:
+                with self._lock:
+                    self._flights.pop(key, None)
+                if flight.body is None and flight.error is None:
+                    flight.error = UpstreamError(500, "NYT request was interrupted")
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        return self._result(key, flight.body, flight.error, leader)
+
+    def refresh(self, query, page):
+        """Fetch a search from NYT now and cache it, raises UpstreamError (the prefetcher's path)"""
+        try:
+            body = self._fetch(query, page)
+        except requests.RequestException as e:
+            raise _request_failed(e)
+        self._store((query, str(page)), body)
+        return body
+
+    def _fresh(self, key):
+        # Caller holds the lock
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry.fetched_at < self.ttl:
+            self._entries.move_to_end(key)
+            self.stats['hit'] += 1
+            return entry.body
+        return None
+
+    def _result(self, key, body, error, leader):
+        if error is None:
+            if leader:
+                with self._lock:
+                    self.stats['miss'] += 1
+            return body, 'MISS'
+
+        # Upstream failed or rate-limited us, fall back to an expired copy if we still have one
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.fetched_at < self.ttl + self.stale_ttl:
+                self.stats['stale'] += 1
+                return entry.body, 'STALE'
+        raise error
+
+    def _params(self, query, page):
+        # Encoded by the HTTP client; '+' is still a space, as when the query was pasted into the URL
+        return {'q': query.replace('+', ' '), 'page': page, 'api-key': self.api_key_getter()}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            for key in self.stats:
+                self.stats[key] = 0
+
+    def _timed(self, started, status):
+        if self.on_upstream is not None:
+            self.on_upstream(time.perf_counter() - started, status)
+
+    def _fetch(self, query, page):
+        started = time.perf_counter()
+        try:
+            response = self.session.get(self.base_url, params=self._params(query, page), timeout=self.timeout)
+        except requests.RequestException:
+            self._timed(started, 0)
+            raise
+        self._timed(started, response.status_code)
+        if response.status_code != 200:
+            raise UpstreamError(response.status_code,
+                                f"NYT API returned status code {response.status_code}")
+        return self._transformed(response.content)
+
+    def _transformed(self, body):
+        return self.transform(body) if self.transform is not None else body
+
+    def _store(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            self._entries[key] = _Entry(body, time.monotonic())
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+
+
+class AsyncNYTArticleCache(NYTArticleCache):
+    """Same cache for the async app: httpx instead of requests, asyncio futures for coalescing
+
+    All callers must share one event loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._async_flights = {}
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+            limits = httpx.Limits(max_connections=self.pool_size * 10,
+                                  max_keepalive_connections=self.pool_size)
+            self._client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        return self._client
+
+    async def get(self, query, page):
+        import asyncio
+        import httpx
+        key = (query, str(page))
+
+        with self._lock:
+            body = self._fresh(key)
+        if body is not None:
+            return body, 'HIT'
+
+        flight = self._async_flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = asyncio.get_running_loop().create_future()
+            self._async_flights[key] = flight
+            started = time.perf_counter()
+            try:
+                try:
+                    response = await self.client.get(self.base_url, params=self._params(query, page))
+                except httpx.HTTPError:
+                    self._timed(started, 0)
+                    raise
+                self._timed(started, response.status_code)
+                if response.status_code != 200:
+                    raise UpstreamError(response.status_code,
+                                        f"NYT API returned status code {response.status_code}")
+                body = self._transformed(response.content)
+                self._store(key, body)
+                flight.set_result(body)
+            except UpstreamError as e:
+                flight.set_exception(e)
+            except httpx.HTTPError as e:
+                flight.set_exception(_request_failed(e))
+            except Exception:
+                logger.exception("NYT fetch failed")
+                flight.set_exception(UpstreamError(500, REQUEST_FAILED))
+            finally:
+                self._async_flights.pop(key, None)
+                # Cancelled leader (client went away): release the followers instead of leaving them waiting
+                if not flight.done():
+                    flight.cancel()
+        else:
+            with self._lock:
+                self.stats['coalesced'] += 1
+
+        try:
+            body = await asyncio.shield(flight)
+            error = None
+        except UpstreamError as e:
+            body, error = None, e
+        except asyncio.CancelledError:
+            if not flight.cancelled():
+                raise  # this request was cancelled, not the one it waited on
+            body, error = None, UpstreamError(503, "NYT request was cancelled")
+        return self._result(key, body, error, leader)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,147 @@
+'''
+Background prefetch of the NYT searches almost every visit asks for.
+
+Nearly all /api/articles traffic is pages 0-2 of a handful of queries.
+ArticlePrefetcher refreshes those (query, page) pairs every interval and
+serves them from process memory, so the request path never waits on NYT.
+
+- Only one worker talks to NYT: each round the workers race for a lease in
+  scheduler_leases, the holder fetches every target (trimmed, see
+  nyt_cache.trim_search_response) and saves them to nyt_pages. Every
+  worker then loads the saved pages into memory.
+- The holder spaces its calls to stay within rate_per_minute and stops the
+  round early when NYT answers 429. NYT also caps a key per day (500 at the
+  time of writing), keep targets * rounds per day well below that.
+- Pages older than max_age are not served, requests fall back to the
+  on-demand cache (nyt_cache.py) as before.
+'''
+
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bson.binary import Binary
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from nyt_cache import UpstreamError
+
+logger = logging.getLogger(__name__)
+
+LEASE_ID = 'nyt_prefetch'
+
+
+def search_key(query, page):
+    """'davis+sacramento' (the configured form) and 'davis sacramento' (the decoded ?q=) are one search"""
+    return ' '.join(query.replace('+', ' ').split()), str(page)
+
+
+def parse_targets(queries, pages):
+    """'davis+sacramento,sacramento' and 3 -> every (query, page) pair for pages 0-2"""
+    return [(query.strip(), str(page)) for query in queries.split(',') if query.strip() for page in range(pages)]
+
+
+class ArticlePrefetcher:
+    def __init__(self, db_getter, cache, targets, interval=900.0, rate_per_minute=5, max_age=3600.0):
+        self.db_getter = db_getter
+        self.cache = cache
+        self.targets = targets
+        self.interval = interval
+        self.min_spacing = 60.0 / rate_per_minute
+        self.max_age = max_age
+        self.stats = {'served': 0, 'fetched': 0, 'failed': 0}
+
+        self._pages = {}  # (query, page) -> (body, fetched_at)
+        self._owner = None
+        self._next_call = 0.0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def get(self, query, page):
+        """The prefetched body for a search, or None when it is not a target or too old"""
+        entry = self._pages.get(search_key(query, page))
+        if entry is None or (datetime.utcnow() - entry[1]).total_seconds() > self.max_age:
+            return None
+        self.stats['served'] += 1
+        return entry[0]
+
+    def ensure_started(self):
+        """Start this process's prefetch thread once (no-op without targets, app.py passes none for NYT_PREFETCH=off)"""
+        if self._pid == os.getpid() or not self.targets:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._owner = f"{socket.gethostname()}:{os.getpid()}"
+            self._stop.clear()
+            threading.Thread(target=self._run, name='nyt-prefetch', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except PyMongoError:
+                logger.exception("NYT prefetch round failed")
+            if self._stop.wait(self.interval):
+                return
+
+    def run_once(self):
+        """One round: fetch everything if this process holds the lease, then load what is saved"""
+        if self._acquire_lease():
+            self._fetch_all()
+        self._load()
+
+    def _acquire_lease(self):
+        now = datetime.utcnow()
+        try:
+            self.db_getter().scheduler_leases.find_one_and_update(
+                {'_id': LEASE_ID, '$or': [{'expiresAt': {'$lt': now}}, {'owner': self._owner}]},
+                # Held a little longer than a round so the holder keeps it while it is alive
+                {'$set': {'owner': self._owner, 'expiresAt': now + timedelta(seconds=self.interval * 1.5)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def _wait_for_budget(self):
+        delay = self._next_call - time.monotonic()
+        if delay > 0 and self._stop.wait(delay):
+            return False
+        self._next_call = time.monotonic() + self.min_spacing
+        return True
+
+    def _fetch_all(self):
+        db = self.db_getter()
+        for query, page in self.targets:
+            if not self._wait_for_budget():
+                return
+            try:
+                body = self.cache.refresh(query, page)
+            except UpstreamError as e:
+                self.stats['failed'] += 1
+                logger.warning("prefetching %s page %s failed: %s", query, page, e)
+                if e.status_code == 429:
+                    return
+                continue
+            now = datetime.utcnow()
+            db.nyt_pages.update_one(
+                {'_id': {'q': query, 'page': page}},
+                {'$set': {'body': Binary(body), 'fetchedAt': now}},
+                upsert=True
+            )
+            self._pages[search_key(query, page)] = (body, now)
+            self.stats['fetched'] += 1
+
+    def _load(self):
+        ids = [{'q': query, 'page': page} for query, page in self.targets]
+        for doc in self.db_getter().nyt_pages.find({'_id': {'$in': ids}}):
+            self._pages[search_key(doc['_id']['q'], doc['_id']['page'])] = (bytes(doc['body']), doc['fetchedAt'])
+
+    def close(self):
+        self._stop.set()
+        self._pid = None
@@ -0,0 +1,195 @@
+'''
+Per-user and per-IP rate limiting.
+
+Each policy is a token bucket: `burst` requests at once, refilled at
+burst/period per second. Buckets are kept as GCRA state (one "theoretical
+arrival time" per key), which behaves exactly like a token bucket but is a
+single number, so a check is one conditional update.
+
+RATE_LIMIT_BACKEND picks where buckets live:
+
+- memory (default): per process. With N workers a client effectively gets
+  N times the limit, fine for a single worker or as a local stand-in.
+- mongo: `rate_limits` collection shared by every worker, documents expire
+  through a TTL index once their bucket is full again. A busy key costs one
+  round trip; a key that is over its limit is then refused locally until
+  it may retry.
+- off: no limits.
+
+Policies are "<burst>/<seconds>" strings, overridable per policy with
+RATE_LIMIT_<NAME> (e.g. RATE_LIMIT_COMMENTS=20/60). If MongoDB fails the
+request is let through.
+'''
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# name -> (default "<burst>/<seconds>", key): key is 'user' (falls back to IP) or 'ip'
+DEFAULT_POLICIES = {
+    'comments': ('20/60', 'user'),
+    'articles': ('120/60', 'ip'),
+}
+
+
+class Policy:
+    def __init__(self, name, spec, key):
+        burst, _, seconds = spec.partition('/')
+        self.name = name
+        self.burst = int(burst)
+        self.period = float(seconds)
+        self.key = key
+        # Seconds one request costs, and how far ahead of now a key may run
+        self.interval = self.period / self.burst
+        self.tolerance = self.interval * (self.burst - 1)
+
+
+class MemoryBuckets:
+    blocking = False
+
+    def __init__(self, clock=time.time, max_entries=100000):
+        self.clock = clock
+        self.max_entries = max_entries
+        self._tat = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, policy, key):
+        """(allowed, seconds until the next request would be allowed)"""
+        now = self.clock()
+        with self._lock:
+            tat = max(self._tat.get(key, now), now)
+            if tat - now > policy.tolerance:
+                return False, tat - policy.tolerance - now
+            self._tat[key] = tat + policy.interval
+            self._tat.move_to_end(key)
+            while len(self._tat) > self.max_entries:
+                self._tat.popitem(last=False)
+        return True, 0.0
+
+    def clear(self):
+        with self._lock:
+            self._tat.clear()
+
+
+class MongoBuckets:
+    blocking = True
+
+    def __init__(self, collection_getter, clock=time.time, max_denied=100000):
+        self.collection_getter = collection_getter
+        self.clock = clock
+        self.max_denied = max_denied
+        # key -> time it may retry, so refused clients stop costing round trips (oldest first)
+        self._denied = OrderedDict()
+        self._lock = threading.Lock()
+        self._indexed = False
+
+    @property
+    def collection(self):
+        collection = self.collection_getter()
+        if not self._indexed:
+            collection.create_index('expiresAt', expireAfterSeconds=0, name='expiresAt_ttl')
+            self._indexed = True
+        return collection
+
+    def hit(self, policy, key):
+        now = self.clock()
+        with self._lock:
+            retry_at = self._denied.get(key)
+            if retry_at is not None:
+                if retry_at > now:
+                    return False, retry_at - now
+                del self._denied[key]
+
+        collection = self.collection
+        # The bucket is full again (and the document useless) once tat has passed
+        expires = datetime.utcfromtimestamp(now + policy.tolerance + policy.interval)
+        # Busy key within its burst: move tat along
+        if collection.find_one_and_update(
+                {'_id': key, 'tat': {'$gt': now, '$lte': now + policy.tolerance}},
+                {'$inc': {'tat': policy.interval}, '$set': {'expiresAt': expires}}) is not None:
+            return True, 0.0
+        # Idle or new key: start again from now
+        try:
+            collection.update_one({'_id': key, 'tat': {'$lte': now}},
+                                  {'$set': {'tat': now + policy.interval, 'expiresAt': expires}}, upsert=True)
+            return True, 0.0
+        except DuplicateKeyError:
+            pass
+        doc = collection.find_one({'_id': key}, {'tat': 1})
+        if doc is None:
+            return True, 0.0
+        retry_at = doc['tat'] - policy.tolerance
+        if retry_at <= now:
+            # It drained between the two updates
+            return self.hit(policy, key)
+        with self._lock:
+            self._denied[key] = retry_at
+            self._denied.move_to_end(key)
+            # One-off clients never come back to clear their entry: drop expired ones from the old end
+            while self._denied and (len(self._denied) > self.max_denied or
+                                    next(iter(self._denied.values())) <= now):
+                self._denied.popitem(last=False)
+        return False, retry_at - now
+
+    def clear(self):
+        with self._lock:
+            self._denied.clear()
+        self.collection.delete_many({})
+
+
+class RateLimiter:
+    def __init__(self, buckets, policies):
+        self.buckets = buckets
+        self.policies = policies
+
+    def hit(self, name, key):
+        """(allowed, retry after seconds) for one request by key under policy name"""
+        policy = self.policies[name]
+        try:
+            return self.buckets.hit(policy, f'{name}:{key}')
+        except PyMongoError:
+            logger.exception("rate limit check failed, letting the request through")
+            return True, 0.0
+
+    def clear(self):
+        self.buckets.clear()
+
+
+def client_key(policy_key, user, remote_addr, forwarded_for=None, proxy_hops=0):
+    """user:<id> for logged-in users under 'user' policies, otherwise ip:<address>
+
+    With proxy_hops > 0 the client address is taken from X-Forwarded-For,
+    that many entries from the right (the ones our own proxies appended).
+    """
+    if policy_key == 'user' and user:
+        user_id = user.get('user_id')
+        return f"user:{user_id}" if user_id and user_id != 'unknown' else f"user:{user.get('username')}"
+    address = remote_addr
+    if proxy_hops and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+        if len(hops) >= proxy_hops:
+            address = hops[-proxy_hops]
+    return f"ip:{address}"
+
+
+def rate_limiter_from_env(db_getter, env=os.environ):
+    """Build the limiter named by RATE_LIMIT_BACKEND, or None when it is off"""
+    backend = env.get('RATE_LIMIT_BACKEND', 'memory')
+    if backend == 'memory':
+        buckets = MemoryBuckets()
+    elif backend == 'mongo':
+        buckets = MongoBuckets(lambda: db_getter().rate_limits)
+    elif backend == 'off':
+        return None
+    else:
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND {backend!r}")
+    policies = {name: Policy(name, env.get(f'RATE_LIMIT_{name.upper()}', spec), key)
+                for name, (spec, key) in DEFAULT_POLICIES.items()}
+    return RateLimiter(buckets, policies)
@@ -0,0 +1,159 @@
+'''
+Reply storage.
+
+Replies used to be $push-ed into their comment's `replies` array, so every
+reply rewrote a growing document and every read shipped the whole thread.
+They now live in their own `replies` collection, one document each:
+
+    {_id, comment_id, articleKey, articleTitle, ancestors, depth,
+     username, text, timestamp, [parent_reply_id], ...moderation fields}
+
+`ancestors` is the materialized path of parent reply ids (root first) and
+`depth` is 0 for a direct reply to the comment. The read helpers strip those
+internal fields so clients still get the old embedded reply shape, or the
+replies nested under their parents (nest_replies).
+'''
+
+import hashlib
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
+
+from articles import article_key
+
+# Internal fields that never leave the server
+INTERNAL_FIELDS = ('comment_id', 'articleKey', 'articleTitle', 'ancestors', 'depth')
+
+
+def new_reply(comment_id, article_title, username, text, parent=None):
+    """Build a reply document, parent is the parent reply document for nested replies"""
+    reply = {
+        '_id': ObjectId(),
+        'comment_id': comment_id,
+        'articleKey': article_key(article_title) if article_title else None,
+        'articleTitle': article_title,
+        'ancestors': [],
+        'depth': 0,
+        'username': username,
+        'text': text,
+        'timestamp': datetime.now().isoformat(),
+    }
+    if parent is not None:
+        reply['ancestors'] = parent.get('ancestors', []) + [parent['_id']]
+        reply['depth'] = parent.get('depth', 0) + 1
+        reply['parent_reply_id'] = str(parent['_id'])  # Reference to the parent reply
+    return reply
+
+
+def to_client(reply):
+    """Legacy embedded shape: no internal fields (ids are encoded as strings by serialization.py)"""
+    for field in INTERNAL_FIELDS:
+        reply.pop(field, None)
+    return reply
+
+
+def nest_replies(replies):
+    """One comment's replies (timestamp order, internal fields included) as client-shaped trees
+
+    Every reply gets a `replies` list of its children. Two passes over the
+    list, so the cost is linear in the number of replies however deep the
+    thread is. A reply whose parent is missing is shown at the top level.
+    """
+    nodes = {}
+    for reply in replies:
+        reply['replies'] = []
+        nodes[reply['_id']] = reply
+    roots = []
+    for reply in replies:
+        ancestors = reply.get('ancestors') or []
+        parent = nodes.get(ancestors[-1]) if ancestors else None
+        (roots if parent is None else parent['replies']).append(reply)
+    for reply in replies:
+        to_client(reply)
+    return roots
+
+
+def replies_by_comment(db, comment_ids):
+    """Map each comment id to its replies in timestamp order, fetched with one query"""
+    grouped = {comment_id: [] for comment_id in comment_ids}
+    if not comment_ids:
+        return grouped
+    cursor = db.replies.find({'comment_id': {'$in': list(comment_ids)}}).sort([('timestamp', 1), ('_id', 1)])
+    for reply in cursor:
+        grouped.setdefault(reply['comment_id'], []).append(reply)
+    return grouped
+
+
+def reply_counts(db, comment_ids):
+    """Map each comment id to its number of replies, from one aggregation"""
+    counts = {comment_id: 0 for comment_id in comment_ids}
+    if not comment_ids:
+        return counts
+    pipeline = [
+        {'$match': {'comment_id': {'$in': list(comment_ids)}}},
+        {'$group': {'_id': '$comment_id', 'count': {'$sum': 1}}}
+    ]
+    for row in db.replies.aggregate(pipeline):
+        counts[row['_id']] = row['count']
+    return counts
+
+
+def find_replies(db, comment_id, under=None, depth=None):
+    """Replies of one comment, optionally only those below reply `under` and/or at one depth"""
+    query = {'comment_id': comment_id}
+    if under is not None:
+        query['ancestors'] = under
+    if depth is not None:
+        query['depth'] = depth
+    projection = {field: 0 for field in INTERNAL_FIELDS}
+    return list(db.replies.find(query, projection).sort([('timestamp', 1), ('_id', 1)]))
+
+
+def _embedded_reply_id(comment_id, index):
+    """The same ObjectId for the same embedded reply on every run, dated like its comment"""
+    digest = hashlib.sha1(f"{comment_id}:{index}".encode()).digest()
+    prefix = comment_id.binary[:4] if isinstance(comment_id, ObjectId) else digest[8:12]
+    return ObjectId(prefix + digest[:8])
+
+
+def migrate_embedded_replies(db, batch_size=500):
+    """Move replies still embedded in comments into the replies collection
+
+    Safe to re-run: reply ids are kept, and replies without one get an id
+    derived from their comment and position, so documents copied by an
+    interrupted run are skipped as duplicates before the embedded array is
+    removed.
+    Returns the number of comments migrated.
+    """
+    migrated = 0
+    cursor = db.comments.find({'replies.0': {'$exists': True}},
+                              {'articleTitle': 1, 'replies': 1}).batch_size(batch_size)
+    for comment in cursor:
+        by_id = {str(reply['_id']): reply for reply in comment['replies'] if '_id' in reply}
+        docs = []
+        for index, reply in enumerate(comment['replies']):
+            if '_id' not in reply:
+                reply['_id'] = _embedded_reply_id(comment['_id'], index)
+            ancestors = []
+            parent_id = reply.get('parent_reply_id')
+            while parent_id is not None and parent_id in by_id and len(ancestors) < len(by_id):
+                ancestors.insert(0, by_id[parent_id]['_id'])
+                parent_id = by_id[parent_id].get('parent_reply_id')
+            doc = dict(reply)
+            doc.update({
+                'comment_id': comment['_id'],
+                'articleKey': article_key(comment['articleTitle']) if comment.get('articleTitle') else None,
+                'articleTitle': comment.get('articleTitle'),
+                'ancestors': ancestors,
+                'depth': len(ancestors),
+            })
+            docs.append(doc)
+        try:
+            db.replies.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if any(error['code'] != 11000 for error in e.details.get('writeErrors', [])):
+                raise
+        db.comments.update_one({'_id': comment['_id']}, {'$unset': {'replies': ''}})
+        migrated += 1
+    return migrated
@@ -0,0 +1,237 @@
+'''
+Comment and reply search.
+
+SEARCH_BACKEND picks the implementation behind GET /api/search:
+
+- mongo (default): the `text` indexes on comments and replies (see
+  indexes.py), ranked by MongoDB's textScore.
+- memory: an in-process inverted index for deployments without text
+  indexes. It is built from the database on first use and then kept up to
+  date from the comment events (events.py), one document at a time. Every
+  worker holds its own copy, so budget about 3.5 GB of RAM per million
+  comments (bench/search_bench.py). A worker only sees the others' writes
+  through the change stream, so with WEB_CONCURRENCY above 1 searches use
+  the text indexes until the stream is open, and always with
+  CHANGE_STREAMS=off (app.search_backend).
+
+Both return the same hits: {type, _id, [commentId], articleTitle, username,
+text, timestamp, score}, best match first. Removed comments and replies are
+never returned. The article filter takes a headline or an article key and
+matches on articleKey (articles.py), like the comment routes.
+'''
+
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from article_stats import VISIBLE
+from articles import article_key, to_article_key
+
+TOKEN = re.compile(r"[^\W_]+")
+# Words too common to rank anything
+STOP_WORDS = frozenset('a an and are as at be but by for from has have i in is it of on or so that the this to was'
+                       ' were with you'.split())
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall((text or '').lower()) if token not in STOP_WORDS]
+
+
+def _filters(username=None, article=None, since=None, until=None):
+    query = dict(VISIBLE)
+    if username:
+        query['username'] = username
+    if article:
+        query['articleKey'] = to_article_key(article)
+    if since or until:
+        query['timestamp'] = {}
+        if since:
+            query['timestamp']['$gte'] = since
+        if until:
+            query['timestamp']['$lt'] = until
+    return query
+
+
+def _hit(kind, doc, score):
+    hit = {
+        'type': kind,
+        '_id': str(doc['_id']),
+        'articleTitle': doc.get('articleTitle'),
+        'username': doc.get('username'),
+        'text': doc.get('text'),
+        'timestamp': doc.get('timestamp'),
+        'score': round(score, 4),
+    }
+    if kind == 'reply':
+        hit['commentId'] = str(doc.get('comment_id'))
+    return hit
+
+
+class MongoTextSearch:
+    """Search through the text indexes, one ranked query per collection"""
+
+    def __init__(self, db_getter):
+        self.db_getter = db_getter
+
+    def search(self, text, offset=0, limit=20, **filters):
+        db = self.db_getter()
+        query = dict(_filters(**filters), **{'$text': {'$search': text}})
+        projection = {'score': {'$meta': 'textScore'}, 'ancestors': 0, 'depth': 0}
+        # Each collection has to supply up to offset + limit hits for the merged page
+        hits = []
+        for kind, collection in (('comment', db.comments), ('reply', db.replies)):
+            cursor = collection.find(query, projection).sort([('score', {'$meta': 'textScore'})])
+            hits.extend(_hit(kind, doc, doc['score']) for doc in cursor.limit(offset + limit + 1))
+        hits.sort(key=lambda hit: hit['score'], reverse=True)
+        return hits[offset:offset + limit], len(hits) > offset + limit
+
+
+class InvertedIndex:
+    """In-process TF-IDF index over comment and reply text"""
+
+    def __init__(self, db_getter=None):
+        self.db_getter = db_getter
+        # Postings are keyed by small internal ids to keep the per-entry cost down
+        self._postings = defaultdict(dict)  # term -> {doc number: term frequency}
+        self._docs = {}                     # doc number -> (kind, metadata, terms)
+        self._numbers = {}                  # (kind, _id) -> doc number
+        self._by_username = defaultdict(set)
+        self._by_article = defaultdict(set)
+        self._next_number = 0
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        # Without a database it is filled through add() only (benchmarks, tests)
+        self._ready = db_getter is None
+        self._pending = None
+
+    def add(self, kind, doc):
+        """Index (or re-index) one comment or reply"""
+        key = (kind, str(doc['_id']))
+        with self._lock:
+            self._remove(key)
+            if 'removed_at' in doc:
+                return
+            terms = Counter(tokenize(doc.get('text')))
+            meta = {field: doc[field] for field in ('_id', 'articleTitle', 'username', 'text', 'timestamp',
+                                                    'comment_id') if doc.get(field) is not None}
+            if 'articleTitle' in meta:
+                # Reply events carry the headline only, so the key is derived here
+                meta['articleKey'] = doc.get('articleKey') or article_key(meta['articleTitle'])
+            number = self._next_number
+            self._next_number += 1
+            self._numbers[key] = number
+            self._docs[number] = (kind, meta, tuple(terms))
+            self._by_username[meta.get('username')].add(number)
+            self._by_article[meta.get('articleKey')].add(number)
+            for term, count in terms.items():
+                self._postings[term][number] = count
+
+    def _remove(self, key):
+        number = self._numbers.pop(key, None)
+        if number is None:
+            return
+        _, meta, terms = self._docs.pop(number)
+        for field, numbers_by in (('username', self._by_username), ('articleKey', self._by_article)):
+            numbers = numbers_by.get(meta.get(field))
+            if numbers is not None:
+                numbers.discard(number)
+                if not numbers:
+                    del numbers_by[meta.get(field)]
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(number, None)
+                if not postings:
+                    del self._postings[term]
+
+    def update(self, kind, doc_id, fields):
+        """Apply changed fields of an indexed document (edits, redactions, removals)"""
+        with self._lock:
+            number = self._numbers.get((kind, str(doc_id)))
+            if number is None:
+                return
+            doc = dict(self._docs[number][1], **fields)
+            self.add(kind, doc)
+
+    def apply_event(self, article_title, event):
+        """Broker listener, see events.py"""
+        with self._lock:
+            if not self._ready:
+                if self._pending is not None:
+                    self._pending.append((article_title, event))
+                return
+            if event['type'] == 'comment':
+                self.add('comment', event['comment'])
+            elif event['type'] == 'reply':
+                reply = dict(event['reply'], articleTitle=article_title, comment_id=event['commentId'])
+                self.add('reply', reply)
+            elif event['type'] == 'update':
+                self.update(event['target'], event['id'], event['fields'])
+
+    def build(self, batch_size=1000):
+        """Load every visible comment and reply, events seen meanwhile are replayed afterwards"""
+        # Searches arriving meanwhile wait here instead of seeing a half-built index
+        with self._build_lock:
+            if self._ready:
+                return
+            with self._lock:
+                self._pending = []
+            db = self.db_getter()
+            projection = {'articleKey': 1, 'articleTitle': 1, 'username': 1, 'text': 1, 'timestamp': 1,
+                          'comment_id': 1}
+            fresh = InvertedIndex()
+            for kind, collection in (('comment', db.comments), ('reply', db.replies)):
+                for doc in collection.find(VISIBLE, projection).batch_size(batch_size):
+                    fresh.add(kind, doc)
+            with self._lock:
+                self._postings, self._docs, self._numbers = fresh._postings, fresh._docs, fresh._numbers
+                self._by_username, self._by_article = fresh._by_username, fresh._by_article
+                self._next_number = fresh._next_number
+                self._ready = True
+                pending, self._pending = self._pending, None
+                for article_title, event in pending:
+                    self.apply_event(article_title, event)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def search(self, text, offset=0, limit=20, username=None, article=None, since=None, until=None):
+        if not self._ready and self.db_getter is not None:
+            self.build()
+        terms = set(tokenize(text))
+        if article:
+            article = to_article_key(article)
+        with self._lock:
+            total = len(self._docs) or 1
+            weights = {term: math.log(1 + total / len(self._postings[term]))
+                       for term in terms if term in self._postings}
+            # A user or article filter usually leaves far fewer documents than a common term matches
+            subsets = [numbers_by.get(value, set()) for value, numbers_by in
+                       ((username, self._by_username), (article, self._by_article)) if value]
+            scores = defaultdict(float)
+            if subsets:
+                for number in min(subsets, key=len):
+                    for term, idf in weights.items():
+                        count = self._postings[term].get(number)
+                        if count:
+                            scores[number] += (1 + math.log(count)) * idf
+            else:
+                for term, idf in weights.items():
+                    for number, count in self._postings[term].items():
+                        scores[number] += (1 + math.log(count)) * idf
+
+            if username or article or since or until:
+                def wanted(number):
+                    meta = self._docs[number][1]
+                    timestamp = meta.get('timestamp') or ''
+                    return ((not username or meta.get('username') == username) and
+                            (not article or meta.get('articleKey') == article) and
+                            (not since or timestamp >= since) and (not until or timestamp < until))
+                candidates = ((number, score) for number, score in scores.items() if wanted(number))
+            else:
+                candidates = scores.items()
+            ranked = heapq.nlargest(offset + limit + 1, candidates, key=lambda item: item[1])
+            hits = [_hit(self._docs[number][0], self._docs[number][1], score) for number, score in ranked]
+        return hits[offset:offset + limit], len(hits) > offset + limit
@@ -0,0 +1,85 @@
+'''
+JSON encoding for API responses.
+
+Documents are encoded as the driver returns them: ObjectId becomes its hex
+string and datetime its ISO 8601 form inside the encoder, so handlers no
+longer walk every comment and reply to convert ids first. Keys keep the
+order MongoDB returned them in instead of being sorted.
+
+JSON_BACKEND picks the encoder:
+
+- auto (default): orjson when it is installed, else the standard library.
+- orjson: fail at startup if it is missing.
+- json: the standard library.
+
+Both produce compact UTF-8 and the same values. MongoJSONProvider puts this
+behind Flask's jsonify; to_json() is for streamed exports and the ASGI app.
+
+Raw BSON is still decoded to dicts first. Going straight from BSON bytes
+to JSON needs a converter such as python-bsonjs, which emits Extended JSON
+({"$oid": ...}) rather than the API's plain id strings.
+'''
+
+import json
+import os
+from datetime import date, datetime
+
+from bson.objectid import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def backend_from_env():
+    backend = os.getenv('JSON_BACKEND', 'auto')
+    if backend == 'auto':
+        return 'orjson' if orjson is not None else 'json'
+    if backend == 'orjson' and orjson is None:
+        raise RuntimeError("JSON_BACKEND=orjson but the orjson package is not installed")
+    if backend not in ('orjson', 'json'):
+        raise ValueError(f"Unknown JSON_BACKEND {backend!r}")
+    return backend
+
+
+BACKEND = backend_from_env()
+_encode = _orjson_dumps if BACKEND == 'orjson' else _stdlib_dumps
+
+
+def to_json(obj):
+    """obj (ObjectId and datetime included) as compact UTF-8 JSON bytes"""
+    return _encode(obj)
+
+
+class MongoJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider on to_json, jsonify() accepts MongoDB documents as they are"""
+
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            kwargs.setdefault('default', _default)
+            return super().dumps(obj, **kwargs)
+        return to_json(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(to_json(obj), mimetype=self.mimetype)
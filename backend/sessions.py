@@ -0,0 +1,243 @@
+'''
+Server-side sessions.
+
+With SESSION_BACKEND set to memory, mongo or file the cookie only carries a
+signed random session id and the session data lives on the server:
+
+- memory: per-process LRU with a TTL (single worker / dev only)
+- mongo:  `sessions` collection with a TTL index, shared by every worker
+- file:   one JSON file per session in SESSION_FILE_DIR
+
+The default, cookie, keeps Flask's signed cookie sessions.
+
+The id changes whenever the session's user does (login, logout), and the
+old entry is deleted, so a session id fixed before login cannot be used to
+ride on it.
+
+Flask opens the session on every request, so the store is only read once a
+handler actually looks at the session: static files, health checks and 304
+revalidations carry the cookie but never reach the store.
+'''
+
+import functools
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+
+def _loading(name):
+    method = getattr(CallbackDict, name)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._load()
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session data, read from the store through loader on first access"""
+
+    def __init__(self, initial=None, sid=None, new=False, loader=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.loaded_user = None
+        self._loader = loader
+
+    @property
+    def loaded(self):
+        return self._loader is None
+
+    def _load(self):
+        loader, self._loader = self._loader, None
+        if loader is None:
+            return
+        data = loader()
+        if data is None:
+            # Expired or unknown id, start over under a new one
+            self.sid = secrets.token_urlsafe(32)
+            self.new = True
+        else:
+            dict.update(self, data)
+            self.loaded_user = data.get('user')
+
+
+# Every read or write of the session loads it first
+for _name in ('__getitem__', '__setitem__', '__delitem__', '__contains__', '__iter__', '__len__',
+              '__eq__', '__repr__', 'get', 'keys', 'values', 'items', 'copy',
+              'setdefault', 'pop', 'popitem', 'update', 'clear'):
+    setattr(ServerSideSession, _name, _loading(_name))
+
+
+class MemoryStore:
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            item = self._data.get(sid)
+            if item is None:
+                return None
+            data, expires = item
+            if expires < time.time():
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return data
+
+    def save(self, sid, data, ttl):
+        with self._lock:
+            self._data[sid] = (data, time.time() + ttl)
+            self._data.move_to_end(sid)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+
+class MongoStore:
+    def __init__(self, collection_getter):
+        # A getter so the collection resolves to the current process's client
+        self.collection_getter = collection_getter
+        self._indexed = False
+
+    @property
+    def collection(self):
+        collection = self.collection_getter()
+        if not self._indexed:
+            # Mongo removes expired sessions by itself
+            collection.create_index('expiresAt', expireAfterSeconds=0, name='expiresAt_ttl')
+            self._indexed = True
+        return collection
+
+    def load(self, sid):
+        doc = self.collection.find_one({'_id': sid, 'expiresAt': {'$gt': datetime.utcnow()}})
+        return doc['data'] if doc else None
+
+    def save(self, sid, data, ttl):
+        self.collection.update_one(
+            {'_id': sid},
+            {'$set': {'data': data, 'expiresAt': datetime.utcnow() + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+
+    def delete(self, sid):
+        self.collection.delete_one({'_id': sid})
+
+
+class FileStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, f"{sid}.json")
+
+    def load(self, sid):
+        try:
+            with open(self._path(sid)) as f:
+                item = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if item['expires'] < time.time():
+            self.delete(sid)
+            return None
+        return item['data']
+
+    def save(self, sid, data, ttl):
+        # Write then rename so readers never see a half-written file
+        tmp = f"{self._path(sid)}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'data': data, 'expires': time.time() + ttl}, f)
+        os.replace(tmp, self._path(sid))
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except OSError:
+            pass
+
+
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, store, ttl=7 * 24 * 3600):
+        self.store = store
+        self.ttl = ttl
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='server-side-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid:
+                return ServerSideSession(sid=sid, loader=functools.partial(self.store.load, sid))
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        if not session.loaded:
+            return  # never looked at, so nothing changed
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # Only touch the store when something changed
+        if not session.modified:
+            return
+        if not session.new and session.get('user') != session.loaded_user:
+            # Logged in or out: move to a new id, so an id planted before login is worthless after it
+            self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+        self.store.save(session.sid, dict(session), self.ttl)
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode(),
+            max_age=self.ttl,
+            httponly=self.get_cookie_httponly(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            domain=domain,
+            path=path,
+        )
+
+
+def session_interface_from_env(db_getter, env=os.environ):
+    """Build the interface named by SESSION_BACKEND, or None to keep cookie sessions"""
+    backend = env.get('SESSION_BACKEND', 'cookie')
+    ttl = int(env.get('SESSION_TTL', str(7 * 24 * 3600)))
+    if backend == 'memory':
+        store = MemoryStore(int(env.get('SESSION_MAX_ENTRIES', '10000')))
+    elif backend == 'mongo':
+        store = MongoStore(lambda: db_getter().sessions)
+    elif backend == 'file':
+        store = FileStore(env.get('SESSION_FILE_DIR', '/tmp/nyt_sessions'))
+    elif backend == 'cookie':
+        return None
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND {backend!r}")
+    return ServerSideSessionInterface(store, ttl)
@@ -11,18 +11,56 @@ import sys
 # since we have modified directory structure (tests folder)
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app import app as flask_app
+import app as app_module
 
 @pytest.fixture
 def app():
     """Create and configure a Flask app for testing."""
     os.environ['NYT_API_KEY'] = 'test_api_key'
-    flask_app.config.update({
+    # No background NYT or MongoDB traffic from the article prefetcher
+    os.environ['NYT_PREFETCH'] = 'off'
+    flask_app = app_module.create_app({
         "TESTING": True,
     })
+    app_module.nyt_cache.clear()
+    app_module.thread_snapshots.clear()
+    if app_module.activity_buffer is not None:
+        app_module.activity_buffer.clear()
+    if app_module.rate_limiter is not None:
+        app_module.rate_limiter.clear()
     
     yield flask_app
+    # Activity tallied against a mock database must not be flushed to a real one later
+    if app_module.activity_buffer is not None:
+        app_module.activity_buffer.clear()
 
 @pytest.fixture
 def client(app):
-    return app.test_client()
\ No newline at end of file
+    return app.test_client()
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    """Swap the app's MongoDB handle for an in-memory mongomock database."""
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient().nyt_comments_db
+    monkeypatch.setattr(app_module, 'db', db)
+    monkeypatch.setattr(app_module, 'get_mongo_client', lambda: db.client)
+    # mongomock has no change streams, write handlers publish events locally
+    monkeypatch.setenv('CHANGE_STREAMS', 'off')
+    monkeypatch.setattr(app_module, 'CHANGE_STREAMS', False)
+    if app_module.article_versions is not None:  # built by create_app, tests without an app have none
+        app_module.article_versions.clear()
+    return db
+
+@pytest.fixture
+def login(client):
+    """Put a user (or the moderator) into the test client's session."""
+    def _login(moderator=False, username=None):
+        with client.session_transaction() as sess:
+            sess['user'] = {
+                'username': username or ('mod' if moderator else 'alice'),
+                'email': 'moderator@hw3.com' if moderator else 'alice@example.com',
+                'user_id': '123',
+                'is_moderator': moderator
+            }
+    return _login
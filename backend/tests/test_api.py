@@ -1,20 +1,17 @@
 import json
-import pytest
-import os
 import unittest.mock
 
-def test_get_api_key_success(client):
-    """Test that the /api/key endpoint returns the API key successfully."""
+from articles import article_key
+
+def test_api_key_not_exposed(client):
+    """Test that the NYT API key is no longer handed out, /api/articles proxies NYT instead."""
     response = client.get('/api/key')
-    assert response.status_code == 200
-    
-    data = json.loads(response.data)
-    assert 'key' in data  # Changed from 'apiKey' to 'key'
-    assert data['key'] == 'test_api_key'  # Changed from data['apiKey'] to data['key']
+    assert response.status_code == 404
+    assert b'test_api_key' not in response.data
 
 def test_content_type_json(client):
     """Test that the response content type is application/json."""
-    response = client.get('/api/key')
+    response = client.get('/api/me')
     assert response.content_type == 'application/json'
 
 def test_get_articles_success(client, monkeypatch):
@@ -22,7 +19,7 @@ def test_get_articles_success(client, monkeypatch):
     # Mock the requests.get function
     mock_response = unittest.mock.Mock()
     mock_response.status_code = 200
-    mock_response.json.return_value = {
+    mock_response.content = json.dumps({
         "response": {
             "docs": [
                 {
@@ -33,9 +30,10 @@ def test_get_articles_success(client, monkeypatch):
                 }
             ]
         }
-    }
+    }).encode()
     
-    with unittest.mock.patch('requests.get', return_value=mock_response):
+    # The proxy reuses a pooled requests.Session instead of calling requests.get
+    with unittest.mock.patch('requests.Session.get', return_value=mock_response):
         response = client.get('/api/articles?q=test&page=0')
         assert response.status_code == 200
         
@@ -51,9 +49,114 @@ def test_get_articles_nyt_api_error(client, monkeypatch):
     mock_response = unittest.mock.Mock()
     mock_response.status_code = 500
     
-    with unittest.mock.patch('requests.get', return_value=mock_response):
+    with unittest.mock.patch('requests.Session.get', return_value=mock_response):
         response = client.get('/api/articles')
         assert response.status_code == 500
         
         data = json.loads(response.data)
-        assert 'error' in data
\ No newline at end of file
+        assert 'error' in data
+
+def test_get_comment_counts_bulk(client, mock_db):
+    """Test that /api/comment-counts returns every count from stats and the comments fallback."""
+    mock_db.article_stats.insert_one({'articleKey': article_key('Tracked'), 'articleTitle': 'Tracked', 'commentCount': 7})
+    mock_db.comments.insert_many([
+        {'articleKey': article_key('Untracked'), 'articleTitle': 'Untracked', 'text': 'a'},
+        {'articleKey': article_key('Untracked'), 'articleTitle': 'Untracked', 'text': 'b'},
+    ])
+
+    response = client.post('/api/comment-counts', json={'titles': ['Tracked', 'Untracked', 'Empty', 'Tracked']})
+    assert response.status_code == 200
+
+    data = json.loads(response.data)
+    assert data['counts'] == {'Tracked': 7, 'Untracked': 2, 'Empty': 0}
+
+def test_get_comment_counts_invalid(client, mock_db):
+    """Test that /api/comment-counts rejects a body without a list of titles."""
+    response = client.post('/api/comment-counts', json={'titles': 'Tracked'})
+    assert response.status_code == 400
+
+def _seed_comments(db, count):
+    import reply_store
+    ids = []
+    for i in range(count):
+        comment_id = db.comments.insert_one({
+            'articleKey': article_key('Paged'),
+            'articleTitle': 'Paged',
+            'username': f'user{i}',
+            'text': f'comment {i}',
+            'timestamp': f'2025-05-01T10:00:{i:02d}'
+        }).inserted_id
+        for _ in range(i % 3):
+            db.replies.insert_one(reply_store.new_reply(comment_id, 'Paged', 'replier', 'reply'))
+        ids.append(comment_id)
+    return ids
+
+def test_get_comments_keyset_pagination(client, mock_db):
+    """Test that ?limit pages through comments in timestamp order with an opaque cursor."""
+    _seed_comments(mock_db, 5)
+
+    response = client.get('/api/comments/Paged?limit=2')
+    assert response.status_code == 200
+    page = json.loads(response.data)
+    assert [c['text'] for c in page['comments']] == ['comment 0', 'comment 1']
+    assert page['next_cursor']
+
+    seen = [c['text'] for c in page['comments']]
+    while page['next_cursor']:
+        page = json.loads(client.get(f"/api/comments/Paged?limit=2&cursor={page['next_cursor']}").data)
+        seen += [c['text'] for c in page['comments']]
+    assert seen == [f'comment {i}' for i in range(5)]
+
+def test_get_comments_reply_counts_and_lazy_replies(client, mock_db):
+    """Test that ?replies=count drops reply arrays and replies can be fetched per comment."""
+    ids = _seed_comments(mock_db, 3)
+
+    page = json.loads(client.get('/api/comments/Paged?limit=10&replies=count').data)
+    assert [c['replyCount'] for c in page['comments']] == [0, 1, 2]
+    assert all('replies' not in c for c in page['comments'])
+    assert page['next_cursor'] is None
+
+    replies = json.loads(client.get(f'/api/comments/{ids[2]}/replies').data)
+    assert len(replies) == 2
+    assert isinstance(replies[0]['_id'], str)
+
+def test_get_comments_unpaginated_shape(client, mock_db):
+    """Test that the plain request still returns a list with replies embedded."""
+    _seed_comments(mock_db, 2)
+    data = json.loads(client.get('/api/comments/Paged').data)
+    assert isinstance(data, list)
+    assert len(data) == 2
+    assert 'replies' in data[0]
+
+def test_get_comments_invalid_cursor(client, mock_db):
+    """Test that a malformed cursor is rejected."""
+    response = client.get('/api/comments/Paged?limit=2&cursor=not-a-cursor')
+    assert response.status_code == 400
+
+def test_get_all_comments_streams_json_array(client, mock_db, monkeypatch):
+    """Test that the default export is a valid JSON array even across several chunks."""
+    import app as app_module
+    monkeypatch.setattr(app_module, 'EXPORT_BATCH_SIZE', 2)
+    _seed_comments(mock_db, 5)
+
+    response = client.get('/api/all-comments')
+    assert response.status_code == 200
+    assert response.is_streamed
+    data = json.loads(response.data)
+    assert len(data) == 5
+    assert all(isinstance(c['_id'], str) for c in data)
+
+def test_get_all_comments_ndjson_filters(client, mock_db):
+    """Test NDJSON output with the article and since filters."""
+    _seed_comments(mock_db, 5)
+    mock_db.comments.insert_one({'articleKey': article_key('Other'), 'articleTitle': 'Other', 'text': 'x',
+                                 'timestamp': '2025-05-01T10:00:09'})
+
+    response = client.get('/api/all-comments?format=ndjson&article=Paged&since=2025-05-01T10:00:02')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.data.decode().splitlines()
+    assert [json.loads(line)['text'] for line in lines] == ['comment 3', 'comment 4']
+
+def test_get_all_comments_empty(client, mock_db):
+    """Test that an empty collection exports as an empty array."""
+    assert json.loads(client.get('/api/all-comments').data) == []
@@ -0,0 +1,38 @@
+import json
+
+from article_stats import rebuild_article_stats
+import reply_store
+
+
+def _count(db, title):
+    return db.article_stats.find_one({'articleTitle': title})['commentCount']
+
+def test_counts_follow_writes_and_removals(client, mock_db, login):
+    """Test that comments and replies increment the count and moderator removals decrement it once."""
+    login()
+    comment_id = json.loads(client.post('/api/comments', json={'articleTitle': 'Counted', 'text': 'hi'}).data)['id']
+    reply_id = json.loads(client.post(f'/api/comments/{comment_id}/replies', json={'text': 'yo'}).data)['id']
+    assert _count(mock_db, 'Counted') == 2
+
+    login(moderator=True)
+    assert client.delete(f'/api/comments/{comment_id}/replies/{reply_id}').status_code == 200
+    assert client.delete(f'/api/comments/{comment_id}/replies/{reply_id}').status_code == 200
+    assert _count(mock_db, 'Counted') == 1
+
+    assert client.delete(f'/api/comments/{comment_id}').status_code == 200
+    assert client.delete(f'/api/comments/{comment_id}').status_code == 200
+    assert _count(mock_db, 'Counted') == 0
+
+def test_rebuild_article_stats(mock_db):
+    """Test that the reconciliation job recomputes drifted counters from comments and replies."""
+    comment_id = mock_db.comments.insert_one({'articleTitle': 'A', 'text': 'x'}).inserted_id
+    mock_db.comments.insert_one({'articleTitle': 'A', 'text': 'gone', 'removed_at': 'now'})
+    mock_db.replies.insert_one(reply_store.new_reply(comment_id, 'A', 'bob', 'reply'))
+    mock_db.article_stats.insert_many([
+        {'articleTitle': 'A', 'commentCount': 40},
+        {'articleTitle': 'Emptied', 'commentCount': 3},
+    ])
+
+    assert rebuild_article_stats(mock_db) == 1
+    assert _count(mock_db, 'A') == 2
+    assert _count(mock_db, 'Emptied') == 0
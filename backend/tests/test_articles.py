@@ -0,0 +1,44 @@
+import json
+
+from articles import article_key, backfill_article_keys, is_article_key, to_article_key
+
+
+def test_article_key_is_fixed_width_and_normalized():
+    """Test that keys are short, stable and ignore spacing and Unicode composition differences."""
+    key = article_key('Davis Votes on Housing')
+    assert is_article_key(key) and len(key) == 19
+    assert article_key('  Davis  Votes on\tHousing ') == key
+    assert article_key('Cafe\u0301 Opens') == article_key('Caf\u00e9 Opens')
+    assert article_key('Davis Votes on Transit') != key
+    assert to_article_key(key) == key
+    assert to_article_key('Davis Votes on Housing') == key
+    assert not is_article_key('ak_not-hex')
+
+def test_backfill_article_keys(mock_db):
+    """Test that documents from before article keys get one, once."""
+    comment_id = mock_db.comments.insert_one({'articleTitle': 'Legacy', 'text': 'x'}).inserted_id
+    mock_db.replies.insert_one({'comment_id': comment_id, 'articleTitle': 'Legacy', 'text': 'y'})
+    mock_db.article_stats.insert_one({'articleTitle': 'Legacy', 'commentCount': 2})
+    mock_db.comments.insert_one({'text': 'no article'})
+
+    assert backfill_article_keys(mock_db, batch_size=1) == {
+        'comments': 1, 'replies': 1, 'article_stats': 1, 'article_activity': 0}
+    assert backfill_article_keys(mock_db)['comments'] == 0
+    key = article_key('Legacy')
+    assert mock_db.comments.find_one({'_id': comment_id})['articleKey'] == key
+    assert mock_db.article_stats.find_one({'articleKey': key})['commentCount'] == 2
+
+def test_routes_accept_title_or_key(client, mock_db, login):
+    """Test that comment reads find the same article by headline or article key."""
+    login()
+    client.post('/api/comments', json={'articleTitle': 'Keyed Article', 'text': 'hi'})
+    key = article_key('Keyed Article')
+    assert mock_db.comments.find_one()['articleKey'] == key
+    assert mock_db.article_stats.find_one({'articleKey': key})['articleTitle'] == 'Keyed Article'
+
+    by_title = json.loads(client.get('/api/comments/Keyed Article').data)
+    by_key = json.loads(client.get(f'/api/comments/{key}').data)
+    assert by_title == by_key and [c['text'] for c in by_key] == ['hi']
+    assert json.loads(client.get(f'/api/comment-count/{key}').data) == {'count': 1}
+    counts = json.loads(client.post('/api/comment-counts', json={'titles': ['Keyed Article', key]}).data)
+    assert counts['counts'] == {'Keyed Article': 1, key: 1}
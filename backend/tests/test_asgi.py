@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip('starlette')
+pytest.importorskip('motor')
+httpx = pytest.importorskip('httpx')
+
+from test_nyt_cache import StubNYT
+
+
+@pytest.fixture
+def stub():
+    server = StubNYT()
+    yield server
+    server.close()
+
+
+def _get(asgi_app, path):
+    async def go():
+        transport = httpx.ASGITransport(app=asgi_app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.get(path)
+    return asyncio.run(go())
+
+
+def test_async_articles_cached(stub, monkeypatch):
+    """Test that the async /api/articles proxies NYT through the async cache."""
+    monkeypatch.setenv('NYT_API_KEY', 'test_api_key')
+    monkeypatch.setenv('NYT_PREFETCH', 'off')
+    import asgi
+    monkeypatch.setattr(asgi.nyt_cache, 'base_url', stub.url)
+    asgi.nyt_cache.clear()
+    asgi.nyt_cache._client = None  # each asyncio.run() gets a fresh loop
+
+    first = _get(asgi.app, '/api/articles?q=test&page=0')
+    assert first.status_code == 200
+    assert json.loads(first.content)['response']['docs']
+    assert first.headers['X-Cache'] == 'MISS'
+
+    asgi.nyt_cache._client = None
+    second = _get(asgi.app, '/api/articles?q=test&page=0')
+    assert second.headers['X-Cache'] == 'HIT'
+    assert stub.hits == 1
+
+def test_async_routes_recorded_in_metrics(stub, monkeypatch):
+    """Test that native routes show up in http_request_duration_seconds once, like the Flask ones."""
+    monkeypatch.setenv('NYT_API_KEY', 'test_api_key')
+    monkeypatch.setenv('NYT_PREFETCH', 'off')
+    import asgi
+    monkeypatch.setattr(asgi.nyt_cache, 'base_url', stub.url)
+    asgi.nyt_cache._client = None
+
+    def count(route):
+        sample = f'http_request_duration_seconds_count{{method="GET",route="{route}",status="200"}} '
+        for line in _get(asgi.app, '/metrics').text.splitlines():
+            if line.startswith(sample):
+                return float(line[len(sample):])
+        return 0.0
+
+    articles, user = count('/api/articles'), count('/api/user')
+    assert _get(asgi.app, '/api/articles?q=metered&page=0').status_code == 200
+    assert _get(asgi.app, '/api/user').status_code == 200
+    assert count('/api/articles') == articles + 1
+    assert count('/api/user') == user + 1
+
+def test_async_falls_back_to_flask_routes():
+    """Test that routes without an async twin are served by the Flask app."""
+    import asgi
+    response = _get(asgi.app, '/api/user')
+    assert response.status_code == 200
+    assert json.loads(response.content) == {"username": None, "is_moderator": False}
+
+def test_async_event_stream(client, mock_db, login):
+    """Test that the SSE endpoint streams a new comment and unsubscribes when the client goes away."""
+    import asgi
+    from events import broker
+
+    async def go():
+        sent, gone = asyncio.Queue(), asyncio.Event()
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/comments/Streamed/events', 'raw_path': b'',
+                 'query_string': b'', 'headers': [], 'http_version': '1.1', 'scheme': 'http',
+                 'server': ('test', 80), 'client': ('127.0.0.1', 1), 'root_path': ''}
+
+        async def receive():
+            await gone.wait()
+            return {'type': 'http.disconnect'}
+
+        served = asyncio.create_task(asgi.app(scope, receive, sent.put))
+        start = await asyncio.wait_for(sent.get(), 5)
+        assert start['status'] == 200 and (b'content-type', b'text/event-stream; charset=utf-8') in start['headers']
+        assert (await asyncio.wait_for(sent.get(), 5))['body'].startswith(b'retry:')
+        # mongomock has no change streams, so the client must keep refetching after its writes
+        hello = (await asyncio.wait_for(sent.get(), 5))['body']
+        assert hello == b'event: hello\ndata: {"changeStream": false}\n\n'
+
+        login()
+        client.post('/api/comments', json={'articleTitle': 'Streamed', 'text': 'live'})
+        frame = (await asyncio.wait_for(sent.get(), 5))['body'].decode()
+        event = json.loads(frame[len('data: '):])
+        assert event['type'] == 'comment' and event['comment']['text'] == 'live'
+
+        gone.set()
+        await asyncio.wait_for(served, 5)
+
+    asyncio.run(go())
+    assert broker.subscriber_count('Streamed') == 0
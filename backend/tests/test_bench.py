@@ -0,0 +1,48 @@
+import copy
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'bench')))
+
+import thread_encoding  # noqa: E402
+import startup  # noqa: E402
+import suite  # noqa: E402
+
+
+def test_suite_smoke(monkeypatch):
+    """Test that every workload runs against mongomock and the stub NYT server without errors."""
+    monkeypatch.setenv('NYT_PREFETCH', 'off')
+    monkeypatch.setenv('CHANGE_STREAMS', 'off')
+    results = suite.run(articles=10, comments=200, iterations=5)
+    assert set(results) == set(suite.WORKLOADS)
+    for report in results.values():
+        assert report['total']['requests'] > 0 and report['total']['errors'] == 0
+    assert 'GET /api/comments/<title>' in results['browse']
+
+def test_compare_flags_regressions():
+    """Test that a slower endpoint p50 and lower workload throughput are reported, p99 noise is not."""
+    base = {'browse': {'GET /x': {'p50_ms': 10.0, 'p99_ms': 20.0, 'rps': 100.0},
+                       'total': {'p50_ms': 10.0, 'p99_ms': 20.0, 'rps': 100.0}}}
+    def run(p50, p99, rps):
+        return {'browse': {'GET /x': {'p50_ms': p50, 'p99_ms': p99, 'rps': rps},
+                           'total': {'p50_ms': p50, 'p99_ms': p99, 'rps': rps}}}
+    assert suite.compare(base, run(12.0, 80.0, 90.0), 0.3) == []
+    regressions = suite.compare(base, run(14.0, 40.0, 70.0), 0.3)
+    assert [line.split(': ')[0] + ' ' + line.split(': ')[1].split()[0] for line in regressions] == \
+        ['browse GET /x p50_ms', 'browse total rps']
+    # Twice as slow a machine: the same slowdown is expected, not a regression
+    assert suite.compare(base, run(24.0, 60.0, 45.0), 0.3, 2.0) == []
+
+def test_serialization_bench_encoders_agree():
+    """Test that every encoder in the micro-benchmark produces the same JSON for a thread."""
+    thread = thread_encoding.build_thread(20, 5)
+    bodies = {name: json.loads(encode(copy.deepcopy(thread))) for name, encode in thread_encoding.encoders().items()}
+    assert all(body == bodies['legacy'] for body in bodies.values())
+    assert bodies['legacy'][0]['_id'] and len(bodies['legacy'][0]['replies']) == 5
+    assert set(thread_encoding.run(comments=20, replies=5, repeat=1)) == set(bodies)
+
+def test_startup_bench_smoke():
+    """Test that the startup benchmark times every phase in a fresh interpreter."""
+    results = startup.run(runs=1)
+    assert set(results) == set(startup.PHASES) and all(ms > 0 for ms in results.values())
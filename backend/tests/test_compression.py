@@ -0,0 +1,83 @@
+import asyncio
+import gzip
+import json
+
+from articles import article_key
+import compression
+from compression import CompressionMiddleware, choose_encoding
+
+
+def _thread(mock_db, title, comments=40):
+    mock_db.comments.insert_many([
+        {'articleKey': article_key(title), 'articleTitle': title, 'username': 'alice', 'text': f'comment number {i} ' * 5,
+         'timestamp': f'2025-05-01T10:00:{i:02d}'}
+        for i in range(comments)
+    ])
+
+def test_choose_encoding(monkeypatch):
+    """Test that q-values and wildcards pick the coding, gzip when brotli is missing."""
+    monkeypatch.setattr(compression, 'brotli', None)
+    assert choose_encoding('gzip, deflate') == 'gzip'
+    assert choose_encoding('br;q=1.0, gzip;q=0.5') == 'gzip'
+    assert choose_encoding('gzip;q=0, *;q=0.1') is None
+    assert choose_encoding('*') == 'gzip'
+    assert choose_encoding('') is None
+
+    monkeypatch.setattr(compression, 'brotli', object())
+    assert choose_encoding('gzip, br') == 'br'
+    assert choose_encoding('br;q=0.5, gzip') == 'gzip'
+
+def test_comment_thread_gzipped(client, mock_db):
+    """Test that a large thread is gzipped with a weak ETag that still revalidates."""
+    _thread(mock_db, 'Long')
+    plain = client.get('/api/comments/Long')
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+
+    response = client.get('/api/comments/Long', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.data)) == json.loads(plain.data)
+    assert len(response.data) < len(plain.data) / 3
+    assert response.headers['ETag'] == 'W/' + plain.headers['ETag']
+
+    revalidated = client.get('/api/comments/Long', headers={'Accept-Encoding': 'gzip',
+                                                            'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+
+def test_small_and_streamed_responses(client, mock_db):
+    """Test that tiny bodies stay as they are and exports are compressed as they stream."""
+    small = client.get('/api/comment-count/Nothing', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+
+    _thread(mock_db, 'Exported')
+    export = client.get('/api/all-comments?format=ndjson', headers={'Accept-Encoding': 'gzip'})
+    assert export.headers['Content-Encoding'] == 'gzip'
+    lines = gzip.decompress(export.data).decode().splitlines()
+    assert len(lines) == 40 and json.loads(lines[0])['articleTitle'] == 'Exported'
+
+def test_asgi_middleware():
+    """Test that the ASGI middleware compresses JSON and leaves event streams alone."""
+    async def inner(scope, receive, send):
+        content_type = b'text/event-stream' if scope['path'] == '/events' else b'application/json'
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', content_type), (b'etag', b'"v1"')]})
+        await send({'type': 'http.response.body', 'body': b'[' + b'1,' * 2000, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'1]'})
+
+    async def call(path):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+        scope = {'type': 'http', 'path': path, 'headers': [(b'accept-encoding', b'gzip')]}
+        await CompressionMiddleware(inner)(scope, None, send)
+        return sent
+
+    sent = asyncio.run(call('/json'))
+    headers = dict(sent[0]['headers'])
+    assert headers[b'content-encoding'] == b'gzip' and headers[b'etag'] == b'W/"v1"'
+    assert json.loads(gzip.decompress(b''.join(m['body'] for m in sent[1:]))) == [1] * 2001
+
+    sent = asyncio.run(call('/events'))
+    assert b'content-encoding' not in dict(sent[0]['headers'])
+    assert sent[1]['body'].startswith(b'[1,')
@@ -0,0 +1,82 @@
+import json
+
+from events import ArticleBroker, broker, update_event
+
+
+def _data(frame):
+    assert frame.startswith('data: ')
+    return json.loads(frame[len('data: '):])
+
+def test_broker_routes_by_article_and_encodes_once():
+    """Test that only the article's subscribers get the event and that unsubscribing stops delivery."""
+    local = ArticleBroker()
+    first, second, other = [], [], []
+    token = local.subscribe('A', first.append)
+    local.subscribe('A', second.append)
+    local.subscribe('B', other.append)
+
+    assert local.publish('A', {'type': 'comment'}) == 2
+    assert first == second and first[0] is second[0]
+    assert other == []
+
+    local.unsubscribe(token)
+    local.publish('A', {'type': 'comment'})
+    assert len(first) == 1 and len(second) == 2
+    assert local.subscriber_count() == 2
+
+def test_update_event_only_exposes_visible_fields():
+    """Test that removal events carry a -1 count delta and no unrelated fields."""
+    event = update_event('reply', 'r1', 'c1', {'text': '', 'removed_at': 'now', 'articleTitle': 'A'})
+    assert event == {'type': 'update', 'target': 'reply', 'id': 'r1', 'commentId': 'c1',
+                     'fields': {'text': '', 'removed_at': 'now'}, 'countDelta': -1}
+
+def test_writes_publish_deltas(client, mock_db, login):
+    """Test that posting, replying and moderation reach the article's subscribers without a change stream."""
+    frames = []
+    token = broker.subscribe('Live', frames.append)
+    try:
+        login()
+        comment_id = json.loads(client.post('/api/comments', json={'articleTitle': 'Live', 'text': 'hi'}).data)['id']
+        reply_id = json.loads(client.post(f'/api/comments/{comment_id}/replies', json={'text': 'yo'}).data)['id']
+        login(moderator=True)
+        client.put(f'/api/comments/{comment_id}/redact')
+        client.delete(f'/api/comments/{comment_id}/replies/{reply_id}')
+    finally:
+        broker.unsubscribe(token)
+
+    events = [_data(frame) for frame in frames]
+    assert [event['type'] for event in events] == ['comment', 'reply', 'update', 'update']
+    assert events[0]['comment']['_id'] == comment_id and events[0]['countDelta'] == 1
+    assert events[1]['commentId'] == comment_id and events[1]['reply']['_id'] == reply_id
+    assert 'comment_id' not in events[1]['reply']
+    assert events[2]['countDelta'] == 0 and 'redacted by a moderator' in events[2]['fields']['text']
+    assert events[3]['target'] == 'reply' and events[3]['countDelta'] == -1
+
+def test_event_stream_not_served_by_flask(client):
+    """Test that the WSGI app leaves event streams to the ASGI app instead of holding a thread per client."""
+    assert client.get('/api/comments/Streamed/events').status_code == 404
+
+def test_loop_relay_fans_out_inside_the_loop():
+    """Test that one broker subscription per loop feeds every queue of that article."""
+    import asyncio
+    import threading
+    from events import LoopRelay
+
+    async def go():
+        local = ArticleBroker()
+        relay = LoopRelay(local, asyncio.get_running_loop())
+        queues = [asyncio.Queue() for _ in range(3)]
+        for queue in queues:
+            relay.add('A', queue)
+        assert local.subscriber_count('A') == 1
+
+        # Writes are published from worker threads
+        threading.Thread(target=local.publish, args=('A', {'type': 'comment'})).start()
+        frames = await asyncio.wait_for(asyncio.gather(*(queue.get() for queue in queues)), 5)
+        assert len(set(frames)) == 1
+
+        for queue in queues:
+            relay.remove('A', queue)
+        assert local.subscriber_count() == 0
+
+    asyncio.run(go())
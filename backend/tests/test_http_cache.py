@@ -0,0 +1,83 @@
+import json
+import re
+
+import http_cache
+
+
+def _post(client, title, text='hi'):
+    return json.loads(client.post('/api/comments', json={'articleTitle': title, 'text': text}).data)['id']
+
+def test_comment_reads_answer_304_until_a_write(client, mock_db, login, monkeypatch):
+    """Test that an unchanged thread is revalidated without a comments query and that writes move the ETag."""
+    login()
+    comment_id = _post(client, 'Cached')
+
+    first = client.get('/api/comments/Cached')
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    def no_query(*args, **kwargs):
+        raise AssertionError('comments were queried for a 304')
+    with monkeypatch.context() as m:
+        m.setattr(mock_db.article_stats, 'find_one', no_query)
+        m.setattr(mock_db.comments, 'find', no_query)
+        again = client.get('/api/comments/Cached', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+
+    # Another representation of the same thread has its own tag
+    assert client.get('/api/comments/Cached?limit=5').headers['ETag'] != etag
+
+    client.post(f'/api/comments/{comment_id}/replies', json={'text': 'yo'})
+    after_reply = client.get('/api/comments/Cached', headers={'If-None-Match': etag})
+    assert after_reply.status_code == 200
+    assert len(json.loads(after_reply.data)[0]['replies']) == 1
+
+    login(moderator=True)
+    etag = after_reply.headers['ETag']
+    client.put(f'/api/comments/{comment_id}/partial-redact', json={'redactedText': 'h█'})
+    after_redact = client.get('/api/comments/Cached', headers={'If-None-Match': etag})
+    assert after_redact.status_code == 200
+    assert json.loads(after_redact.data)[0]['text'] == 'h█'
+
+def test_comment_count_etag(client, mock_db, login):
+    """Test that the count endpoint is revalidated with its own ETag."""
+    login()
+    _post(client, 'Counted')
+    first = client.get('/api/comment-count/Counted')
+    assert client.get('/api/comment-count/Counted', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    _post(client, 'Counted')
+    second = client.get('/api/comment-count/Counted', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert json.loads(second.data)['count'] == 2
+
+def test_static_assets_are_content_hashed(client):
+    """Test that index.html links hashed asset URLs that are cached for good, and is itself revalidated."""
+    index = client.get('/')
+    html = index.data.decode()
+    match = re.search(r'src="script\.js\?v=([0-9a-f]+)"', html)
+    assert match
+    assert index.headers['Cache-Control'] == 'no-cache'
+    assert client.get('/', headers={'If-None-Match': index.headers['ETag']}).status_code == 304
+
+    hashed = client.get(f'/script.js?v={match.group(1)}')
+    assert hashed.status_code == 200
+    assert 'immutable' in hashed.headers['Cache-Control']
+    assert client.get('/script.js').headers['Cache-Control'] == 'no-cache'
+    assert client.get('/script.js?v=outdated').headers['Cache-Control'] == 'no-cache'
+
+def test_versions_expire_with_change_streams(mock_db, monkeypatch):
+    """Test that a version read before its bump landed is not kept forever when events are authoritative."""
+    clock = [100.0]
+    monkeypatch.setattr(http_cache.time, 'monotonic', lambda: clock[0])
+    versions = http_cache.ArticleVersions(lambda: mock_db, ttl=2, authoritative=lambda: True, authoritative_ttl=10)
+    mock_db.article_stats.insert_one({'articleKey': 'ak_0123456789abcdef', 'version': 1})
+    assert versions.get('ak_0123456789abcdef') == 1
+
+    # The comments event already invalidated, then the article_stats bump lands without another one
+    mock_db.article_stats.update_one({'articleKey': 'ak_0123456789abcdef'}, {'$inc': {'version': 1}})
+    clock[0] += 5
+    assert versions.get('ak_0123456789abcdef') == 1
+    clock[0] += 6
+    assert versions.get('ak_0123456789abcdef') == 2
@@ -0,0 +1,41 @@
+from articles import article_key
+from indexes import drop_retired_indexes, ensure_indexes, uses_collscan
+
+
+def test_uses_collscan_detects_nested_stage():
+    """Test that a COLLSCAN anywhere in the winning plan is reported."""
+    explain = {'queryPlanner': {'winningPlan': {
+        'stage': 'FETCH',
+        'inputStage': {'stage': 'OR', 'inputStages': [{'stage': 'IXSCAN'}, {'stage': 'COLLSCAN'}]}
+    }}}
+    assert uses_collscan(explain)
+
+def test_uses_collscan_index_plan():
+    """Test that an index-backed plan passes."""
+    explain = {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}}}
+    assert not uses_collscan(explain)
+
+def test_ensure_indexes(mock_db):
+    """Test that startup keys old documents and builds the articleKey indexes, merging duplicate stats first."""
+    mock_db.article_stats.insert_many([
+        {'articleTitle': 'Dup', 'commentCount': 2},
+        {'articleTitle': 'Dup', 'commentCount': 3},
+    ])
+    ensure_indexes(mock_db)
+
+    comment_indexes = mock_db.comments.index_information()
+    assert comment_indexes['articleKey_timestamp']['key'] == [('articleKey', 1), ('timestamp', 1)]
+    assert 'comment_id_ancestors' in mock_db.replies.index_information()
+    assert mock_db.article_stats.index_information()['articleKey_unique']['unique']
+
+    stats = list(mock_db.article_stats.find({'articleKey': article_key('Dup')}))
+    assert len(stats) == 1
+    assert stats[0]['commentCount'] == 5
+
+def test_drop_retired_indexes(mock_db):
+    """Test that the headline indexes are dropped once, leaving the articleKey ones."""
+    mock_db.comments.create_index([('articleTitle', 1), ('timestamp', 1)], name='articleTitle_timestamp')
+    ensure_indexes(mock_db)
+    assert drop_retired_indexes(mock_db) == ['articleTitle_timestamp']
+    assert drop_retired_indexes(mock_db) == []
+    assert 'articleKey_timestamp' in mock_db.comments.index_information()
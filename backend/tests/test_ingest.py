@@ -0,0 +1,109 @@
+import json
+import os
+
+from bson import json_util
+from bson.objectid import ObjectId
+
+import app as app_module
+from ingest import QueueFull, WriteBehindQueue
+
+
+def _comment(title='A', text='hi'):
+    return {'_id': ObjectId(), 'articleTitle': title, 'username': 'alice', 'text': text,
+            'timestamp': '2024-01-01T00:00:00'}
+
+def _queue(db, tmp_path, **options):
+    # A long interval keeps the background flusher idle so the test decides when to flush
+    options.setdefault('flush_interval', 60)
+    options.setdefault('fsync', False)
+    return WriteBehindQueue(lambda: db, str(tmp_path), batch_size=1000, **options)
+
+def test_flush_batches_inserts_and_counts(mock_db, tmp_path):
+    """Test that queued comments are written with one insert and one aggregated $inc per article."""
+    queue = _queue(mock_db, tmp_path)
+    try:
+        for title in ('A', 'A', 'B'):
+            queue.submit(_comment(title))
+        assert mock_db.comments.count_documents({}) == 0
+        spill = [name for name in os.listdir(tmp_path) if name.endswith('.jsonl')]
+        assert len(spill) == 1
+
+        assert queue.flush() == 3
+        assert mock_db.comments.count_documents({}) == 3
+        assert mock_db.article_stats.find_one({'articleTitle': 'A'})['commentCount'] == 2
+        assert mock_db.article_stats.find_one({'articleTitle': 'B'})['commentCount'] == 1
+        assert queue.stats['batches'] == 1
+        assert not [name for name in os.listdir(tmp_path) if name.endswith('.flushing')]
+    finally:
+        queue.close()
+
+def test_backpressure(mock_db, tmp_path):
+    """Test that a full queue rejects new comments instead of growing."""
+    queue = _queue(mock_db, tmp_path, max_pending=2, put_timeout=0.01)
+    try:
+        queue.submit(_comment())
+        queue.submit(_comment())
+        try:
+            queue.submit(_comment())
+            assert False, 'expected QueueFull'
+        except QueueFull:
+            pass
+        assert queue.stats['rejected'] == 1
+    finally:
+        queue.close()
+
+def _dead_pid(start=4194000):
+    while True:
+        try:
+            os.kill(start, 0)
+            start += 1
+        except ProcessLookupError:
+            return start
+
+def test_replay_of_a_dead_process_spill(mock_db, tmp_path):
+    """Test that comments spilled by a crashed worker are inserted once and counted once."""
+    already = _comment()
+    mock_db.comments.insert_one(dict(already))
+    dead_pid = _dead_pid()
+    with open(tmp_path / f'comments.{dead_pid}.jsonl', 'w') as f:
+        f.write(json_util.dumps(already) + '\n')
+        f.write(json_util.dumps(_comment()) + '\n')
+        f.write('{"torn": ')
+
+    queue = _queue(mock_db, tmp_path)
+    assert queue.replay() == 1
+    assert mock_db.comments.count_documents({}) == 2
+    assert mock_db.article_stats.find_one({'articleTitle': 'A'})['commentCount'] == 1
+    assert os.listdir(tmp_path) == []
+
+def test_replay_reclaims_a_dead_replay(mock_db, tmp_path):
+    """Test that a file claimed by a replay that crashed is replayed again, one claimed by a live one is not."""
+    dead_pid = _dead_pid()
+    dead_replayer = _dead_pid(dead_pid + 1)
+    orphan, busy = _comment(text='orphan'), _comment(text='busy')
+    with open(tmp_path / f'comments.{dead_pid}.jsonl.{dead_replayer}.replaying', 'w') as f:
+        f.write(json_util.dumps(orphan) + '\n')
+    with open(tmp_path / f'comments.{dead_pid}.jsonl.1.flushing.{os.getpid()}.replaying', 'w') as f:
+        f.write(json_util.dumps(busy) + '\n')
+
+    queue = _queue(mock_db, tmp_path)
+    assert queue.replay() == 1
+    assert [doc['text'] for doc in mock_db.comments.find()] == ['orphan']
+    assert os.listdir(tmp_path) == [f'comments.{dead_pid}.jsonl.1.flushing.{os.getpid()}.replaying']
+
+def test_add_comment_write_behind(client, mock_db, login, tmp_path, monkeypatch):
+    """Test that POST /api/comments answers with the final id before the comment is written."""
+    queue = _queue(mock_db, tmp_path)
+    monkeypatch.setattr(app_module, 'comment_queue', queue)
+    try:
+        login()
+        response = client.post('/api/comments', json={'articleTitle': 'Queued', 'text': 'hi'})
+        assert response.status_code == 202
+        comment_id = json.loads(response.data)['id']
+        assert mock_db.comments.count_documents({}) == 0
+
+        queue.flush()
+        comments = json.loads(client.get('/api/comments/Queued').data)
+        assert [comment['_id'] for comment in comments] == [comment_id]
+    finally:
+        queue.close()
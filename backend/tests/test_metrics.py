@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+import types
+
+import logs
+import metrics
+
+
+def test_histogram_and_counter_render():
+    """Test that histograms are cumulative and everything renders in the text format."""
+    registry = metrics.Registry()
+    latency = registry.histogram('op_seconds', 'Op latency', buckets=(0.1, 1.0))
+    latency.observe(0.05, op='a')
+    latency.observe(0.5, op='a')
+    registry.counter('ops_total', 'Ops').inc(op='a"b')
+    registry.collect_stats('cache_total', 'Cache', 'result', lambda: {'hit': 3})
+
+    text = registry.render()
+    assert '# TYPE op_seconds histogram' in text
+    assert 'op_seconds_bucket{op="a",le="0.1"} 1.0' in text
+    assert 'op_seconds_bucket{op="a",le="1.0"} 2.0' in text
+    assert 'op_seconds_bucket{op="a",le="+Inf"} 2.0' in text
+    assert 'op_seconds_count{op="a"} 2.0' in text
+    assert 'ops_total{op="a\\"b"} 1.0' in text
+    assert 'cache_total{result="hit"} 3.0' in text
+
+def test_mongo_commands_totalled_per_request():
+    """Test that command events are timed and summed for the thread's current request."""
+    registry = metrics.Registry()
+    listener = metrics.MongoCommandMetrics(registry)
+    event = types.SimpleNamespace(command_name='find', duration_micros=2000)
+    listener.succeeded(event)  # outside a request
+    listener.begin_request()
+    listener.succeeded(event)
+    listener.failed(types.SimpleNamespace(command_name='insert', duration_micros=1000))
+    assert listener.end_request() == [2, 0.003]
+    assert 'mongo_command_duration_seconds_count{command="find"} 2.0' in registry.render()
+    assert 'mongo_command_failures_total{command="insert"} 1.0' in registry.render()
+
+def test_metrics_endpoint(client, mock_db):
+    """Test that requests are recorded per route and exposed on /metrics."""
+    client.get('/api/comments/Metered')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    text = response.data.decode()
+    assert ('http_request_duration_seconds_count{method="GET",route="/api/comments/<article_title>",'
+            'status="200"}') in text
+    assert 'http_request_mongo_commands_count{route="/api/comments/<article_title>"}' in text
+    assert 'nyt_cache_requests_total{result="hit"}' in text
+
+def test_snapshots_merge_workers(tmp_path):
+    """Test that /metrics sums every worker's snapshot and keeps the counts of exited ones."""
+    registry = metrics.Registry()
+    registry.counter('ops_total', 'Ops').inc(2)
+    dead_pid = 2 ** 22 + 1
+    with open(tmp_path / f'worker.{dead_pid}.json', 'w') as f:
+        json.dump([['ops_total', [], 5]], f)
+
+    assert registry.merged_samples(str(tmp_path))[('ops_total', ())] == 7
+    assert not os.path.exists(tmp_path / f'worker.{dead_pid}.json')
+    assert registry.merged_samples(str(tmp_path))[('ops_total', ())] == 7
+
+def test_log_event_levels_and_sampling(caplog, monkeypatch):
+    """Test that events are JSON lines, disabled levels are skipped and sampling spares warnings."""
+    logger = logging.getLogger('test_logs')
+    with caplog.at_level(logging.INFO, logger='test_logs'):
+        logs.log_event(logger, logging.DEBUG, 'hidden', n=1)
+        logs.log_event(logger, logging.INFO, 'shown', n=2)
+        monkeypatch.setattr(logs, 'SAMPLE_RATE', 0.0)
+        logs.log_event(logger, logging.INFO, 'sampled_out')
+        logs.log_event(logger, logging.WARNING, 'kept')
+    assert [json.loads(record.message)['event'] for record in caplog.records] == ['shown', 'kept']
@@ -0,0 +1,85 @@
+import json
+
+from bson.objectid import ObjectId
+
+import reply_store
+from articles import article_key
+
+
+def _seed(db):
+    """Two comments by spammer and one by alice on A, one spam reply under alice's comment"""
+    key = article_key('A')
+    spam = [db.comments.insert_one({'articleKey': key, 'articleTitle': 'A', 'username': 'spammer',
+                                    'text': f'buy {n}'}).inserted_id
+            for n in range(2)]
+    keep = db.comments.insert_one({'articleKey': key, 'articleTitle': 'A', 'username': 'alice', 'text': 'hi'}).inserted_id
+    reply = reply_store.new_reply(keep, 'A', 'spammer', 'buy more')
+    db.replies.insert_one(reply)
+    db.article_stats.insert_one({'articleKey': key, 'articleTitle': 'A', 'commentCount': 4, 'version': 1})
+    return spam, keep, reply['_id']
+
+def _bulk(client, actions):
+    response = client.post('/api/moderation/bulk', json={'actions': actions})
+    return response.status_code, json.loads(response.data)
+
+def test_bulk_moderation_mixed_actions(client, mock_db, login):
+    """Test that id and filter actions apply in one request with a result per action and exact counts."""
+    spam, keep, reply_id = _seed(mock_db)
+    login(moderator=True)
+
+    status, body = _bulk(client, [
+        {'action': 'remove', 'target': 'all', 'filter': {'articleTitle': 'A', 'username': 'spammer'}},
+        {'action': 'remove', 'target': 'comment', 'id': str(spam[0])},
+        {'action': 'partial_redact', 'target': 'comment', 'id': str(keep), 'redactedText': 'h█'},
+        {'action': 'redact', 'target': 'reply', 'id': str(ObjectId())},
+        {'action': 'explode', 'target': 'comment', 'id': str(keep)},
+    ])
+    assert status == 200
+    assert [result['status'] for result in body['results']] == ['ok', 'already_removed', 'ok', 'not_found', 'invalid']
+    assert body['results'][0]['modified'] == 3
+    assert body['summary'] == {'ok': 2, 'already_removed': 1, 'not_found': 1, 'invalid': 1}
+
+    assert mock_db.comments.count_documents({'removed_at': {'$exists': True}}) == 2
+    assert mock_db.replies.find_one({'_id': reply_id})['removed_by'] == 'mod'
+    assert mock_db.comments.find_one({'_id': keep})['text'] == 'h█'
+    stats = mock_db.article_stats.find_one({'articleTitle': 'A'})
+    assert stats['commentCount'] == 1
+    assert stats['version'] == 2
+
+def test_bulk_moderation_rejects_bad_requests(client, mock_db, login):
+    """Test that only moderators may use the endpoint and that the body is validated."""
+    login()
+    assert _bulk(client, [{'action': 'redact', 'target': 'comment', 'id': str(ObjectId())}])[0] == 403
+
+    login(moderator=True)
+    assert _bulk(client, [])[0] == 400
+    status, body = _bulk(client, [
+        {'action': 'redact', 'filter': {'$where': 'true'}},
+        {'action': 'partial_redact', 'filter': {'username': 'x'}},
+    ])
+    assert status == 200
+    assert [result['status'] for result in body['results']] == ['invalid', 'invalid']
+
+def test_bulk_removal_counts_only_its_own_changes(client, mock_db, login, monkeypatch):
+    """Test that a comment removed concurrently after the pre-read is not decremented a second time."""
+    import moderation
+    spam, keep, reply_id = _seed(mock_db)
+    login(moderator=True)
+
+    resolve = moderation._resolve
+    def racing_resolve(db, parsed_items):
+        resolved = resolve(db, parsed_items)
+        # Another moderator removes (and counts) the comment between our read and our write
+        db.comments.update_one({'_id': spam[0]}, {'$set': {'removed_at': 'earlier', 'removed_by': 'other'}})
+        db.article_stats.update_one({'articleTitle': 'A'}, {'$inc': {'commentCount': -1}})
+        return resolved
+    monkeypatch.setattr(moderation, '_resolve', racing_resolve)
+
+    status, body = _bulk(client, [
+        {'action': 'remove', 'target': 'comment', 'id': str(spam[0])},
+        {'action': 'remove', 'target': 'comment', 'id': str(spam[1])},
+    ])
+    assert [result['status'] for result in body['results']] == ['already_removed', 'ok']
+    assert body['results'][0]['modified'] == 0
+    assert mock_db.comments.find_one({'_id': spam[0]})['removed_by'] == 'other'
+    assert mock_db.article_stats.find_one({'articleTitle': 'A'})['commentCount'] == 2
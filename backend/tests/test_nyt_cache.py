@@ -0,0 +1,192 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from articles import article_key
+from nyt_cache import NYTArticleCache, UpstreamError, trim_search_response
+
+
+class StubNYT:
+    """Tiny local stand-in for the NYT Article Search API"""
+
+    def __init__(self):
+        self.hits = 0
+        self.status = 200
+        self.delay = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.hits += 1
+                time.sleep(stub.delay)
+                body = json.dumps({"response": {"docs": [{"headline": {"main": self.path}}]}}).encode()
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/articlesearch.json"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubNYT()
+    yield server
+    server.close()
+
+
+def make_cache(stub, **kwargs):
+    return NYTArticleCache(api_key_getter=lambda: 'test_api_key', base_url=stub.url, **kwargs)
+
+
+def test_cache_hit_after_miss(stub):
+    """Test that a repeated (query, page) is served without going upstream."""
+    cache = make_cache(stub)
+    body, status = cache.get('davis+sacramento', '0')
+    assert status == 'MISS'
+    assert json.loads(body)['response']['docs']
+
+    body2, status2 = cache.get('davis+sacramento', '0')
+    assert status2 == 'HIT'
+    assert body2 == body
+    assert stub.hits == 1
+
+    cache.get('davis+sacramento', '1')
+    assert stub.hits == 2
+
+def test_concurrent_misses_share_one_fetch(stub):
+    """Test that identical concurrent misses are coalesced into one upstream request."""
+    stub.delay = 0.2
+    cache = make_cache(stub)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('q', '0'))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert stub.hits == 1
+    assert len(results) == 8
+    assert len({body for body, _ in results}) == 1
+
+def test_stale_served_when_rate_limited(stub):
+    """Test that an expired entry is served when NYT starts returning 429."""
+    cache = make_cache(stub, ttl=0, stale_ttl=60)
+    body, _ = cache.get('q', '0')
+
+    stub.status = 429
+    stale_body, status = cache.get('q', '0')
+    assert status == 'STALE'
+    assert stale_body == body
+
+def test_error_without_cached_copy(stub):
+    """Test that upstream errors surface when there is nothing to fall back on."""
+    stub.status = 503
+    cache = make_cache(stub)
+    with pytest.raises(UpstreamError) as excinfo:
+        cache.get('q', '0')
+    assert excinfo.value.status_code == 503
+
+def test_query_is_encoded(stub):
+    """Test that a query containing & or # reaches NYT whole, with '+' still meaning a space."""
+    body, _ = make_cache(stub).get('salt & pepper #1+deals', '0')
+    params = parse_qs(urlsplit(json.loads(body)['response']['docs'][0]['headline']['main']).query)
+    assert params == {'q': ['salt & pepper #1 deals'], 'page': ['0'], 'api-key': ['test_api_key']}
+
+def test_unreachable_upstream_hides_the_url(stub, caplog):
+    """Test that a connection failure neither returns nor logs the request URL with its API key."""
+    stub.close()
+    cache = make_cache(stub)
+    with pytest.raises(UpstreamError) as excinfo:
+        cache.get('q', '0')
+    assert excinfo.value.status_code == 500 and str(excinfo.value) == 'NYT request failed'
+    assert 'test_api_key' not in caplog.text
+
+def test_followers_get_leader_failures(stub):
+    """Test that an unexpected error in the leader (here from transform) reaches every waiting request."""
+    stub.delay = 0.2
+
+    def broken(body):
+        raise ValueError("bad body")
+    cache = make_cache(stub, transform=broken)
+    errors = []
+
+    def get():
+        try:
+            errors.append(cache.get('q', '0'))
+        except UpstreamError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=get) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(errors) == 4 and all(isinstance(e, UpstreamError) and e.status_code == 500 for e in errors)
+
+def test_async_followers_released_when_leader_cancelled(stub):
+    """Test that cancelling the leading request (client disconnect) does not leave followers waiting."""
+    pytest.importorskip('httpx')
+    import asyncio
+    from nyt_cache import AsyncNYTArticleCache
+    stub.delay = 0.5
+    cache = AsyncNYTArticleCache(api_key_getter=lambda: 'test_api_key', base_url=stub.url)
+
+    async def go():
+        leader = asyncio.create_task(cache.get('q', '0'))
+        await asyncio.sleep(0.05)
+        follower = asyncio.create_task(cache.get('q', '0'))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        with pytest.raises(UpstreamError) as excinfo:
+            await asyncio.wait_for(follower, 2)
+        assert excinfo.value.status_code == 503
+        assert leader.cancelled()
+        await cache.aclose()
+
+    asyncio.run(go())
+
+def test_lru_eviction(stub):
+    """Test that the least recently used entry is evicted once the cache is full."""
+    cache = make_cache(stub, max_entries=2)
+    cache.get('a', '0')
+    cache.get('b', '0')
+    cache.get('a', '0')  # a is now most recently used
+    cache.get('c', '0')  # evicts b
+
+    hits = stub.hits
+    assert cache.get('a', '0')[1] == 'HIT'
+    assert cache.get('b', '0')[1] == 'MISS'
+    assert stub.hits == hits + 1
+
+def test_trim_search_response():
+    """Test that only the fields the frontend renders are kept, image URLs made absolute, keys added."""
+    body = json.dumps({"status": "OK", "response": {"meta": {"hits": 2}, "docs": [
+        {"headline": {"main": "Old format", "kicker": "x"}, "snippet": "From the snippet", "word_count": 800,
+         "multimedia": [{"url": "images/a.jpg", "height": 400}], "keywords": [{"name": "subject"}]},
+        {"headline": {"main": "New format"}, "abstract": "Abstract", "word_count": 0,
+         "multimedia": {"default": {"url": "https://static01.nyt.com/b.jpg"}, "thumbnail": {}}},
+    ]}}).encode()
+    docs = json.loads(trim_search_response(body))['response']['docs']
+    assert docs == [
+        {'headline': {'main': 'Old format'}, 'abstract': 'From the snippet', 'word_count': 800,
+         'articleKey': article_key('Old format'),
+         'multimedia': {'default': {'url': 'https://www.nytimes.com/images/a.jpg'}}},
+        {'headline': {'main': 'New format'}, 'abstract': 'Abstract', 'word_count': 0,
+         'articleKey': article_key('New format'),
+         'multimedia': {'default': {'url': 'https://static01.nyt.com/b.jpg'}}},
+    ]
+    assert trim_search_response(b'not json') == b'not json'
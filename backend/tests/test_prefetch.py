@@ -0,0 +1,72 @@
+import unittest.mock
+
+from nyt_cache import UpstreamError
+from prefetch import ArticlePrefetcher, parse_targets
+
+
+class FakeCache:
+    def __init__(self, status=200):
+        self.status = status
+        self.calls = []
+
+    def refresh(self, query, page):
+        self.calls.append((query, page))
+        if self.status != 200:
+            raise UpstreamError(self.status, "NYT API returned status code %d" % self.status)
+        return f'{{"q": "{query}", "page": {page}}}'.encode()
+
+
+def _prefetcher(mock_db, cache, **kwargs):
+    kwargs.setdefault('rate_per_minute', 6000)
+    return ArticlePrefetcher(lambda: mock_db, cache, parse_targets('davis+sacramento', 2), **kwargs)
+
+def test_parse_targets():
+    """Test that every configured query is expanded to its first pages."""
+    assert parse_targets('a, b,', 2) == [('a', '0'), ('a', '1'), ('b', '0'), ('b', '1')]
+
+def test_lease_holder_fetches_and_other_workers_load(mock_db):
+    """Test that only the lease holder calls NYT and every worker serves the saved pages."""
+    leader_cache, follower_cache = FakeCache(), FakeCache()
+    leader, follower = _prefetcher(mock_db, leader_cache), _prefetcher(mock_db, follower_cache)
+    leader._owner, follower._owner = 'host:1', 'host:2'
+
+    leader.run_once()
+    follower.run_once()
+    assert leader_cache.calls == [('davis+sacramento', '0'), ('davis+sacramento', '1')]
+    assert follower_cache.calls == []
+    assert follower.get('davis+sacramento', 1) == b'{"q": "davis+sacramento", "page": 1}'
+    assert follower.get('davis sacramento', '0') == b'{"q": "davis+sacramento", "page": 0}'
+    assert follower.get('other', 0) is None
+
+    # The holder keeps its lease on the next round
+    leader.run_once()
+    assert len(leader_cache.calls) == 4
+
+def test_rate_limited_round_stops_early(mock_db):
+    """Test that a 429 ends the round instead of spending more of the budget."""
+    cache = FakeCache(status=429)
+    prefetcher = _prefetcher(mock_db, cache)
+    prefetcher._owner = 'host:1'
+    prefetcher.run_once()
+    assert len(cache.calls) == 1
+    assert prefetcher.get('davis+sacramento', 0) is None
+
+def test_old_pages_not_served(mock_db):
+    """Test that pages past max_age fall back to the on-demand cache."""
+    prefetcher = _prefetcher(mock_db, FakeCache(), max_age=0)
+    prefetcher._owner = 'host:1'
+    prefetcher.run_once()
+    assert prefetcher.get('davis+sacramento', 0) is None
+
+def test_articles_served_from_prefetch(client, mock_db):
+    """Test that /api/articles answers prefetched searches without calling NYT."""
+    import app as app_module
+    prefetcher = _prefetcher(mock_db, FakeCache())
+    prefetcher._owner = 'host:1'
+    prefetcher.run_once()
+    with unittest.mock.patch.object(app_module, 'article_prefetch', prefetcher), \
+            unittest.mock.patch('requests.Session.get') as upstream:
+        response = client.get('/api/articles?q=davis+sacramento&page=0')
+        assert response.headers['X-Cache'] == 'PREFETCHED'
+        assert response.data == b'{"q": "davis+sacramento", "page": 0}'
+        assert not upstream.called
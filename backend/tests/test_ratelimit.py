@@ -0,0 +1,90 @@
+import json
+import time
+
+import pytest
+
+import app as app_module
+from ratelimit import MemoryBuckets, MongoBuckets, Policy, RateLimiter, client_key
+
+
+class Clock:
+    def __init__(self):
+        # Real time, mongomock applies the TTL index to expiresAt
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+def _buckets(kind, clock):
+    if kind == 'memory':
+        return MemoryBuckets(clock=clock)
+    mongomock = pytest.importorskip('mongomock')
+    collection = mongomock.MongoClient().db.rate_limits
+    return MongoBuckets(lambda: collection, clock=clock)
+
+@pytest.mark.parametrize('kind', ['memory', 'mongo'])
+def test_token_bucket(kind):
+    """Test that a key gets its burst at once, then one request per interval, independently of other keys."""
+    clock = Clock()
+    buckets = _buckets(kind, clock)
+    policy = Policy('comments', '3/30', 'user')  # 3 at once, then one every 10 s
+
+    assert [buckets.hit(policy, 'a')[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = buckets.hit(policy, 'a')
+    assert not allowed and retry_after == pytest.approx(10)
+    assert buckets.hit(policy, 'b')[0]
+
+    clock.now += 10
+    assert buckets.hit(policy, 'a')[0]
+    assert not buckets.hit(policy, 'a')[0]
+
+    # A long pause refills the whole burst but never more
+    clock.now += 1000
+    assert [buckets.hit(policy, 'a')[0] for _ in range(4)] == [True, True, True, False]
+
+def test_mongo_denied_keys_bounded():
+    """Test that refused one-off clients do not pile up in the local deny list."""
+    mongomock = pytest.importorskip('mongomock')
+    clock = Clock()
+    collection = mongomock.MongoClient().db.rate_limits
+    buckets = MongoBuckets(lambda: collection, clock=clock, max_denied=3)
+    policy = Policy('articles', '1/10', 'ip')
+    for n in range(5):
+        buckets.hit(policy, f'ip{n}')
+        assert not buckets.hit(policy, f'ip{n}')[0]
+    assert list(buckets._denied) == ['ip2', 'ip3', 'ip4']
+
+    # Expired entries go as soon as the next client is refused
+    clock.now += 20
+    buckets.hit(policy, 'late')
+    assert not buckets.hit(policy, 'late')[0]
+    assert list(buckets._denied) == ['late']
+
+def test_client_key():
+    """Test that users are keyed by id and anonymous callers by (proxied) address."""
+    assert client_key('user', {'user_id': '42'}, '10.0.0.1') == 'user:42'
+    assert client_key('user', {'user_id': 'unknown', 'username': 'bob'}, '10.0.0.1') == 'user:bob'
+    assert client_key('user', None, '10.0.0.1') == 'ip:10.0.0.1'
+    assert client_key('ip', {'user_id': '42'}, '10.0.0.1') == 'ip:10.0.0.1'
+    assert client_key('ip', None, '10.0.0.1', '1.2.3.4, 5.6.7.8', proxy_hops=1) == 'ip:5.6.7.8'
+    assert client_key('ip', None, '10.0.0.1', '1.2.3.4, 5.6.7.8', proxy_hops=2) == 'ip:1.2.3.4'
+
+def test_comment_writes_limited_per_user(client, mock_db, login, monkeypatch):
+    """Test that a user over the comment limit gets 429 with Retry-After while others can still post."""
+    limiter = RateLimiter(MemoryBuckets(), {'comments': Policy('comments', '2/60', 'user'),
+                                            'articles': Policy('articles', '100/60', 'ip')})
+    monkeypatch.setattr(app_module, 'rate_limiter', limiter)
+    login(username='alice')
+    post = lambda: client.post('/api/comments', json={'articleTitle': 'Limited', 'text': 'hi'})
+    comment_id = json.loads(post().data)['id']
+    assert client.post(f'/api/comments/{comment_id}/replies', json={'text': 'yo'}).status_code == 201
+
+    limited = post()
+    assert limited.status_code == 429
+    assert int(limited.headers['Retry-After']) == 30
+    assert mock_db.comments.count_documents({}) == 1
+
+    with client.session_transaction() as sess:
+        sess['user'] = dict(sess['user'], user_id='456')
+    assert post().status_code == 201
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from bson.objectid import ObjectId
+
+import reply_store
+from articles import article_key
+
+
+def test_migrate_embedded_replies(mock_db):
+    """Test that embedded replies move to the replies collection with their ancestor paths."""
+    top, child, grandchild = ObjectId(), ObjectId(), ObjectId()
+    comment_id = mock_db.comments.insert_one({
+        'articleTitle': 'Legacy',
+        'text': 'root',
+        'replies': [
+            {'_id': top, 'username': 'a', 'text': 'top', 'timestamp': '1'},
+            {'_id': child, 'username': 'b', 'text': 'child', 'timestamp': '2', 'parent_reply_id': str(top)},
+            {'_id': grandchild, 'username': 'c', 'text': 'grand', 'timestamp': '3', 'parent_reply_id': str(child)},
+        ]
+    }).inserted_id
+
+    assert reply_store.migrate_embedded_replies(mock_db) == 1
+    assert reply_store.migrate_embedded_replies(mock_db) == 0  # idempotent
+
+    assert 'replies' not in mock_db.comments.find_one({'_id': comment_id})
+    stored = mock_db.replies.find_one({'_id': grandchild})
+    assert stored['comment_id'] == comment_id
+    assert stored['ancestors'] == [top, child]
+    assert stored['depth'] == 2
+
+def test_migration_rerun_after_partial_failure(mock_db, monkeypatch):
+    """Test that replies without ids are not copied twice when a run dies before unsetting the array."""
+    comment_id = mock_db.comments.insert_one({
+        'articleTitle': 'Legacy',
+        'replies': [{'username': 'a', 'text': 'one', 'timestamp': '1'},
+                    {'username': 'b', 'text': 'two', 'timestamp': '2'}]
+    }).inserted_id
+
+    def unset_fails(*args, **kwargs):
+        raise RuntimeError('interrupted')
+    with monkeypatch.context() as patched:
+        patched.setattr(mock_db.comments, 'update_one', unset_fails)
+        with pytest.raises(RuntimeError):
+            reply_store.migrate_embedded_replies(mock_db)
+    assert mock_db.replies.count_documents({}) == 2
+
+    assert reply_store.migrate_embedded_replies(mock_db) == 1
+    assert sorted(reply['text'] for reply in mock_db.replies.find({'comment_id': comment_id})) == ['one', 'two']
+
+def test_reply_threads_keep_client_shape(client, mock_db, login):
+    """Test that replies and nested replies round-trip through the API in the embedded shape."""
+    login()
+    comment_id = mock_db.comments.insert_one({'articleKey': article_key('Thread'), 'articleTitle': 'Thread',
+                                             'text': 'root', 'timestamp': '1'}).inserted_id
+
+    response = client.post(f'/api/comments/{comment_id}/replies', json={'text': 'first'})
+    assert response.status_code == 201
+    reply_id = json.loads(response.data)['id']
+
+    response = client.post(f'/api/comments/{comment_id}/replies/{reply_id}/replies', json={'text': 'nested'})
+    assert response.status_code == 201
+    nested_id = json.loads(response.data)['id']
+
+    comments = json.loads(client.get('/api/comments/Thread').data)
+    replies = comments[0]['replies']
+    assert [r['text'] for r in replies] == ['first', 'nested']
+    assert 'parent_reply_id' not in replies[0]
+    assert replies[1]['parent_reply_id'] == reply_id
+    assert set(replies[1]) == {'_id', 'username', 'text', 'timestamp', 'parent_reply_id'}
+    assert mock_db.article_stats.find_one({'articleTitle': 'Thread'})['commentCount'] == 2
+
+    # One depth level and a subtree can be loaded on their own
+    direct = json.loads(client.get(f'/api/comments/{comment_id}/replies?depth=0').data)
+    assert [r['_id'] for r in direct] == [reply_id]
+    subtree = json.loads(client.get(f'/api/comments/{comment_id}/replies/{reply_id}/replies').data)
+    assert [r['_id'] for r in subtree] == [nested_id]
+
+def test_nested_reply_unknown_parent(client, mock_db, login):
+    """Test that replying to a missing reply returns 404."""
+    login()
+    comment_id = mock_db.comments.insert_one({'articleTitle': 'Thread', 'text': 'root'}).inserted_id
+    response = client.post(f'/api/comments/{comment_id}/replies/{ObjectId()}/replies', json={'text': 'x'})
+    assert response.status_code == 404
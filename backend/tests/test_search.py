@@ -0,0 +1,84 @@
+import json
+
+from bson.objectid import ObjectId
+
+import app as app_module
+import reply_store
+from events import broker
+from articles import article_key
+from indexes import INDEXES
+from search import InvertedIndex
+
+
+def _doc(text, username='alice', article='A', timestamp='2024-01-01T00:00:00'):
+    return {'_id': ObjectId(), 'text': text, 'username': username, 'articleTitle': article, 'timestamp': timestamp}
+
+def test_inverted_index_ranks_and_filters():
+    """Test that rarer and repeated terms rank higher and that filters narrow the hits."""
+    index = InvertedIndex()
+    index.add('comment', _doc('the budget vote was close'))
+    best = _doc('budget budget budget deficit', username='bob', timestamp='2024-02-01T00:00:00')
+    index.add('comment', best)
+    index.add('comment', _doc('weather is nice'))
+
+    hits, more = index.search('budget deficit')
+    assert [hit['_id'] for hit in hits][0] == str(best['_id'])
+    assert len(hits) == 2 and not more
+
+    assert [hit['username'] for hit in index.search('budget', username='alice')[0]] == ['alice']
+    assert index.search('budget', since='2024-01-15')[0][0]['_id'] == str(best['_id'])
+    index.add('comment', _doc('budget hearing', article='B'))
+    assert [hit['articleTitle'] for hit in index.search('budget', article='B')[0]] == ['B']
+    assert index.search('budget', article=article_key('B'))[0] == index.search('budget', article='B')[0]
+    hits, more = index.search('budget', limit=1)
+    assert len(hits) == 1 and more
+
+def test_inverted_index_follows_writes(client, mock_db, login, monkeypatch):
+    """Test that the in-process index is built on first use and updated by posts and moderation."""
+    comment_id = mock_db.comments.insert_one(_doc('existing pothole report')).inserted_id
+    mock_db.replies.insert_one(reply_store.new_reply(comment_id, 'A', 'bob', 'pothole on fifth street'))
+    index = InvertedIndex(lambda: mock_db)
+    monkeypatch.setattr(app_module, 'comment_search', index)
+    broker.add_listener(index.apply_event)
+    try:
+        body = json.loads(client.get('/api/search?q=pothole').data)
+        assert {hit['type'] for hit in body['results']} == {'comment', 'reply'}
+        assert body['next_offset'] is None
+
+        login()
+        new_id = json.loads(client.post('/api/comments', json={'articleTitle': 'A', 'text': 'another pothole'}).data)['id']
+        body = json.loads(client.get('/api/search?q=pothole&username=alice').data)
+        assert {hit['_id'] for hit in body['results']} == {str(comment_id), new_id}
+
+        login(moderator=True)
+        client.delete(f'/api/comments/{new_id}')
+        body = json.loads(client.get('/api/search?q=pothole').data)
+        assert new_id not in {hit['_id'] for hit in body['results']}
+    finally:
+        broker.remove_listener(index.apply_event)
+
+def test_memory_index_needs_change_stream_with_several_workers(client, mock_db, monkeypatch):
+    """Test that several workers search the text indexes until writes from all of them reach the index."""
+    index = InvertedIndex()
+    index.add('comment', _doc('pothole in memory'))
+    monkeypatch.setattr(app_module, 'comment_search', index)
+    monkeypatch.setattr(app_module._text_search, 'search', lambda text, **kwargs: ([{'type': 'text'}], False))
+
+    def searched():
+        return json.loads(client.get('/api/search?q=pothole').data)['results'][0]['type']
+
+    assert searched() == 'comment'
+    monkeypatch.setattr(app_module, 'WORKERS', 3)
+    assert searched() == 'text'
+    monkeypatch.setattr(broker, 'watching', lambda: True)
+    assert searched() == 'comment'
+
+def test_search_validates_parameters(client):
+    """Test that a query is required and deep offsets are refused."""
+    assert client.get('/api/search').status_code == 400
+    assert client.get('/api/search?q=x&offset=100000').status_code == 400
+
+def test_text_indexes_are_declared():
+    """Test that both searchable collections get a text index."""
+    text_indexes = {collection for collection, keys, _ in INDEXES if keys == [('text', 'text')]}
+    assert text_indexes == {'comments', 'replies'}
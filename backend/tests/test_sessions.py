@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from sessions import FileStore, MemoryStore, ServerSideSessionInterface
+
+
+@pytest.fixture(params=['memory', 'file'])
+def server_sessions(request, app, monkeypatch, tmp_path):
+    store = MemoryStore(max_entries=10) if request.param == 'memory' else FileStore(str(tmp_path))
+    monkeypatch.setattr(app, 'session_interface', ServerSideSessionInterface(store, ttl=60))
+    return store
+
+def test_server_side_session_round_trip(client, login, server_sessions):
+    """Test that the cookie only carries a signed id and the user lives in the store."""
+    login(moderator=True)
+    cookie = client.get_cookie('session')
+    assert 'moderator' not in cookie.value
+    sid = cookie.value.rsplit('.', 1)[0]
+    assert server_sessions.load(sid)['user']['email'] == 'moderator@hw3.com'
+
+    data = json.loads(client.get('/api/me').data)
+    assert data == {'username': 'mod', 'email': 'moderator@hw3.com', 'user_id': '123', 'is_moderator': True}
+
+    client.get('/logout')
+    assert server_sessions.load(sid) is None
+    assert json.loads(client.get('/api/me').data)['username'] is None
+
+def test_login_issues_new_session_id(client, login, server_sessions):
+    """Test that logging in moves the session to a new id and drops the one used before login."""
+    with client.session_transaction() as sess:
+        sess['next'] = '/app'
+    before = client.get_cookie('session').value
+    old_sid = before.rsplit('.', 1)[0]
+    assert server_sessions.load(old_sid) == {'next': '/app'}
+
+    login()
+    after = client.get_cookie('session').value
+    assert after != before
+    assert server_sessions.load(old_sid) is None
+    assert server_sessions.load(after.rsplit('.', 1)[0])['next'] == '/app'
+    assert json.loads(client.get('/api/me').data)['username'] == 'alice'
+
+def test_store_read_only_when_session_used(client, login, server_sessions, monkeypatch):
+    """Test that requests that never look at the session do not read the store."""
+    login()
+    loads = []
+    load = server_sessions.load
+    monkeypatch.setattr(server_sessions, 'load', lambda sid: loads.append(sid) or load(sid))
+
+    assert client.get('/healthz').status_code == 200
+    assert loads == []
+    assert json.loads(client.get('/api/me').data)['username'] == 'alice'
+    assert len(loads) == 1
+
+def test_tampered_session_cookie(client, server_sessions):
+    """Test that an unsigned session id is treated as a fresh anonymous session."""
+    client.set_cookie('session', 'forged-session-id')
+    assert json.loads(client.get('/api/me').data)['username'] is None
+
+def test_memory_store_lru():
+    """Test that the in-memory store evicts the least recently used session."""
+    store = MemoryStore(max_entries=2)
+    store.save('a', {'n': 1}, 60)
+    store.save('b', {'n': 2}, 60)
+    store.load('a')
+    store.save('c', {'n': 3}, 60)
+    assert store.load('b') is None
+    assert store.load('a') == {'n': 1}
+
+def test_me_resolves_moderator_from_email(client):
+    """Test that /api/me derives the moderator role for sessions without the flag."""
+    with client.session_transaction() as sess:
+        sess['user'] = {'username': 'mod', 'email': 'moderator@hw3.com'}
+    data = json.loads(client.get('/api/me').data)
+    assert data['is_moderator'] is True
+    assert data['user_id'] == 'unknown'
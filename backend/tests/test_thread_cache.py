@@ -0,0 +1,62 @@
+import json
+
+import app as app_module
+import reply_store
+from thread_cache import ThreadSnapshots
+
+
+def test_nest_replies_builds_trees():
+    """Test that replies are nested under their parents in order, orphans at the top level."""
+    root = reply_store.new_reply('c', 'T', 'a', 'root')
+    child = reply_store.new_reply('c', 'T', 'b', 'child', parent=root)
+    grandchild = reply_store.new_reply('c', 'T', 'c', 'grandchild', parent=child)
+    sibling = reply_store.new_reply('c', 'T', 'd', 'sibling')
+    orphan = reply_store.new_reply('c', 'T', 'e', 'orphan', parent=reply_store.new_reply('c', 'T', 'x', 'gone'))
+
+    tree = reply_store.nest_replies([root, child, grandchild, sibling, orphan])
+    assert [r['text'] for r in tree] == ['root', 'sibling', 'orphan']
+    assert tree[0]['replies'][0]['text'] == 'child'
+    assert tree[0]['replies'][0]['replies'][0]['text'] == 'grandchild'
+    assert tree[0]['replies'][0]['replies'][0]['replies'] == []
+    assert 'ancestors' not in tree[0] and 'comment_id' not in tree[0]
+
+def test_snapshots_follow_versions_and_evict():
+    """Test that snapshots only serve their own version and the least recently used article goes first."""
+    snapshots = ThreadSnapshots(max_entries=2)
+    snapshots.put('a', 1, b'', b'[1]')
+    snapshots.put('b', 1, b'', b'[2]')
+    assert snapshots.get('a', 1, b'') == b'[1]'
+    assert snapshots.get('a', 2, b'') is None
+    snapshots.put('c', 1, b'', b'[3]')
+    assert snapshots.get('b', 1, b'') is None
+    assert snapshots.get('a', 1, b'') == b'[1]'
+    snapshots.invalidate('a')
+    assert snapshots.get('a', 1, b'') is None
+
+    small = ThreadSnapshots(max_bytes=5)
+    small.put('a', 1, b'', b'[1]')
+    small.put('b', 1, b'', b'[22]')
+    assert small.get('a', 1, b'') is None and small.get('b', 1, b'') == b'[22]'
+
+def test_tree_thread_snapshot_invalidated_by_writes(client, mock_db, login):
+    """Test that ?replies=tree nests replies and is rebuilt after replies and redactions."""
+    login()
+    comment_id = json.loads(client.post('/api/comments', json={'articleTitle': 'Tree', 'text': 'root'}).data)['id']
+    reply_id = json.loads(client.post(f'/api/comments/{comment_id}/replies', json={'text': 'first'}).data)['id']
+    client.post(f'/api/comments/{comment_id}/replies/{reply_id}/replies', json={'text': 'nested'})
+
+    thread = json.loads(client.get('/api/comments/Tree?replies=tree').data)
+    assert [r['text'] for r in thread[0]['replies']] == ['first']
+    assert thread[0]['replies'][0]['replies'][0]['text'] == 'nested'
+    hits = app_module.thread_snapshots.stats['hit']
+    assert json.loads(client.get('/api/comments/Tree?replies=tree').data) == thread
+    assert app_module.thread_snapshots.stats['hit'] == hits + 1
+
+    client.post(f'/api/comments/{comment_id}/replies', json={'text': 'second'})
+    thread = json.loads(client.get('/api/comments/Tree?replies=tree').data)
+    assert [r['text'] for r in thread[0]['replies']] == ['first', 'second']
+
+    login(moderator=True)
+    client.put(f'/api/comments/{comment_id}/replies/{reply_id}')
+    thread = json.loads(client.get('/api/comments/Tree?replies=tree').data)
+    assert thread[0]['replies'][0]['text'] == "[This reply has been redacted by a moderator]"
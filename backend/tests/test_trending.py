@@ -0,0 +1,63 @@
+import json
+from datetime import datetime, timedelta
+
+import app as app_module
+from articles import article_key
+from article_stats import activity_bucket, apply_count_deltas
+from trending import Leaderboard
+
+
+def test_activity_buckets_follow_writes(client, mock_db, login):
+    """Test that comments, replies and removals move the current activity bucket."""
+    login()
+    comment_id = json.loads(client.post('/api/comments', json={'articleTitle': 'Busy', 'text': 'hi'}).data)['id']
+    client.post(f'/api/comments/{comment_id}/replies', json={'text': 'yo'})
+    client.post('/api/comments', json={'articleTitle': 'Quiet', 'text': 'hi'})
+    login(moderator=True)
+    client.delete(f'/api/comments/{comment_id}')
+
+    # Single writes only tally their activity, the buffer writes it with one bulk_write
+    assert mock_db.article_activity.count_documents({}) == 0
+    assert app_module.activity_buffer.flush() == 2
+    counts = {doc['articleTitle']: doc['count'] for doc in mock_db.article_activity.find()}
+    assert counts == {'Busy': 1, 'Quiet': 1}
+    assert all(doc['bucket'] == activity_bucket() for doc in mock_db.article_activity.find())
+
+def test_leaderboard_windows(mock_db):
+    """Test that each window sums only its own buckets and keeps the top entries."""
+    now = datetime.utcnow()
+    old = activity_bucket(now - timedelta(hours=3))
+    mock_db.article_activity.insert_many([
+        {'articleKey': article_key('Old news'), 'articleTitle': 'Old news', 'bucket': old, 'count': 9},
+        {'articleKey': article_key('Fresh'), 'articleTitle': 'Fresh', 'bucket': activity_bucket(now), 'count': 2},
+    ])
+    apply_count_deltas(mock_db, {'Fresh': 1, 'Also fresh': 1, 'Old news': 0})
+    mock_db.article_stats.update_one({'articleTitle': 'Old news'}, {'$set': {'commentCount': 40}})
+
+    board = Leaderboard(lambda: mock_db, size=2, refresh_interval=3600)
+    board.refresh()
+    assert board.top('1h')[0] == [{'articleKey': article_key('Fresh'), 'articleTitle': 'Fresh', 'count': 3},
+                                 {'articleKey': article_key('Also fresh'), 'articleTitle': 'Also fresh', 'count': 1}]
+    assert board.top('24h', 1)[0] == [{'articleKey': article_key('Old news'), 'articleTitle': 'Old news', 'count': 9}]
+    assert board.top('all')[0][0] == {'articleKey': article_key('Old news'), 'articleTitle': 'Old news', 'count': 40}
+    board.close()
+
+def test_trending_endpoint(client, mock_db, monkeypatch):
+    """Test that the endpoint serves the cached ranking and validates its parameters."""
+    apply_count_deltas(mock_db, {'A': 3, 'B': 5})
+    board = Leaderboard(lambda: mock_db, size=5, refresh_interval=3600)
+    monkeypatch.setattr(app_module, 'trending', board)
+    try:
+        body = json.loads(client.get('/api/trending?window=1h&limit=1').data)
+        assert body['articles'] == [{'articleKey': article_key('B'), 'articleTitle': 'B', 'count': 5}]
+
+        # Served from memory until the next refresh
+        apply_count_deltas(mock_db, {'A': 10})
+        assert json.loads(client.get('/api/trending?window=1h').data)['articles'][0]['articleTitle'] == 'B'
+        board.refresh()
+        assert json.loads(client.get('/api/trending?window=1h').data)['articles'][0]['articleTitle'] == 'A'
+
+        assert client.get('/api/trending?window=1y').status_code == 400
+        assert client.get('/api/trending?limit=0').status_code == 400
+    finally:
+        board.close()
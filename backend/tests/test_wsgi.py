@@ -0,0 +1,82 @@
+import os
+from datetime import datetime
+
+from flask import Flask
+
+import app as app_module
+
+
+def test_mongo_client_recreated_after_fork(monkeypatch):
+    """Test that a forked worker (new pid) gets its own pooled MongoClient."""
+    app_module.reset_mongo_client()
+    parent_client = app_module.get_mongo_client()
+    assert app_module.get_mongo_client() is parent_client
+    assert parent_client.options.pool_options.max_pool_size == app_module.MONGO_POOL_OPTIONS['maxPoolSize']
+
+    monkeypatch.setattr(app_module.os, 'getpid', lambda: -1)
+    worker_client = app_module.get_mongo_client()
+    assert worker_client is not parent_client
+
+    app_module.reset_mongo_client()
+    parent_client.close()
+    worker_client.close()
+
+def test_wsgi_entry_point():
+    """Test that the production entry point exposes the Flask app."""
+    import wsgi
+    assert isinstance(wsgi.app, Flask)
+    assert 'api.get_comments' in wsgi.app.view_functions
+
+def test_factory_builds_independent_apps():
+    """Test that create_app applies its config per app and importing the module logs nobody in to Dex."""
+    first, second = app_module.create_app({'TESTING': True}), app_module.create_app()
+    assert first is not second and first.testing and not second.testing
+    assert not hasattr(app_module, 'oauth') and not hasattr(app_module, 'nonce')
+
+def test_factory_config_builds_services():
+    """Test that create_app's config reaches the services it builds, over the environment."""
+    app_module.create_app({'RATE_LIMIT_BACKEND': 'off', 'SESSION_BACKEND': 'memory', 'NYT_CACHE_TTL': '7'})
+    assert app_module.rate_limiter is None
+    assert app_module.nyt_cache.ttl == 7
+    assert type(app_module._session_interface).__name__ == 'ServerSideSessionInterface'
+    app_module.create_app()
+    assert app_module.rate_limiter is not None and app_module._session_interface is None
+
+def test_factory_config_sets_plain_settings(monkeypatch):
+    """Test that the API key and plain settings come from create_app's config when the environment lacks them."""
+    monkeypatch.delenv('NYT_API_KEY', raising=False)
+    monkeypatch.setenv('MAX_COMMENTS_PAGE', '100')
+    client = app_module.create_app({'NYT_API_KEY': 'k', 'MAX_COMMENTS_PAGE': '5', 'RATE_LIMIT_BACKEND': 'off'}).test_client()
+    assert app_module.nyt_cache.api_key_getter() == 'k' and app_module.MAX_COMMENTS_PAGE == 5
+    app_module.article_prefetch.targets = [('cached', '0')]
+    app_module.article_prefetch._pid = os.getpid()  # no prefetch thread
+    app_module.article_prefetch._pages[('cached', '0')] = (b'{"response": {"docs": []}}', datetime.utcnow())
+    response = client.get('/api/articles?q=cached&page=0')
+    assert response.status_code == 200 and response.headers['X-Cache'] == 'PREFETCHED'
+    app_module.create_app()
+    assert app_module.MAX_COMMENTS_PAGE == 100
+
+def test_health_and_readiness(client, mock_db, monkeypatch):
+    """Test that /healthz never touches MongoDB and /readyz reports 503 while it is unreachable."""
+    assert client.get('/healthz').get_json() == {'status': 'ok'}
+    assert client.get('/readyz').get_json() == {'ready': True}
+    assert app_module.warm_up(timeout=1) == {'mongo': 'ok', 'oauth': 'ok'}
+
+    from pymongo.errors import ServerSelectionTimeoutError
+    class Down:
+        class admin:
+            def command(name):
+                raise ServerSelectionTimeoutError('no servers')
+    monkeypatch.setattr(app_module, 'get_mongo_client', lambda: Down)
+    assert client.get('/healthz').status_code == 200
+    response = client.get('/readyz')
+    assert response.status_code == 503 and response.get_json()['mongo'] == 'no servers'
+    assert app_module.warm_up(timeout=1)['mongo'] == 'no servers'
+
+def test_oauth_client_created_once_per_process(monkeypatch):
+    """Test that the OIDC client is created on first use and again in a forked worker."""
+    client = app_module.get_oauth_client()
+    assert app_module.get_oauth_client() is client
+    assert client.name == 'flask_app' and client.client_kwargs == {'scope': 'openid email profile'}
+    monkeypatch.setattr(app_module.os, 'getpid', lambda: -1)
+    assert app_module.get_oauth_client() is not client
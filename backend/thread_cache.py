@@ -0,0 +1,73 @@
+'''
+Assembled comment threads (GET /api/comments/<article>?replies=tree).
+
+Building a nested thread means reading every comment and reply of the page
+and encoding the whole tree. ThreadSnapshots keeps the encoded response body
+per article and query string in process memory, so repeat readers of a busy
+thread get the same bytes back without touching MongoDB.
+
+A snapshot is tied to the article version it was built at (article_stats.
+version, see http_cache.py) and is only served while the article is still at
+that version, so writes handled by other workers are never hidden. Writes in
+this process drop the article's snapshots at once through the event
+listeners. Articles are evicted least recently used first once there are
+more than max_entries of them or their snapshots exceed max_bytes.
+'''
+
+import threading
+from collections import OrderedDict
+
+
+class ThreadSnapshots:
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._articles = OrderedDict()  # article key -> (version, {variant: body})
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'hit': 0, 'miss': 0, 'evicted': 0}
+
+    def get(self, article_key, version, variant):
+        """Encoded body built at version, or None"""
+        with self._lock:
+            entry = self._articles.get(article_key)
+            body = entry[1].get(variant) if entry is not None and entry[0] == version else None
+            if body is None:
+                self.stats['miss'] += 1
+                return None
+            self._articles.move_to_end(article_key)
+            self.stats['hit'] += 1
+            return body
+
+    def put(self, article_key, version, variant, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            entry = self._articles.get(article_key)
+            if entry is None or entry[0] != version:
+                self._drop(article_key)
+                entry = (version, {})
+                self._articles[article_key] = entry
+            previous = entry[1].get(variant)
+            if previous is not None:
+                self._bytes -= len(previous)
+            entry[1][variant] = body
+            self._bytes += len(body)
+            self._articles.move_to_end(article_key)
+            while len(self._articles) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._articles)))
+                self.stats['evicted'] += 1
+
+    def invalidate(self, article_key):
+        with self._lock:
+            self._drop(article_key)
+
+    def clear(self):
+        with self._lock:
+            self._articles.clear()
+            self._bytes = 0
+
+    def _drop(self, article_key):
+        entry = self._articles.pop(article_key, None)
+        if entry is not None:
+            self._bytes -= sum(len(body) for body in entry[1].values())
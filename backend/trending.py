@@ -0,0 +1,99 @@
+'''
+Trending and most-discussed articles (GET /api/trending).
+
+Every comment and reply write also moves a per-article counter for the
+current ACTIVITY_BUCKET_SECONDS slice in article_activity (see
+article_stats.py). A Leaderboard sums those buckets over each window once
+per refresh interval and keeps only the top `size` articles of every window
+in memory, so a read is a slice of a short list no matter how many articles
+exist. Windows are exact to one bucket; 'all' ranks article_stats by its
+running commentCount.
+
+Each worker refreshes its own copy in a background thread, started lazily
+so forked workers get their own. Rankings are at most one interval old.
+'''
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import PyMongoError
+
+from article_stats import activity_bucket
+
+logger = logging.getLogger(__name__)
+
+# Window name -> seconds of activity it covers (None: all time)
+WINDOWS = {'1h': 3600, '24h': 24 * 3600, '7d': 7 * 24 * 3600, 'all': None}
+
+
+class Leaderboard:
+    def __init__(self, db_getter, size=50, refresh_interval=30.0):
+        self.db_getter = db_getter
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self._boards = None  # {window: [{'articleKey', 'articleTitle', 'count'}, ...]}, replaced whole on refresh
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pid = None
+
+    def _window(self, seconds, now):
+        db = self.db_getter()
+        if seconds is None:
+            cursor = db.article_stats.find(
+                {'commentCount': {'$gt': 0}}, {'_id': 0, 'articleKey': 1, 'articleTitle': 1, 'commentCount': 1}
+            ).sort([('commentCount', -1), ('articleTitle', 1)]).limit(self.size)
+            return [{'articleKey': doc.get('articleKey'), 'articleTitle': doc['articleTitle'],
+                     'count': doc['commentCount']} for doc in cursor]
+        pipeline = [
+            {'$match': {'bucket': {'$gte': activity_bucket(now - timedelta(seconds=seconds))}}},
+            {'$group': {'_id': '$articleKey', 'title': {'$last': '$articleTitle'}, 'count': {'$sum': '$count'}}},
+            {'$match': {'count': {'$gt': 0}}},
+            {'$sort': {'count': -1, 'title': 1}},
+            {'$limit': self.size},
+        ]
+        return [{'articleKey': doc['_id'], 'articleTitle': doc['title'], 'count': doc['count']}
+                for doc in db.article_activity.aggregate(pipeline)]
+
+    def refresh(self, now=None):
+        """Recompute every window from the database"""
+        now = now or datetime.now(timezone.utc)
+        boards = {window: self._window(seconds, now) for window, seconds in WINDOWS.items()}
+        self._boards, self._refreshed_at = boards, now
+        return boards
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # The first read waits for a ranking, later ones never touch the database
+            if self._boards is None:
+                self.refresh()
+            self._stop.clear()
+            threading.Thread(target=self._run, name='trending-refresh', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except PyMongoError:
+                logger.exception("trending refresh failed, serving the previous ranking")
+                time.sleep(self.refresh_interval)
+
+    def top(self, window, limit=None):
+        """The ranking for one window (at most size entries) and when it was computed"""
+        if window not in WINDOWS:
+            raise KeyError(window)
+        self._ensure_started()
+        board = self._boards[window]
+        return board[:limit] if limit is not None else list(board), self._refreshed_at
+
+    def close(self):
+        self._stop.set()
+        self._pid = None
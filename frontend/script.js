@@ -88,6 +88,9 @@ async function displayArticles(articles, clearExisting = false) {
         gridContainer.innerHTML = '';
     }
     
+    // Fetch every comment count for this batch in one request
+    const commentCounts = await fetchCommentCounts(articles.map(article => article.headline.main));
+    
     // Add articles to the grid
     for (let i = 0; i < articles.length; i++) {
         const article = articles[i];
@@ -133,6 +136,7 @@ async function displayArticles(articles, clearExisting = false) {
 
         const commentTag = document.createElement('p');
         commentTag.className = "comment-tag";
+        commentTag.dataset.articleTitle = article.headline.main;
         
         const commentIcon = document.createElement('i');
         commentIcon.className = "material-icons";
@@ -142,15 +146,10 @@ async function displayArticles(articles, clearExisting = false) {
         // Initialize commentNumber with a default value
         let commentNumber = 0;
 
-        try {
-            const countResponse = await fetch(`/api/comment-count/${encodeURIComponent(article.headline.main)}`);
-            if (countResponse.ok) {
-                const data = await countResponse.json();
-                commentNumber = data.count;
-                commentTag.appendChild(document.createTextNode(` ${commentNumber}`));
-            }
-        } catch (error) {
-            console.error('Error updating comment count:', error);
+        if (commentCounts) {
+            commentNumber = commentCounts[article.headline.main] || 0;
+            commentTag.appendChild(document.createTextNode(` ${commentNumber}`));
+        } else {
             // Add a default value for errors
             commentTag.appendChild(document.createTextNode(` 0`));
         }
@@ -174,6 +173,26 @@ async function displayArticles(articles, clearExisting = false) {
     }
 }
 
+// Get comment counts for many articles at once, returns null on failure
+async function fetchCommentCounts(titles) {
+    try {
+        const response = await fetch('/api/comment-counts', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ titles })
+        });
+        if (response.ok) {
+            const data = await response.json();
+            return data.counts || {};
+        }
+    } catch (error) {
+        console.error('Error updating comment counts:', error);
+    }
+    return null;
+}
+
 // Check if user has scrolled near the bottom
 // https://stackoverflow.com/questions/6456846/how-to-do-an-infinite-scroll-in-plain-javascript
 function checkScroll() {
@@ -214,7 +233,7 @@ function setupProfileSidebar() {
         mobileProfileButton.addEventListener('click', (e) => {
             e.preventDefault();
             e.stopPropagation();
-            fetch('/api/user')
+            fetch('/api/me')
                 .then(response => response.json())
                 .then(data => {
                     if (data.username) {
@@ -250,6 +269,115 @@ function setupProfileSidebar() {
 // Comment sidebar functionality
 let commentsData = {}; // Store comments for each article
 
+// Live updates for the article open in the sidebar (Server-Sent Events)
+let commentStream = null;
+let commentStreamTitle = null;
+// Set by the stream's hello event: writes from every server worker arrive on it
+let commentStreamShared = false;
+
+// Update the comment count shown on an article in the grid
+function updateArticleCommentCounts(articleTitle, count) {
+    document.querySelectorAll('.comment-tag').forEach(tag => {
+        if (tag.dataset.articleTitle === articleTitle && tag.lastChild) {
+            tag.lastChild.textContent = ` ${count}`;
+        }
+    });
+}
+
+// True when posts and removals on this article will arrive through the event stream.
+// Without a change stream the server only pushes writes handled by the same worker,
+// so the client keeps refetching after its own writes.
+function liveUpdatesActive(articleTitle) {
+    return commentStream !== null && commentStreamTitle === articleTitle &&
+        commentStream.readyState === 1 && // EventSource.OPEN
+        commentStreamShared;
+}
+
+// Subscribe to new comments, replies and moderation changes on one article
+function subscribeToArticle(articleTitle) {
+    unsubscribeFromArticle();
+    if (typeof EventSource === 'undefined') {
+        return null;
+    }
+    commentStream = new EventSource(`/api/comments/${encodeURIComponent(articleTitle)}/events`);
+    commentStreamTitle = articleTitle;
+    commentStream.addEventListener('hello', (message) => {
+        try {
+            commentStreamShared = JSON.parse(message.data).changeStream === true;
+        } catch (error) {
+            commentStreamShared = false;
+        }
+    });
+    commentStream.onmessage = (message) => {
+        try {
+            applyCommentEvent(articleTitle, JSON.parse(message.data));
+        } catch (error) {
+            console.error('Error applying comment event:', error);
+        }
+    };
+    return commentStream;
+}
+
+function unsubscribeFromArticle() {
+    if (commentStream) {
+        commentStream.close();
+    }
+    commentStream = null;
+    commentStreamTitle = null;
+    commentStreamShared = false;
+}
+
+// Apply one pushed delta to the loaded comments and the counts
+function applyCommentEvent(articleTitle, event) {
+    const comments = commentsData[articleTitle] || (commentsData[articleTitle] = []);
+    const findComment = (id) => comments.find(comment => comment._id === id);
+    let countDelta = event.countDelta || 0;
+
+    if (event.type === 'comment') {
+        if (findComment(event.comment._id)) {
+            countDelta = 0; // Already loaded
+        } else {
+            comments.push(event.comment);
+        }
+    } else if (event.type === 'reply') {
+        const comment = findComment(event.commentId);
+        if (comment) {
+            comment.replies = comment.replies || [];
+            if (comment.replies.some(reply => reply._id === event.reply._id)) {
+                countDelta = 0;
+            } else {
+                comment.replies.push(event.reply);
+            }
+        }
+    } else if (event.type === 'update') {
+        let target = null;
+        if (event.target === 'reply') {
+            const comment = findComment(event.commentId);
+            target = comment && (comment.replies || []).find(reply => reply._id === event.id);
+        } else {
+            target = findComment(event.id);
+        }
+        if (target) {
+            if (event.fields.removed_at && target.removed_at) {
+                countDelta = 0;
+            }
+            Object.assign(target, event.fields);
+        }
+    }
+
+    const commentCountElem = document.getElementById('comment-count');
+    const isOpen = document.getElementById('comment-article-title').textContent === articleTitle;
+    if (isOpen) {
+        displayComments(articleTitle);
+    }
+    if (countDelta && isOpen && commentCountElem) {
+        const current = parseInt(commentCountElem.textContent.replace(/[^0-9]/g, ''), 10) || 0;
+        const count = Math.max(0, current + countDelta);
+        commentCountElem.textContent = `(${count})`;
+        updateArticleCommentCounts(articleTitle, count);
+    }
+}
+
 // Open comment sidebar for a specific article
 async function openCommentSidebar(articleTitle, commentCount) {
     const commentSidebar = document.getElementById('comment-sidebar');
@@ -280,6 +408,9 @@ async function openCommentSidebar(articleTitle, commentCount) {
     
     await fetchComments(articleTitle);
 
+    // Keep the thread current without re-polling
+    subscribeToArticle(articleTitle);
+
     setupCommentEventHandlers(articleTitle);
 }
 
@@ -559,18 +690,21 @@ async function submitReply(parentId, text) {
             console.log('Reply added successfully:', result);
               // Refresh comments to show the new reply - always get the current article title
             const currentArticleTitle = document.getElementById('comment-article-title').textContent;
-            await fetchComments(currentArticleTitle);
-            
-            // Update comment count by fetching from the server
-            try {
-                const countResponse = await fetch(`/api/comment-count/${encodeURIComponent(currentArticleTitle)}`);
-                if (countResponse.ok) {
-                    const data = await countResponse.json();
-                    const commentCountElem = document.getElementById('comment-count');
-                    commentCountElem.textContent = `(${data.count})`;
+            // With live updates the reply and its count arrive through the event stream
+            if (!liveUpdatesActive(currentArticleTitle)) {
+                await fetchComments(currentArticleTitle);
+                
+                // Update comment count by fetching from the server
+                try {
+                    const countResponse = await fetch(`/api/comment-count/${encodeURIComponent(currentArticleTitle)}`);
+                    if (countResponse.ok) {
+                        const data = await countResponse.json();
+                        const commentCountElem = document.getElementById('comment-count');
+                        commentCountElem.textContent = `(${data.count})`;
+                    }
+                } catch (error) {
+                    console.error('Error updating comment count:', error);
                 }
-            } catch (error) {
-                console.error('Error updating comment count:', error);
             }
             
             // Hide the reply form
@@ -611,7 +745,10 @@ async function submitNestedReply(parentCommentId, replyId, text) {
         if (response.ok) {
             // Refresh comments to show the new nested reply
             const currentArticleTitle = document.getElementById('comment-article-title').textContent;
-            await fetchComments(currentArticleTitle);
+            const live = liveUpdatesActive(currentArticleTitle);
+            if (!live) {
+                await fetchComments(currentArticleTitle);
+            }
             
             // Hide the reply form
             const replyForm = document.getElementById(`reply-form-${replyId}`);
@@ -620,18 +757,20 @@ async function submitNestedReply(parentCommentId, replyId, text) {
             }
             
             // Update comment count
-            try {
-                const countResponse = await fetch(`/api/comment-count/${encodeURIComponent(currentArticleTitle)}`);
-                if (countResponse.ok) {
-                    const data = await countResponse.json();
-                    const commentCountElem = document.getElementById('comment-count');
-                    commentCountElem.textContent = `(${data.count})`;
-                    
-                    // Also update article grid count
-                    updateArticleCommentCounts(currentArticleTitle, data.count);
+            if (!live) {
+                try {
+                    const countResponse = await fetch(`/api/comment-count/${encodeURIComponent(currentArticleTitle)}`);
+                    if (countResponse.ok) {
+                        const data = await countResponse.json();
+                        const commentCountElem = document.getElementById('comment-count');
+                        commentCountElem.textContent = `(${data.count})`;
+                        
+                        // Also update article grid count
+                        updateArticleCommentCounts(currentArticleTitle, data.count);
+                    }
+                } catch (error) {
+                    console.error('Error updating comment count:', error);
                 }
-            } catch (error) {
-                console.error('Error updating comment count:', error);
             }
         } else {
             if (response.status === 401) {
@@ -664,6 +803,7 @@ function setupCommentEventHandlers(articleTitle) {
     // Close button event
     closeButton.addEventListener('click', () => {
         commentSidebar.style.display = 'none';
+        unsubscribeFromArticle();
     });
     
     // Show/hide buttons based on textarea content
@@ -720,18 +860,21 @@ async function submitComment(articleTitle, text) {
             console.log('Comment added successfully:', result);
               // Refresh comments - this will update the comment list
             const currentArticleTitle = document.getElementById('comment-article-title').textContent;
-            await fetchComments(currentArticleTitle);
-            
-            // Update comment count by fetching from the server
-            try {
-                const countResponse = await fetch(`/api/comment-count/${encodeURIComponent(currentArticleTitle)}`);
-                if (countResponse.ok) {
-                    const data = await countResponse.json();
-                    const commentCountElem = document.getElementById('comment-count');
-                    commentCountElem.textContent = `(${data.count})`;
+            // With live updates the comment and its count arrive through the event stream
+            if (!liveUpdatesActive(currentArticleTitle)) {
+                await fetchComments(currentArticleTitle);
+                
+                // Update comment count by fetching from the server
+                try {
+                    const countResponse = await fetch(`/api/comment-count/${encodeURIComponent(currentArticleTitle)}`);
+                    if (countResponse.ok) {
+                        const data = await countResponse.json();
+                        const commentCountElem = document.getElementById('comment-count');
+                        commentCountElem.textContent = `(${data.count})`;
+                    }
+                } catch (error) {
+                    console.error('Error updating comment count:', error);
                 }
-            } catch (error) {
-                console.error('Error updating comment count:', error);
             }
         } else {
             if (response.status === 401) {
@@ -773,21 +916,24 @@ async function deleteComment(commentId) {
             
             const currentArticleTitle = document.getElementById('comment-article-title').textContent;
             
-            await fetchComments(currentArticleTitle);
-            
-            // Update comment count in sidebar
-            try {
-                const countResponse = await fetch(`/api/comment-count/${encodeURIComponent(currentArticleTitle)}`);
-                if (countResponse.ok) {
-                    const data = await countResponse.json();
-                    const commentCountElem = document.getElementById('comment-count');
-                    commentCountElem.textContent = `(${data.count})`;
-                    
-                    // Also update article grid count
-                    updateArticleCommentCounts(currentArticleTitle, data.count);
+            // With live updates the removal and the new count arrive through the event stream
+            if (!liveUpdatesActive(currentArticleTitle)) {
+                await fetchComments(currentArticleTitle);
+                
+                // Update comment count in sidebar
+                try {
+                    const countResponse = await fetch(`/api/comment-count/${encodeURIComponent(currentArticleTitle)}`);
+                    if (countResponse.ok) {
+                        const data = await countResponse.json();
+                        const commentCountElem = document.getElementById('comment-count');
+                        commentCountElem.textContent = `(${data.count})`;
+                        
+                        // Also update article grid count
+                        updateArticleCommentCounts(currentArticleTitle, data.count);
+                    }
+                } catch (error) {
+                    console.error('Error updating comment count:', error);
                 }
-            } catch (error) {
-                console.error('Error updating comment count:', error);
             }
             
             return { success: true };
@@ -1053,7 +1199,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const profileEmail = document.getElementById('profile-email');
     const mobileProfileButton = document.getElementById('mobile-profile-button');
     
-    fetch('/api/user')
+    fetch('/api/me')
         .then(response => response.json())
         .then(data => {
             console.log("User data received:", data);
@@ -1072,32 +1218,20 @@ document.addEventListener('DOMContentLoaded', () => {
                     mobileProfileButton.title = `Signed in as ${data.username}`;
                 }
 
-                if (isUserModerator && profileUsername) {
-                    profileUsername.textContent = data.username + " (Moderator)";
-                    console.log("Updated profile username with moderator status");
+                // /api/me already includes the profile details, no second request needed
+                if (profileUsername) {
+                    profileUsername.textContent = isUserModerator
+                        ? data.username + " (Moderator)"
+                        : data.username || 'User';
                 }
                 
-                // Get full user details for the profile sidebar
-                fetch('/api/user-details')
-                    .then(response => response.json())
-                    .then(userData => {
-                        if (profileUsername) {
-                            profileUsername.textContent = userData.username || 'User';
-                        }
-                        
-                        if (profileEmail) {
-                            if (userData.email) {
-                                profileEmail.textContent = userData.email;
-                            } else {
-                                profileEmail.textContent = 'No email provided';
-                            }
-                        }
-                    })
-                    .catch(error => {
-                        if (profileUsername) profileUsername.textContent = data.username || 'User';
-                        if (profileEmail) profileEmail.textContent = 'Email not available';
-                        console.error('Error fetching user details:', error);
-                    });
+                if (profileEmail) {
+                    if (data.email) {
+                        profileEmail.textContent = data.email;
+                    } else {
+                        profileEmail.textContent = 'No email provided';
+                    }
+                }
             }
         })
         .catch(error => console.error('Error fetching user info:', error));
@@ -1108,6 +1242,7 @@ if (typeof module !== 'undefined' && module.exports) {
     estimateReadTime,
     fetchNYTData,
     displayArticles,
+    fetchCommentCounts,
     checkScroll,
     openCommentSidebar,
     setupCommentEventHandlers,
@@ -1120,6 +1255,10 @@ if (typeof module !== 'undefined' && module.exports) {
     deleteReply,
     redactReply,
     createCommentElement,
-    displayComments
+    displayComments,
+    subscribeToArticle,
+    liveUpdatesActive,
+    applyCommentEvent,
+    updateArticleCommentCounts
   };
 }
\ No newline at end of file
@@ -142,10 +142,10 @@ describe('NYT Frontend Tests', () => {
             }
           })
         });
-      } else if (url.includes('/api/comment-count/')) {
+      } else if (url === '/api/comment-counts') {
         return Promise.resolve({
           ok: true,
-          json: () => Promise.resolve({count: 5})
+          json: () => Promise.resolve({counts: {'Test Article': 5}})
         });
       }
       return Promise.resolve({ok: false});
@@ -309,20 +309,27 @@ describe('NYT Frontend Tests', () => {
     ];
     
     fetch.mockImplementation((url) => {
-      if (url.includes('/api/comment-count/')) {
+      if (url === '/api/comment-counts') {
         return Promise.resolve({
           ok: true,
-          json: () => Promise.resolve({count: 3})
+          json: () => Promise.resolve({counts: {'First Article': 3, 'Second Article': 3}})
         });
       }
       return Promise.resolve({ok: false});
     });
+    fetch.mockClear();
     
     await script.displayArticles(testArticles, true);
     
+    // All counts for the batch come from a single request
+    const countCalls = fetch.mock.calls.filter(call => call[0] === '/api/comment-counts');
+    expect(countCalls.length).toBe(1);
+    expect(JSON.parse(countCalls[0][1].body).titles).toEqual(['First Article', 'Second Article']);
+    
     const gridContainer = document.querySelector('.grid-container');
     expect(gridContainer.children.length).toBe(2);
     expect(gridContainer.children[0].querySelector('.news-title').textContent).toBe('First Article');
+    expect(gridContainer.children[0].querySelector('.comment-tag').textContent).toContain('3');
     expect(gridContainer.children[1].querySelector('.news-title').textContent).toBe('Second Article');
     
     // Test adding more articles without clearing
@@ -527,7 +534,7 @@ describe('NYT Frontend Tests', () => {
     
     // Mock fetch for logged in user
     fetch.mockImplementationOnce((url) => {
-      if (url === '/api/user') {
+      if (url === '/api/me') {
         return Promise.resolve({
           ok: true,
           json: () => Promise.resolve({
@@ -696,6 +703,75 @@ describe('NYT Frontend Tests', () => {
   });
 });
 
+describe('Live comment events', () => {
+  test('applyCommentEvent adds pushed comments and replies and moves the count', () => {
+    const title = document.getElementById('comment-article-title').textContent;
+    const countElem = document.getElementById('comment-count');
+    countElem.textContent = '(2)';
+
+    script.applyCommentEvent(title, {
+      type: 'comment',
+      comment: { _id: 'live1', username: 'alice', text: 'Pushed', replies: [] },
+      countDelta: 1
+    });
+    script.applyCommentEvent(title, {
+      type: 'reply',
+      commentId: 'live1',
+      reply: { _id: 'live2', username: 'bob', text: 'Pushed reply' },
+      countDelta: 1
+    });
+
+    expect(document.querySelector('.comment[data-id="live1"]')).not.toBeNull();
+    expect(countElem.textContent).toBe('(4)');
+
+    // A repeated event (e.g. after a reconnect) changes nothing
+    script.applyCommentEvent(title, {
+      type: 'comment',
+      comment: { _id: 'live1', username: 'alice', text: 'Pushed', replies: [] },
+      countDelta: 1
+    });
+    expect(countElem.textContent).toBe('(4)');
+
+    script.applyCommentEvent(title, {
+      type: 'update',
+      target: 'comment',
+      id: 'live1',
+      fields: { text: '[Comment removed by a moderator]', removed_at: '2024-01-01T00:00:00' },
+      countDelta: -1
+    });
+    expect(document.querySelector('.comment[data-id="live1"] .comment-text').textContent)
+      .toBe('[Comment removed by a moderator]');
+    expect(countElem.textContent).toBe('(3)');
+  });
+
+  test('subscribeToArticle is a no-op without EventSource', () => {
+    expect(script.subscribeToArticle('Test Article')).toBeNull();
+  });
+
+  test('live updates replace refetching only when the server watches the change stream', () => {
+    const listeners = {};
+    global.EventSource = jest.fn(() => ({
+      readyState: 1,
+      close: jest.fn(),
+      addEventListener: (type, listener) => { listeners[type] = listener; }
+    }));
+    try {
+      script.subscribeToArticle('Test Article');
+      expect(script.liveUpdatesActive('Test Article')).toBe(false);
+
+      listeners.hello({ data: '{"changeStream": false}' });
+      expect(script.liveUpdatesActive('Test Article')).toBe(false);
+
+      listeners.hello({ data: '{"changeStream": true}' });
+      expect(script.liveUpdatesActive('Test Article')).toBe(true);
+      expect(script.liveUpdatesActive('Other Article')).toBe(false);
+    } finally {
+      delete global.EventSource;
+      script.subscribeToArticle('Test Article'); // closes the stream
+    }
+  });
+});
+
 // Clean up any unresolved promises
 afterEach(async () => {
   await new Promise(resolve => setTimeout(resolve, 50));
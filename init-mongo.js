@@ -16,5 +16,21 @@ db = db.getSiblingDB('nyt_comments_db');  // Switch to the 'nyt_comments_db' dat
 // Create comments collection
 db.createCollection('comments');
 
+// Replies are stored one document each, linked to their comment
+db.createCollection('replies');
+
 // Create article_stats collection for tracking comment counts
-db.createCollection('article_stats');
\ No newline at end of file
+db.createCollection('article_stats');
+// Indexes for the hot comment queries (the backend also ensures these at startup)
+db.comments.createIndex({ articleKey: 1, timestamp: 1 }, { name: 'articleKey_timestamp' });
+db.replies.createIndex({ comment_id: 1, timestamp: 1 }, { name: 'comment_id_timestamp' });
+db.replies.createIndex({ comment_id: 1, ancestors: 1 }, { name: 'comment_id_ancestors' });
+db.article_stats.createIndex({ articleKey: 1 }, { name: 'articleKey_unique', unique: true });
+// Text indexes for comment search
+db.comments.createIndex({ text: 'text' }, { name: 'text_search' });
+db.replies.createIndex({ text: 'text' }, { name: 'text_search' });
+// Per-article activity buckets for the trending leaderboard, kept for 8 days
+db.createCollection('article_activity');
+db.article_activity.createIndex({ articleKey: 1, bucket: 1 }, { name: 'articleKey_bucket_unique', unique: true });
+db.article_activity.createIndex({ bucket: 1 }, { name: 'bucket_ttl', expireAfterSeconds: 691200 });
+db.article_stats.createIndex({ commentCount: -1 }, { name: 'commentCount' });